@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 import random
 from PIL import Image, ImageEnhance
@@ -8,18 +7,28 @@ class ImageAugmentor:
     def __init__(self, probability=0.5):
         self.prob = probability
 
-    def process(self, pil_image: Image.Image) -> Image.Image:
+    def process(self, pil_image: Image.Image, points=None):
+        """
+        Аугментирует картинку. Если переданы points (список [x, y] в координатах исходной картинки),
+        они проходят через те же геометрические преобразования и возвращаются вторыми: (картинка, точки).
+        """
+        # cv2 грузится долго, поэтому импортируем при первой аугментации, а не при импорте модуля
+        import cv2
+
+        track = points is not None
+        points = np.asarray(points if track else np.zeros((0, 2)), dtype=np.float64).reshape(-1, 2)
+
         # 1. Повороты на 90/180/270 градусов (Критично для сканера!)
         # Это применяем с вероятностью 70%, так как люди редко кладут идеально ровно
         if random.random() < 0.7:
-            pil_image = self._apply_random_rotation_90(pil_image)
+            pil_image, points = self._apply_random_rotation_90(pil_image, points)
 
         # Конвертация в OpenCV для геометрии
         cv_img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
 
         # 2. Легкий перекос (Skew) - бумага легла чуть криво
         if random.random() < self.prob:
-            cv_img = self._apply_slight_skew(cv_img)
+            cv_img, points = self._apply_slight_skew(cv_img, points)
 
         # 3. Шум сканера (зернистость на высоких DPI)
         if random.random() < self.prob:
@@ -36,21 +45,32 @@ class ImageAugmentor:
         if random.random() < 0.1:  # Редко, но бывает
             pil_image = self._apply_binarization_look(pil_image)
 
-        return pil_image
+        return (pil_image, points.tolist()) if track else pil_image
 
-    def _apply_random_rotation_90(self, img):
+    def _apply_random_rotation_90(self, img, points):
         """Сканер может выдать картинку в любой ориентации"""
         angle = random.choice([0, 90, 180, 270])
-        if angle == 0: return img
-        return img.rotate(angle, expand=True)
+        if angle == 0: return img, points
+        w, h = img.size
+        x, y = points[:, 0], points[:, 1]
+        # Image.rotate крутит против часовой, expand=True сдвигает результат в начало координат
+        if angle == 90:
+            points = np.stack([y, w - x], axis=1)
+        elif angle == 180:
+            points = np.stack([w - x, h - y], axis=1)
+        else:
+            points = np.stack([h - y, x], axis=1)
+        return img.rotate(angle, expand=True), points
 
-    def _apply_slight_skew(self, img):
+    def _apply_slight_skew(self, img, points):
         """Поворот на +/- 1-3 градуса"""
+        import cv2
         h, w = img.shape[:2]
         angle = random.uniform(-2.5, 2.5)  # Небольшой угол
         M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        points = points @ M[:, :2].T + M[:, 2]
         # Заливаем края белым (сканер дает белый фон), а не черным
-        return cv2.warpAffine(img, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+        return cv2.warpAffine(img, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255)), points
 
     def _apply_scanner_noise(self, img):
         """Легкий цифровой шум CCD-матрицы"""
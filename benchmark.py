@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import glob
+import tempfile
+import platform
+import argparse
+import itertools
+import subprocess
+from datetime import datetime
+import numpy as np
+import torch
+from PIL import Image
+from transformers import (VisionEncoderDecoderModel, VisionEncoderDecoderConfig, DonutSwinConfig, MBartConfig,
+                          DonutImageProcessor, StoppingCriteriaList)
+from transformers.modeling_outputs import BaseModelOutput
+from ocr_engine import OCREngine, DOCUMENT_TYPES
+from image_pipeline import load_image
+
+# Размер входа, как при обучении (train_donut.IMAGE_SIZE)
+IMAGE_SIZE = (1280, 960)
+
+# Архитектуры для случайно инициализированной модели: tiny - быстрый прогон для проверки,
+# base - размеры naver-clova-ix/donut-base без скачивания весов
+RANDOM_CONFIGS = {
+    "tiny": {
+        "encoder": {"embed_dim": 32, "depths": [1, 1, 1, 1], "num_heads": [1, 2, 4, 8]},
+        "decoder": {"d_model": 64, "decoder_layers": 2, "decoder_attention_heads": 4, "decoder_ffn_dim": 256,
+                    "vocab_size": 1024},
+    },
+    "base": {
+        "encoder": {"embed_dim": 128, "depths": [2, 2, 14, 2], "num_heads": [4, 8, 16, 32]},
+        "decoder": {"d_model": 1024, "decoder_layers": 4, "decoder_attention_heads": 16, "decoder_ffn_dim": 4096,
+                    "vocab_size": 57525},
+    },
+}
+
+# Служебные токены MBart по умолчанию; промптом служит первый свободный id
+RANDOM_PAD_ID, RANDOM_EOS_ID, RANDOM_PROMPT_ID = 1, 2, 3
+
+
+class BenchTarget:
+    """
+    Что замеряем. Обученная модель идет через OCREngine (engine + doc_type): тот же препроцессинг с draft(),
+    энкодер и аргументы generate (запрет <unk>, repetition, остановка по схеме), что у test_ocr.py
+    и evaluate_models.py. Случайная модель (engine=None) - голый generate с промптом и служебными токенами.
+    """
+
+    def __init__(self, model, image_processor, prompt_ids, pad_token_id, eos_token_id, backend, model_path=None,
+                 engine=None, doc_type=None):
+        self.model = model
+        self.image_processor = image_processor
+        self.prompt_ids = prompt_ids
+        self.pad_token_id = pad_token_id
+        self.eos_token_id = eos_token_id
+        self.backend = backend
+        self.model_path = model_path
+        self.engine = engine
+        self.doc_type = doc_type
+
+    def set_threads(self, threads):
+        torch.set_num_threads(threads)
+        if self.backend == "onnx":
+            # У ONNX Runtime число потоков задается при создании сессии
+            from onnx_backend import OnnxDonutModel
+            self.model = OnnxDonutModel(self.model_path, num_threads=threads)
+            self.engine.get(self.doc_type).model = self.model
+
+
+def build_random_model(size="tiny", image_size=IMAGE_SIZE, max_length=768):
+    """Donut со случайными весами: латентность зависит от архитектуры, а не от значений весов"""
+    spec = RANDOM_CONFIGS[size]
+    encoder_config = DonutSwinConfig(image_size=list(image_size), patch_size=4, window_size=10, **spec["encoder"])
+    decoder_config = MBartConfig(is_decoder=True, add_cross_attention=True, max_position_embeddings=max_length + 2,
+                                 scale_embedding=True, **spec["decoder"])
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder_config, decoder_config)
+    config.pad_token_id = RANDOM_PAD_ID
+    config.eos_token_id = RANDOM_EOS_ID
+    config.decoder_start_token_id = RANDOM_PROMPT_ID
+    model = VisionEncoderDecoderModel(config=config)
+    model.eval()
+    return model
+
+
+def load_target(doc_type="passport", backend="torch", quantized=False, random_init=None, schema_stopping=False):
+    if random_init:
+        model = build_random_model(random_init)
+        if quantized:
+            from quantize_model import quantize_model
+            model = quantize_model(model)
+        image_processor = DonutImageProcessor(size={"height": IMAGE_SIZE[0], "width": IMAGE_SIZE[1]})
+        prompt_ids = torch.tensor([[RANDOM_PROMPT_ID]], dtype=torch.long)
+        return BenchTarget(model, image_processor, prompt_ids, RANDOM_PAD_ID, RANDOM_EOS_ID, "torch")
+
+    engine = OCREngine(device="cpu", quantized=quantized, backend=backend, schema_stopping=schema_stopping)
+    loaded = engine.get(doc_type)
+    tokenizer = loaded.processor.tokenizer
+    return BenchTarget(loaded.model, loaded.processor.image_processor, loaded.prompt_ids.cpu(),
+                       tokenizer.pad_token_id, tokenizer.eos_token_id, backend, engine.document_types[doc_type][0],
+                       engine=engine, doc_type=doc_type)
+
+
+def cold_start(target_kwargs, repeats=3):
+    """
+    Холодный старт в чистом интерпретаторе: импорт torch/transformers/движка и загрузка модели.
+    В текущем процессе все уже импортировано, поэтому меряем в подпроцессе.
+    """
+    probe = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "import benchmark\n"
+        "imported = time.perf_counter()\n"
+        "benchmark.load_target(**json.loads(sys.argv[1]))\n"
+        "loaded = time.perf_counter()\n"
+        "print(json.dumps({'import_s': imported - started, 'load_s': loaded - imported}))\n"
+    )
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", probe, json.dumps(target_kwargs)], check=True,
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {
+        "import_s": float(np.median([r["import_s"] for r in runs])),
+        "load_s": float(np.median([r["load_s"] for r in runs])),
+        "repeats": repeats,
+    }
+
+
+def prepare_images(images_glob=None, dataset_path=None, count=8, image_size=IMAGE_SIZE):
+    """
+    Пути к картинкам для замеров: по шаблону, из валидационного датасета или синтетические JPEG
+    (шум нужного размера), чтобы в препроцессинг честно входило декодирование файла.
+    """
+    if images_glob:
+        paths = sorted(p for p in glob.glob(images_glob, recursive=True) if os.path.isfile(p))
+    elif dataset_path and os.path.exists(os.path.join(dataset_path, "metadata.jsonl")):
+        with open(os.path.join(dataset_path, "metadata.jsonl"), "r", encoding="utf-8") as f:
+            paths = [os.path.join(dataset_path, json.loads(line)["file_name"]) for line in f]
+    else:
+        paths = []
+    if paths:
+        return paths[:count]
+
+    tmp_dir = tempfile.mkdtemp(prefix="donut_bench_")
+    rng = np.random.RandomState(0)
+    height, width = image_size
+    for i in range(count):
+        pixels = rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        path = os.path.join(tmp_dir, f"synthetic_{i}.jpg")
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def _percentiles(values_ms):
+    return {
+        "p50": float(np.percentile(values_ms, 50)),
+        "p95": float(np.percentile(values_ms, 95)),
+        "p99": float(np.percentile(values_ms, 99)),
+        "mean": float(np.mean(values_ms)),
+    }
+
+
+def _decode_kwargs(target, batch_size, num_beams, fixed_tokens):
+    prompt_len = target.prompt_ids.shape[1]
+    kwargs = {"num_beams": num_beams}
+    if fixed_tokens:
+        # Фиксированное число шагов декодера: сравнимо между коммитами и для случайных весов.
+        # Остановка по схеме оборвала бы декодирование раньше, поэтому здесь она отключается
+        kwargs.update(max_length=prompt_len + fixed_tokens, min_length=prompt_len + fixed_tokens,
+                      stopping_criteria=StoppingCriteriaList())
+    if target.engine is not None:
+        return target.engine.decode_kwargs(target.engine.get(target.doc_type), batch_size, **kwargs)
+    return dict(
+        decoder_input_ids=target.prompt_ids.repeat(batch_size, 1),
+        pad_token_id=target.pad_token_id,
+        eos_token_id=target.eos_token_id,
+        use_cache=True,
+        return_dict_in_generate=True,
+        **dict({"max_length": 768}, **kwargs)
+    )
+
+
+def run_once(target, paths, num_beams, fixed_tokens=None):
+    """Одна пачка: препроцессинг, энкодер и декодер по отдельности, время в мс"""
+    started = time.perf_counter()
+    if target.engine is not None:
+        pixel_values = target.engine.preprocess(paths, target.doc_type)
+    else:
+        # Как processor_draft_size: меньшая сторона должна покрыть меньшую сторону входа модели
+        images = [load_image(path, min(IMAGE_SIZE)) for path in paths]
+        pixel_values = target.image_processor(images, return_tensors="pt").pixel_values
+    preprocessed = time.perf_counter()
+
+    with torch.no_grad():
+        if target.engine is not None:
+            hidden = target.engine.encode(pixel_values, target.doc_type)
+        else:
+            hidden = target.model.encoder(pixel_values).last_hidden_state
+        encoded = time.perf_counter()
+
+        kwargs = _decode_kwargs(target, len(paths), num_beams, fixed_tokens)
+        outputs = target.model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=hidden), **kwargs)
+    decoded = time.perf_counter()
+    prompt_len = target.prompt_ids.shape[1]
+
+    return {
+        "preprocess_ms": (preprocessed - started) * 1000,
+        "encoder_ms": (encoded - preprocessed) * 1000,
+        "decoder_ms": (decoded - encoded) * 1000,
+        "total_ms": (decoded - started) * 1000,
+        "generated_tokens": int(outputs.sequences.shape[1] - prompt_len),
+    }
+
+
+def benchmark(target, paths, batch_sizes, beams, threads, iterations=10, warmup=1, fixed_tokens=None):
+    results = []
+    for thread_count, batch_size, num_beams in itertools.product(threads, batch_sizes, beams):
+        target.set_threads(thread_count)
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths) - batch_size + 1, batch_size)]
+        if not batches:
+            print(f"⚠️ Картинок меньше, чем batch_size={batch_size}, конфигурация пропущена")
+            continue
+
+        for i in range(warmup):
+            run_once(target, batches[i % len(batches)], num_beams, fixed_tokens)
+        runs = [run_once(target, batches[i % len(batches)], num_beams, fixed_tokens) for i in range(iterations)]
+
+        total_seconds = sum(r["total_ms"] for r in runs) / 1000
+        row = {
+            "threads": thread_count,
+            "batch_size": batch_size,
+            "num_beams": num_beams,
+            "iterations": iterations,
+            "throughput_img_s": batch_size * iterations / total_seconds,
+            "generated_tokens": float(np.mean([r["generated_tokens"] for r in runs])),
+        }
+        for stage in ("preprocess_ms", "encoder_ms", "decoder_ms", "total_ms"):
+            row[stage] = _percentiles([r[stage] for r in runs])
+        results.append(row)
+        print(f"   threads={thread_count} batch={batch_size} beams={num_beams}: "
+              f"p50 {row['total_ms']['p50']:.0f} мс, p95 {row['total_ms']['p95']:.0f} мс, "
+              f"{row['throughput_img_s']:.2f} картинок/с")
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(baseline_path, report):
+    """Сравнение с отчетом другого коммита по совпадающим конфигурациям (p50 и p95 полного пути)"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(row):
+        return row["threads"], row["batch_size"], row["num_beams"]
+
+    old_rows = {key(row): row for row in baseline["results"]}
+    print("\n" + "=" * 80)
+    print(f"📊 СРАВНЕНИЕ С {baseline['meta'].get('commit')} ({baseline_path})")
+    print("=" * 80)
+    print(f"{'threads/batch/beams':<22}{'p50 было':>12}{'p50 стало':>12}{'p95 было':>12}{'p95 стало':>12}{'Δ p50':>10}")
+    for row in report["results"]:
+        old = old_rows.get(key(row))
+        if old is None:
+            continue
+        old_p50, new_p50 = old["total_ms"]["p50"], row["total_ms"]["p50"]
+        print(f"{'/'.join(map(str, key(row))):<22}{old_p50:>12.0f}{new_p50:>12.0f}"
+              f"{old['total_ms']['p95']:>12.0f}{row['total_ms']['p95']:>12.0f}{(new_p50 / old_p50 - 1):>10.1%}")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк латентности распознавания на CPU")
+    parser.add_argument('--type', type=str, choices=list(DOCUMENT_TYPES), default="passport")
+    parser.add_argument('--backend', type=str, choices=["torch", "onnx"], default="torch")
+    parser.add_argument('--int8', action='store_true', help='Замерять int8-квантованную модель')
+    parser.add_argument('--schema-stop', action='store_true',
+                        help='Остановка генерации по схеме полей, как в test_ocr.py --schema-stop')
+    parser.add_argument('--random-init', type=str, choices=list(RANDOM_CONFIGS), default=None,
+                        help='Случайно инициализированный Donut вместо обученной модели')
+    parser.add_argument('--images', type=str, default=None,
+                        help='Glob-шаблон картинок (по умолчанию валидация, иначе синтетика)')
+    parser.add_argument('--num-images', type=int, default=8)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--beams', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--fixed-tokens', type=int, default=None,
+                        help='Декодировать ровно столько токенов (по умолчанию так для --random-init)')
+    parser.add_argument('--cold-start-repeats', type=int, default=3, help='0 - не мерить холодный старт')
+    parser.add_argument('--out', type=str, default=None, help='Куда сохранить JSON-отчет')
+    parser.add_argument('--compare', type=str, default=None, help='JSON-отчет другого коммита для сравнения')
+    args = parser.parse_args()
+
+    if args.random_init and args.backend == "onnx":
+        parser.error("--random-init поддерживается только для --backend torch")
+    if args.random_init and args.schema_stop:
+        parser.error("--schema-stop нужна схема обученной модели, с --random-init не поддерживается")
+    fixed_tokens = args.fixed_tokens or (64 if args.random_init else None)
+    target_kwargs = {"doc_type": args.type, "backend": args.backend, "quantized": args.int8,
+                     "random_init": args.random_init, "schema_stopping": args.schema_stop}
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "cpu": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "model": f"random-{args.random_init}" if args.random_init else DOCUMENT_TYPES[args.type][0],
+            "backend": args.backend,
+            "int8": args.int8,
+            "schema_stop": args.schema_stop,
+            "fixed_tokens": fixed_tokens,
+        },
+    }
+
+    if args.cold_start_repeats:
+        print("🧊 Холодный старт...")
+        report["cold_start"] = cold_start(target_kwargs, args.cold_start_repeats)
+        print(f"   импорт {report['cold_start']['import_s']:.2f} с, загрузка модели {report['cold_start']['load_s']:.2f} с")
+
+    target = load_target(**target_kwargs)
+    paths = prepare_images(args.images, f"dataset/val_{args.type}", args.num_images)
+    print(f"⏱️ Замеры на {len(paths)} картинках...")
+    report["results"] = benchmark(target, paths, args.batch_sizes, args.beams, args.threads,
+                                  args.iterations, args.warmup, fixed_tokens)
+
+    suffix = f"random_{args.random_init}" if args.random_init else args.type
+    backend = "int8" if args.int8 else args.backend
+    out_path = args.out or os.path.join("reports", f"benchmark_{suffix}_{backend}_{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 Отчет сохранен в {out_path}")
+
+    if args.compare:
+        compare_reports(args.compare, report)
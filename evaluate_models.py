@@ -1,22 +1,56 @@
 import os
+import sys
 import json
-import torch
+import time
+import hashlib
 import argparse
-import re
-from PIL import Image
-from transformers import DonutProcessor, VisionEncoderDecoderModel
-from jiwer import cer
+import itertools
+from collections import OrderedDict
+from ocr_utils import score_sample, MetricsAccumulator
+from ocr_engine import OCREngine, EVAL_GENERATION
+from image_pipeline import prefetch_batches
+from warm_worker import add_warm_argument, maybe_run_warm
 
 
-def evaluate(model_path, dataset_path, task_prompt):
-    print(f"⏳ Загрузка модели из {model_path}...")
-    processor = DonutProcessor.from_pretrained(model_path)
-    model = VisionEncoderDecoderModel.from_pretrained(model_path)
+def load_report(report_path):
+    """
+    Читает отчет для продолжения после прерывания: (заголовок, уже посчитанные записи).
+    Заголовок - первая строка с моделью и настройками, которыми считались записи (None у старых отчетов).
+    """
+    header, records = None, {}
+    if not os.path.exists(report_path):
+        return header, records
+    with open(report_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при падении - ее просто пересчитаем
+                continue
+            if "report_header" in record:
+                header = record["report_header"]
+            else:
+                records[record["file_name"]] = record
+    return header, records
+
+
+def report_header(engine, doc_type):
+    """Что определяет ответы модели: продолжать отчет можно только при полном совпадении"""
+    model_path = engine.document_types[doc_type][0]
+    return {
+        "model": model_path,
+        "revision": model_revision(model_path, engine.backend),
+        "backend": engine.backend,
+        "generation": engine.generation_kwargs,
+        "schema_stop": engine.schema_stopping,
+        "auto_orient": engine.auto_orient,
+    }
+
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"⚡ Устройство: {device}")
-    model.to(device)
-    model.eval()
+def evaluate(doc_type, dataset_path, batch_size=1, workers=2, full_run=False, report_path=None, engine=None,
+             resume=True):
+    engine = engine or OCREngine(generation_kwargs=EVAL_GENERATION)
+    processor = engine.get(doc_type).processor
 
     metadata_file = os.path.join(dataset_path, "metadata.jsonl")
     if not os.path.exists(metadata_file):
@@ -25,105 +59,427 @@ def evaluate(model_path, dataset_path, task_prompt):
     with open(metadata_file, "r", encoding="utf-8") as f:
         metadata = [json.loads(line) for line in f]
 
-    total_cer = 0.0
-    exact_matches = 0
+    metrics = MetricsAccumulator()
     total_images = len(metadata)
 
-    print(f"🚀 Начинаем валидацию {total_images} изображений...")
+    # В полном режиме каждая запись сразу дописывается в JSONL-отчет, уже посчитанные пропускаем
+    report = None
+    if full_run:
+        header = report_header(engine, doc_type)
+        stored_header, done = load_report(report_path) if resume else (None, {})
+        if done and stored_header != header:
+            # Записи другой модели (или без заголовка - неизвестно какой) нельзя смешивать с новыми в одной сводке
+            raise ValueError(f"Отчет {report_path} посчитан другой моделью или с другими настройками "
+                             f"({(stored_header or {}).get('model', 'неизвестно')}, ревизия "
+                             f"{(stored_header or {}).get('revision', '?')}). Укажите другой --report или удалите его.")
+        if done:
+            print(f"🔄 В отчете {report_path} уже {len(done)} записей. Продолжаем с места остановки.")
+        for record in done.values():
+            metrics.add(record)
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        # Переписываем отчет начисто, чтобы выкинуть оборванную строку
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"report_header": header}, ensure_ascii=False) + "\n")
+            for record in done.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        report = open(report_path, "a", encoding="utf-8")
+        pending = [(idx, item) for idx, item in enumerate(metadata) if item["file_name"] not in done]
+    else:
+        pending = list(enumerate(metadata))
 
-    for idx, item in enumerate(metadata):
-        image_path = os.path.join(dataset_path, item["file_name"])
+    print(f"🚀 Начинаем валидацию {len(pending)} из {total_images} изображений (батч {batch_size})...")
 
-        # Достаем идеальный словарь из твоей метадаты
-        ground_truth_dict = json.loads(item["ground_truth"])["gt_parse"]
+    # Время генерации считаем только для картинок этого запуска
+    generate_seconds = 0.0
+    generated_images = 0
 
-        try:
-            image = Image.open(image_path).convert("RGB")
-        except Exception as e:
-            print(f"❌ Ошибка загрузки {image_path}: {e}")
-            continue
+    # Картинки читаются и препроцессятся в фоновых потоках, пока модель декодирует текущую пачку
+    items = ((idx, os.path.join(dataset_path, item["file_name"])) for idx, item in pending)
+    try:
+        for indices, pixel_values, failed in prefetch_batches(items, processor, batch_size, workers=workers,
+                                                              orient=engine.orienter(doc_type)):
+            for idx, e in failed:
+                print(f"❌ Ошибка загрузки {metadata[idx]['file_name']}: {e}")
 
-        pixel_values = processor(image, return_tensors="pt").pixel_values.to(device)
-        decoder_input_ids = processor.tokenizer(
-            task_prompt, add_special_tokens=False, return_tensors="pt"
-        ).input_ids.to(device)
-
-        with torch.no_grad():
-            outputs = model.generate(
-                pixel_values,
-                decoder_input_ids=decoder_input_ids,
-                max_length=768,
-                pad_token_id=processor.tokenizer.pad_token_id,
-                eos_token_id=processor.tokenizer.eos_token_id,
-                use_cache=True,
-                bad_words_ids=[[processor.tokenizer.unk_token_id]],
-                return_dict_in_generate=True,
-                repetition_penalty=1.2,
-                num_beams=2
-            )
-
-            # 1. Получаем сырую строку
-            sequence = processor.batch_decode(outputs.sequences)[0]
-            sequence = sequence.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
-            sequence = re.sub(r"^" + re.escape(task_prompt), "", sequence).strip()
-
-            # 2. Пытаемся получить словарь
-            predicted_dict = processor.token2json(sequence)
-
-            # ЕСЛИ МОДЕЛЬ ВЫДАЛА СЫРОЙ JSON (как в твоем логе), чистим и парсим его напрямую:
-            if "text_sequence" in predicted_dict:
-                raw_text = predicted_dict["text_sequence"]
-                # Пытаемся вырезать всё лишнее и оставить только сам словарь
-                try:
-                    # Ищем структуру {"gt_parse": {...}}
-                    match = re.search(r'{"gt_parse":\s*({.*?})}', raw_text)
-                    if match:
-                        predicted_dict = json.loads(match.group(1))
-                    else:
-                        # Если совсем мусор
-                        predicted_dict = {"error": raw_text}
-                except json.JSONDecodeError:
-                    predicted_dict = {"error": "JSON_Decode_Error"}
-
-            # 3. Считаем метрики
-            truth_str = json.dumps(ground_truth_dict, sort_keys=True, ensure_ascii=False)
-            pred_str = json.dumps(predicted_dict, sort_keys=True, ensure_ascii=False)
-
-            current_cer = cer(truth_str, pred_str)
-            total_cer += current_cer
-
-            if ground_truth_dict == predicted_dict:
-                exact_matches += 1
-                status = "✅ ИДЕАЛЬНО"
-            else:
-                status = f"❌ ОШИБКА (CER: {current_cer:.2f})"
+            if pixel_values is None:
+                continue
+
+            started = time.perf_counter()
+            predicted_dicts = engine.generate(pixel_values, doc_type)
+            generate_seconds += time.perf_counter() - started
+            generated_images += len(predicted_dicts)
 
-            print(f"[{idx + 1}/{total_images}] {item['file_name']} | {status}")
+            stop = False
+            for idx, predicted_dict in zip(indices, predicted_dicts):
+                item = metadata[idx]
+                # Достаем идеальный словарь из твоей метадаты
+                ground_truth_dict = json.loads(item["ground_truth"])["gt_parse"]
 
-            if ground_truth_dict != predicted_dict:
-                print(f"   Ожидалось: {truth_str}")
-                print(f"   Получено:  {pred_str}")
-                break  # Тормозим на первой ошибке
+                record = score_sample(ground_truth_dict, predicted_dict)
+                record["file_name"] = item["file_name"]
+                record["prediction"] = predicted_dict
+                metrics.add(record)
+
+                if report:
+                    report.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+                if record["exact"]:
+                    status = "✅ ИДЕАЛЬНО"
+                else:
+                    status = f"❌ ОШИБКА (CER: {record['cer']:.2f})"
+
+                print(f"[{idx + 1}/{total_images}] {item['file_name']} | {status}")
+
+                if not record["exact"] and not full_run:
+                    truth_str = json.dumps(ground_truth_dict, sort_keys=True, ensure_ascii=False)
+                    pred_str = json.dumps(predicted_dict, sort_keys=True, ensure_ascii=False)
+                    print(f"   Ожидалось: {truth_str}")
+                    print(f"   Получено:  {pred_str}")
+                    stop = True  # Тормозим на первой ошибке
+                    break
+
+            if report:
+                # Сбрасываем на диск после каждой пачки: при падении теряется максимум одна пачка
+                report.flush()
+            if stop:
+                break
+    finally:
+        if report:
+            report.close()
 
     # Финальные результаты
-    avg_cer = total_cer / total_images
-    accuracy = (exact_matches / total_images) * 100
+    summary = metrics.summary()
+    summary["latency_ms_per_image"] = generate_seconds * 1000 / generated_images if generated_images else None
 
     print("\n" + "=" * 50)
     print(f"📊 РЕЗУЛЬТАТЫ ВАЛИДАЦИИ ({dataset_path})")
     print("=" * 50)
-    print(f"Всего изображений: {total_images}")
-    print(f"Идеальных совпадений (Точность): {accuracy:.2f}%")
-    print(f"Средняя ошибка по символам (CER): {avg_cer:.4f} (ближе к 0 = лучше)")
+    print(f"Всего изображений: {total_images}, проверено: {summary['documents']}")
+    print(f"Идеальных совпадений (Точность): {summary['exact_match'] * 100:.2f}%")
+    print(f"Средняя ошибка по символам (CER): {summary['cer']:.4f} (ближе к 0 = лучше)")
+    if summary["latency_ms_per_image"] is not None:
+        print(f"Время генерации: {summary['latency_ms_per_image']:.0f} мс/картинка")
+    print("-" * 50)
+    for field, field_metrics in summary["fields"].items():
+        print(f"{field:<25} CER: {field_metrics['cer']:.4f} | Точность: {field_metrics['exact_match'] * 100:.2f}%")
     print("=" * 50 + "\n")
 
+    if full_run:
+        summary_path = os.path.splitext(report_path)[0] + ".summary.json"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"💾 Сводка сохранена: {summary_path}")
+
+    return summary
+
+
+def _peak_rss_mb():
+    """Пиковая память процесса (RSS) или None, где нет модуля resource (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _evaluate_isolated(doc_type, dataset_path, batch_size, workers, report_path, engine_kwargs):
+    """Выполняется в отдельном процессе, чтобы пиковая память относилась только к этой модели"""
+    from quantize_model import weights_size_mb
+    engine = OCREngine(generation_kwargs=EVAL_GENERATION, **engine_kwargs)
+    summary = evaluate(doc_type, dataset_path, batch_size, workers, full_run=True,
+                       report_path=report_path, engine=engine, resume=False)
+    summary["weights_mb"] = weights_size_mb(engine.document_types[doc_type][0])
+    summary["peak_rss_mb"] = _peak_rss_mb()
+    return summary
+
+
+def compare_int8(doc_type, dataset_path, batch_size=1, workers=2, backend="torch", schema_stopping=False,
+                 auto_orient=False):
+    """
+    Прогоняет датасет на fp32 и на int8 (CPU) и печатает метрики рядом. Настройки движка (--schema-stop,
+    --auto-orient) одинаковы для обеих моделей; backend задает fp32-сторону, int8 бывает только у torch.
+    Каждая модель считается в своем процессе (spawn): так пиковый RSS - это память именно этой модели.
+    """
+    import multiprocessing
+    if backend != "torch":
+        print(f"⚠️ int8-модели есть только для torch: сравниваем fp32 ({backend}) с int8 (torch)")
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name, quantized in (("fp32", False), ("int8", True)):
+        print(f"\n🔬 Модель {name}")
+        engine_kwargs = {"device": "cpu", "quantized": quantized, "backend": "torch" if quantized else backend,
+                         "schema_stopping": schema_stopping, "auto_orient": auto_orient}
+        report_path = os.path.join("reports", f"{doc_type}_eval_{name}.jsonl")
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(_evaluate_isolated, (doc_type, dataset_path, batch_size, workers,
+                                                              report_path, engine_kwargs))
+
+    print("=" * 50)
+    print(f"⚖️ СРАВНЕНИЕ FP32 / INT8 ({dataset_path})")
+    print("=" * 50)
+    print(f"{'':<22}{'fp32':>12}{'int8':>12}")
+    for label, key, fmt in (
+            ("Время, мс/картинка", "latency_ms_per_image", "{:>12.0f}"),
+            ("Веса на диске, МБ", "weights_mb", "{:>12.0f}"),
+            ("Пиковый RSS, МБ", "peak_rss_mb", "{:>12.0f}"),
+            ("CER", "cer", "{:>12.4f}"),
+            ("Точность", "exact_match", "{:>12.2%}"),
+    ):
+        values = "".join(fmt.format(results[name][key] or 0) for name in ("fp32", "int8"))
+        print(f"{label:<22}{values}")
+    print("=" * 50 + "\n")
+    return results
+
+
+def model_revision(model_path, backend="torch"):
+    """Ревизия модели: имена, размеры и время изменения файлов весов + бэкенд"""
+    h = hashlib.sha1(backend.encode("utf-8"))
+    for name in sorted(os.listdir(model_path)):
+        stat = os.stat(os.path.join(model_path, name))
+        h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EncoderOutputCache:
+    """
+    Кэш выходов энкодера по ключу (ревизия модели, хэш содержимого картинки). Hidden states Swin
+    на 1280x960 весят мегабайты на картинку, поэтому храним их в fp16 и ограничиваем память
+    в байтах (max_mb), а не числом записей. Вытесненные записи сбрасываются в .npy в spill_dir,
+    пока на диске не наберется max_spill_mb; spill_dir=None или max_spill_mb=0 - без диска,
+    вытесненное просто забывается (get вернет None, и вызывающий прогонит энкодер заново).
+    """
+
+    def __init__(self, spill_dir=None, max_mb=1024, max_spill_mb=8192):
+        self.spill_dir = spill_dir if max_spill_mb else None
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_spill_bytes = max_spill_mb * 1024 * 1024
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.written = []
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.spill_bytes = sum(entry.stat().st_size for entry in os.scandir(self.spill_dir) if entry.is_file())
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def __contains__(self, key):
+        return key in self.memory or bool(self.spill_dir and os.path.exists(self._path(key)))
+
+    def get(self, key):
+        """fp32-тензор для generate или None, если запись вытеснена без сброса на диск"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key].float()
+        if not self.spill_dir or not os.path.exists(self._path(key)):
+            return None
+        import numpy as np
+        import torch
+        hidden = torch.from_numpy(np.load(self._path(key)))
+        self._remember(key, hidden)
+        return hidden.float()
+
+    def put(self, key, hidden):
+        self._remember(key, hidden.half().contiguous())
+
+    def _remember(self, key, hidden):
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key).nbytes
+        self.memory[key] = hidden
+        self.memory_bytes += hidden.nbytes
+        while self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+            evicted_key, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+            self._spill(evicted_key, evicted)
+
+    def _spill(self, key, hidden):
+        if not self.spill_dir:
+            return
+        path = self._path(key)
+        if os.path.exists(path) or self.spill_bytes + hidden.nbytes > self.max_spill_bytes:
+            return
+        import numpy as np
+        # Пишем через временный файл, чтобы прерванный прогон не оставил битый кэш
+        np.save(path + ".tmp.npy", hidden.numpy())
+        os.replace(path + ".tmp.npy", path)
+        self.spill_bytes += os.path.getsize(path)
+        self.written.append(path)
+
+    def flush(self):
+        """Сбросить все, что в памяти, на диск (в пределах max_spill_mb) - для повторных переборов"""
+        for key, hidden in self.memory.items():
+            self._spill(key, hidden)
+
+    def cleanup(self):
+        """Удалить файлы, записанные этим кэшем"""
+        for path in self.written:
+            if os.path.exists(path):
+                self.spill_bytes -= os.path.getsize(path)
+                os.remove(path)
+        self.written = []
+
+
+def sweep(doc_type, dataset_path, grid, batch_size=1, workers=2, limit=None, cache_dir="encoder_cache/sweep",
+          engine=None, cache_mb=1024, spill_mb=8192, keep_cache=False):
+    """
+    Перебор настроек декодирования: энкодер прогоняется один раз на картинку,
+    затем каждая конфигурация из grid декодирует по закэшированным hidden states.
+    Что не поместилось ни в cache_mb памяти, ни в spill_mb на диске, прогоняется через энкодер заново.
+    Сброшенный на диск кэш после перебора удаляется, если не задан keep_cache.
+    """
+    import torch
+    engine = engine or OCREngine(generation_kwargs=EVAL_GENERATION)
+    processor = engine.get(doc_type).processor
+    revision = model_revision(engine.document_types[doc_type][0], engine.backend)
+    if engine.auto_orient:
+        # Выровненные картинки дают другие выходы энкодера
+        revision += "_oriented"
+    cache = EncoderOutputCache(cache_dir, max_mb=cache_mb, max_spill_mb=spill_mb)
+
+    with open(os.path.join(dataset_path, "metadata.jsonl"), "r", encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f][:limit]
+
+    keys = [f"{revision}_{file_hash(os.path.join(dataset_path, item['file_name']))}" for item in metadata]
+    missing = [(idx, os.path.join(dataset_path, metadata[idx]["file_name"]))
+               for idx, key in enumerate(keys) if key not in cache]
+
+    print(f"🧊 Энкодер: {len(missing)} новых картинок, {len(keys) - len(missing)} уже в кэше")
+    encode_seconds = 0.0
+    failed_indices = set()
+    for indices, pixel_values, failed in prefetch_batches(missing, processor, batch_size, workers=workers,
+                                                          orient=engine.orienter(doc_type)):
+        for idx, e in failed:
+            failed_indices.add(idx)
+            print(f"❌ Ошибка загрузки {metadata[idx]['file_name']}: {e}")
+        if pixel_values is None:
+            continue
+        started = time.perf_counter()
+        hidden = engine.encode(pixel_values, doc_type)
+        encode_seconds += time.perf_counter() - started
+        for idx, row in zip(indices, hidden):
+            cache.put(keys[idx], row.unsqueeze(0))
+    if keep_cache:
+        cache.flush()
+
+    reencoded = 0
+
+    def cached_hidden(batch):
+        """Hidden states пачки из кэша; вытесненные без сброса на диск считаем энкодером заново"""
+        nonlocal reencoded
+        rows = {idx: cache.get(keys[idx]) for idx in batch}
+        lost = [idx for idx, row in rows.items() if row is None]
+        if lost:
+            paths = [os.path.join(dataset_path, metadata[idx]["file_name"]) for idx in lost]
+            for idx, row in zip(lost, engine.encode(engine.preprocess(paths, doc_type), doc_type)):
+                rows[idx] = row.unsqueeze(0)
+                cache.put(keys[idx], rows[idx])
+            reencoded += len(lost)
+        return torch.cat([rows[idx] for idx in batch])
+
+    available = [idx for idx in range(len(keys)) if idx not in failed_indices]
+    rows = []
+    try:
+        for values in itertools.product(*grid.values()):
+            config = dict(zip(grid.keys(), values))
+            metrics = MetricsAccumulator()
+            decode_seconds = 0.0
+            for start in range(0, len(available), batch_size):
+                batch = available[start:start + batch_size]
+                hidden = cached_hidden(batch)
+                started = time.perf_counter()
+                predicted_dicts = engine.generate_from_encoder(hidden, doc_type, **config)
+                decode_seconds += time.perf_counter() - started
+                for idx, predicted_dict in zip(batch, predicted_dicts):
+                    metrics.add(score_sample(json.loads(metadata[idx]["ground_truth"])["gt_parse"], predicted_dict))
+
+            summary = metrics.summary()
+            summary["config"] = config
+            summary["decode_ms_per_image"] = decode_seconds * 1000 / max(len(available), 1)
+            rows.append(summary)
+            print(f"   {config} -> CER {summary['cer']:.4f}, точность {summary['exact_match']:.2%}, "
+                  f"{summary['decode_ms_per_image']:.0f} мс/картинка")
+    finally:
+        if not keep_cache:
+            cache.cleanup()
+    if reencoded:
+        print(f"⚠️ Кэш энкодера не вместил все картинки: {reencoded} прогонов энкодера повторно "
+              f"(увеличьте --encoder-cache-mb или --encoder-spill-mb)")
+
+    print("\n" + "=" * 80)
+    print(f"🔬 ПЕРЕБОР НАСТРОЕК ДЕКОДИРОВАНИЯ ({len(available)} картинок, ревизия модели {revision})")
+    if missing:
+        print(f"   Энкодер: {encode_seconds * 1000 / len(missing):.0f} мс/картинка (один раз на картинку)")
+    print("=" * 80)
+    header = "".join(f"{name:>20}" for name in grid) + f"{'Точность':>12}{'CER':>10}{'мс/картинка':>14}"
+    print(header)
+    for row in sorted(rows, key=lambda r: (-r["exact_match"], r["cer"])):
+        values = "".join(f"{str(row['config'][name]):>20}" for name in grid)
+        print(f"{values}{row['exact_match']:>12.2%}{row['cer']:>10.4f}{row['decode_ms_per_image']:>14.0f}")
+    print("=" * 80 + "\n")
+    return rows
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Массовая валидация моделей")
     parser.add_argument('--type', type=str, choices=['passport', 'registration'], required=True)
+    parser.add_argument('--batch-size', type=int, default=1, help='Сколько картинок распознавать за один вызов generate')
+    parser.add_argument('--workers', type=int, default=2, help='Потоков для фоновой загрузки и препроцессинга картинок')
+    parser.add_argument('--full', action='store_true',
+                        help='Прогнать весь датасет без остановки на первой ошибке и писать JSONL-отчет')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Путь к JSONL-отчету (по умолчанию reports/<type>_eval.jsonl). Существующий отчет продолжается')
+    parser.add_argument('--int8', action='store_true', help='Валидировать int8-модель (<модель>_int8, только CPU)')
+    parser.add_argument('--compare-int8', action='store_true',
+                        help='Прогнать fp32 и int8 на CPU и сравнить время, размер весов на диске, пиковый RSS и CER')
+    parser.add_argument('--backend', type=str, choices=['torch', 'onnx'], default='torch',
+                        help='onnx - ONNX Runtime с KV-кэшем (<модель>_onnx, см. onnx_export.py)')
+    parser.add_argument('--schema-stop', action='store_true',
+                        help='Останавливать генерацию по схеме полей и при зацикливании, бюджет длины из схемы')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Перебрать сетку настроек декодирования по закэшированным выходам энкодера')
+    parser.add_argument('--sweep-beams', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--sweep-repetition-penalty', type=float, nargs='+', default=[1.0, 1.2])
+    parser.add_argument('--sweep-max-length', type=int, nargs='+', default=[768])
+    parser.add_argument('--limit', type=int, default=None, help='Сколько картинок валидации брать для перебора')
+    parser.add_argument('--encoder-cache', type=str, default='encoder_cache/sweep',
+                        help='Папка для сброса кэша энкодера на диск')
+    parser.add_argument('--encoder-cache-mb', type=int, default=1024,
+                        help='Бюджет памяти кэша энкодера, МБ (hidden states хранятся в fp16)')
+    parser.add_argument('--encoder-spill-mb', type=int, default=8192,
+                        help='Сколько МБ кэша энкодера можно сбросить на диск (0 - не сбрасывать)')
+    parser.add_argument('--keep-encoder-cache', action='store_true',
+                        help='Оставить кэш энкодера на диске для следующих переборов (по умолчанию удаляется)')
+    parser.add_argument('--auto-orient', action='store_true',
+                        help='Перед распознаванием ставить сканы ровно (0/90/180/270, см. orientation.py)')
+    add_warm_argument(parser)
     args = parser.parse_args()
+    maybe_run_warm(args, __file__)
 
-    if args.type == "passport":
-        evaluate("models_ready/donut_passport_v1", "dataset/val_passport", "<s_passport>")
-    elif args.type == "registration":
-        evaluate("models_ready/donut_registration_v1", "dataset/val_registration", "<s_registration>")
\ No newline at end of file
+    dataset_path = f"dataset/val_{args.type}"
+    engine = OCREngine(generation_kwargs=EVAL_GENERATION, quantized=args.int8, backend=args.backend,
+                       schema_stopping=args.schema_stop, auto_orient=args.auto_orient)
+    if args.compare_int8:
+        compare_int8(args.type, dataset_path, args.batch_size, args.workers, args.backend, args.schema_stop,
+                     args.auto_orient)
+    elif args.sweep:
+        grid = {
+            "num_beams": args.sweep_beams,
+            "repetition_penalty": args.sweep_repetition_penalty,
+            "max_length": args.sweep_max_length,
+        }
+        sweep(args.type, dataset_path, grid, args.batch_size, args.workers, args.limit, args.encoder_cache, engine,
+              args.encoder_cache_mb, args.encoder_spill_mb, args.keep_encoder_cache)
+    else:
+        report_path = args.report or os.path.join("reports", f"{args.type}_eval.jsonl")
+        evaluate(args.type, dataset_path, args.batch_size, args.workers, args.full, report_path, engine)
@@ -0,0 +1,148 @@
+import io
+import os
+import json
+import math
+import tarfile
+from PIL import Image
+
+# Поля по умолчанию для экспорта: короткие, массовые и хорошо читаемые строкой
+DEFAULT_CROP_FIELDS = {
+    "passport": ["passport_series", "passport_number", "issue_date", "birth_date", "department_code"],
+    "birth_certificate": ["birthDate", "numberofcertificate"],
+    "registration": ["house_number", "korpus", "stroenie", "apart_nmb"],
+}
+
+
+def rotate_vector(x, y, angle_cw):
+    """Поворот вектора на angle_cw градусов по часовой (ось y направлена вниз, как у картинок)"""
+    a = math.radians(angle_cw)
+    return x * math.cos(a) - y * math.sin(a), x * math.sin(a) + y * math.cos(a)
+
+
+def rotated_quad(cx, cy, width, height, angle_cw):
+    """
+    Углы прямоугольника строки width x height с центром (cx, cy), повернутого на angle_cw градусов
+    по часовой (как Image.rotate(-angle_cw)). Порядок - по чтению текста: UL, LL, LR, UR.
+    """
+    corners = [(-width / 2, -height / 2), (-width / 2, height / 2), (width / 2, height / 2), (width / 2, -height / 2)]
+    return [[cx + dx, cy + dy] for dx, dy in (rotate_vector(x, y, angle_cw) for x, y in corners)]
+
+
+def rect_quad(left, top, right, bottom):
+    return [[left, top], [left, bottom], [right, bottom], [right, top]]
+
+
+def flatten_quads(fields):
+    """Все углы всех полей одним списком точек - в таком виде их преобразует ImageAugmentor.process"""
+    return [point for field in fields for point in field["quad"]]
+
+
+def unflatten_quads(fields, points):
+    return [dict(field, quad=[list(map(float, p)) for p in points[4 * i:4 * i + 4]]) for i, field in enumerate(fields)]
+
+
+def crop_field(img, quad, pad=0.15):
+    """
+    Вырезает строку по четырехугольнику и выпрямляет ее (Image.QUAD): повороты бланка и перекос
+    сканера уже учтены в quad, поэтому кроп всегда выходит горизонтальным. pad - запас в долях высоты.
+    """
+    (ulx, uly), (llx, lly), (lrx, lry), (urx, ury) = quad
+    width = math.hypot(urx - ulx, ury - uly)
+    height = math.hypot(llx - ulx, lly - uly)
+    if width < 2 or height < 2:
+        return None
+
+    # Единичные векторы вдоль строки и поперек нее
+    ux, uy = (urx - ulx) / width, (ury - uly) / width
+    vx, vy = (llx - ulx) / height, (lly - uly) / height
+    m = pad * height
+
+    def shift(x, y, du, dv):
+        return x + du * ux + dv * vx, y + du * uy + dv * vy
+
+    corners = [shift(ulx, uly, -m, -m), shift(llx, lly, -m, m), shift(lrx, lry, m, m), shift(urx, ury, m, -m)]
+    size = (max(1, round(width + 2 * m)), max(1, round(height + 2 * m)))
+    data = [coord for corner in corners for coord in corner]
+    return img.transform(size, Image.QUAD, data, resample=Image.BILINEAR, fillcolor=(255, 255, 255))
+
+
+def export_crops(img, fields, doc_type, source, allowed=None):
+    """Кропы полей одного сэмпла -> список записей (PNG в градациях серого + подпись)"""
+    records = []
+    for i, field in enumerate(fields):
+        if allowed is not None and field["label"] not in allowed:
+            continue
+        if not str(field["text"]).strip():
+            continue
+        crop = crop_field(img, field["quad"])
+        if crop is None:
+            continue
+        buffer = io.BytesIO()
+        crop.convert("L").save(buffer, "PNG", optimize=True)
+        records.append({
+            "key": f"{os.path.splitext(source)[0]}_{i:02d}",
+            "png": buffer.getvalue(),
+            "meta": {"text": str(field["text"]), "field": field["label"], "doc_type": doc_type, "source": source},
+        })
+    return records
+
+
+class CropShardWriter:
+    """
+    Шардированное хранилище кропов в формате WebDataset: crops-00000.tar с парами <key>.png / <key>.json.
+    Шард k содержит кропы сэмплов с номерами [k * shard_size, (k + 1) * shard_size) и появляется
+    под своим именем только целиком (до этого пишется во временный .tmp).
+    """
+
+    def __init__(self, output_dir, shard_size=5000):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        os.makedirs(output_dir, exist_ok=True)
+        self._shard = None
+        self._tar = None
+        self._count = 0
+
+    def shard_of(self, index):
+        return index // self.shard_size
+
+    def shard_path(self, shard):
+        return os.path.join(self.output_dir, f"crops-{shard:05d}.tar")
+
+    def is_complete(self, shard):
+        return os.path.exists(self.shard_path(shard))
+
+    def _open(self, shard):
+        self.close()
+        self._shard = shard
+        self._tar = tarfile.open(self.shard_path(shard) + ".tmp", "w")
+        self._count = 0
+
+    def _add(self, name, payload):
+        info = tarfile.TarInfo(name)
+        info.size = len(payload)
+        self._tar.addfile(info, io.BytesIO(payload))
+
+    def write(self, index, records):
+        shard = self.shard_of(index)
+        if shard != self._shard:
+            self._open(shard)
+        for record in records:
+            self._add(f"{record['key']}.png", record["png"])
+            self._add(f"{record['key']}.json", json.dumps(record["meta"], ensure_ascii=False).encode("utf-8"))
+            self._count += 1
+
+    def abort(self):
+        """Прерванный шард остается .tmp: при resume его сэмплы генерируются заново"""
+        if self._tar is not None:
+            self._tar.close()
+        self._tar = None
+        self._shard = None
+
+    def close(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        os.replace(self.shard_path(self._shard) + ".tmp", self.shard_path(self._shard))
+        print(f"🧩 Шард кропов {os.path.basename(self.shard_path(self._shard))}: {self._count} шт.")
+        self._tar = None
+        self._shard = None
@@ -5,11 +5,10 @@ import xml.etree.ElementTree as ET
 import json  # ВАЖНО: Добавлен импорт JSON
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
-from faker import Faker
 from augmentor import ImageAugmentor
-
-# Настройка Faker
-fake = Faker('ru_RU')
+from generation_jobs import (GenerationJob, get_fake, seed_sample, save_image_atomic, save_json_atomic,
+                             date_between_years, date_of_birth)
+from field_crops import rotate_vector, rotated_quad, flatten_quads, unflatten_quads
 
 male_patronymics = ['Иванович', 'Петрович', 'Сергеевич', 'Александрович', 'Михайлович', 'Дмитриевич']
 female_patronymics = ['Ивановна', 'Петровна', 'Сергеевна', 'Александровна', 'Михайловна', 'Дмитриевна']
@@ -57,6 +56,7 @@ def parse_cvat_xml(xml_path):
 
 def generate_data():
     """Генерирует случайные данные для одного паспорта"""
+    fake = get_fake()
     is_male = random.choice([True, False])
     surname = fake.last_name_male() if is_male else fake.last_name_female()
     name = fake.first_name_male() if is_male else fake.first_name_female()
@@ -67,12 +67,12 @@ def generate_data():
         'name': name,
         'patronymic': patronymic,
         'issued_by': f"ОУФМС РОССИИ ПО {random.choice(['ГОР. МОСКВЕ', 'МОСКОВСКОЙ ОБЛ.'])} В {random.choice(['ЦАО', 'ЗАО', 'СВАО'])}",
-        'issue_date': fake.date_between('-10y', '-1y').strftime('%d.%m.%Y'),
+        'issue_date': date_between_years(fake, 10, 1).strftime('%d.%m.%Y'),
         'department_code': f"{random.randint(100, 999):03d}-{random.randint(100, 999):03d}",
         'passport_series': f"{random.randint(10, 99):02d} {random.randint(10, 99):02d}",
         'passport_number': f"{random.randint(100000, 999999):06d}",
         'sex': 'МУЖ.' if is_male else 'ЖЕН.',
-        'birth_date': fake.date_of_birth(minimum_age=14, maximum_age=60).strftime('%d.%m.%Y'),
+        'birth_date': date_of_birth(fake, minimum_age=14, maximum_age=60).strftime('%d.%m.%Y'),
         'birth_place': f"ГОР. {fake.city().upper()}"
     }
 
@@ -118,7 +118,7 @@ def get_font_for_box(box, is_vertical=False, max_font_size=42):
 
 
 def draw_rotated_text(img, box, text, color=(0, 0, 0)):
-    """Рисует текст с учетом вращения и специфики паспорта"""
+    """Рисует текст с учетом вращения и специфики паспорта. Возвращает четырехугольник строки (UL, LL, LR, UR)"""
     is_vertical_field = 'passport' in box['label'].lower()
     font = get_font_for_box(box, is_vertical=is_vertical_field)
 
@@ -126,10 +126,12 @@ def draw_rotated_text(img, box, text, color=(0, 0, 0)):
     txt_layer = Image.new('RGBA', (temp_dim, temp_dim), (0, 0, 0, 0))
     draw = ImageDraw.Draw(txt_layer)
 
+    offset_x = offset_y = 0
     try:
         text_bbox = draw.textbbox((0, 0), text, font=font)
         text_w = text_bbox[2] - text_bbox[0]
         text_h = text_bbox[3] - text_bbox[1]
+        offset_x, offset_y = text_bbox[0], text_bbox[1]
     except TypeError:
         text_w, text_h = draw.textsize(text, font=font)
 
@@ -144,16 +146,19 @@ def draw_rotated_text(img, box, text, color=(0, 0, 0)):
     paste_y = int(box['cy'] - rotated_txt.height / 2)
     img.paste(rotated_txt, (paste_x, paste_y), rotated_txt)
 
+    # Центр чернил смещен от центра слоя на отступ textbbox, слой вставлен центром в (cx, cy)
+    dx, dy = rotate_vector(offset_x, offset_y, -pil_rotation_angle)
+    return rotated_quad(box['cx'] + dx, box['cy'] + dy, text_w, text_h, -pil_rotation_angle)
 
-def fill_template(template_path, boxes, output_dir, file_prefix, count_idx, augmentor, apply_aug_prob):
-    """Создает одно изображение паспорта и JSON разметку"""
-    data = generate_data()
 
-    try:
-        img = Image.open(template_path).convert('RGBA')
-    except FileNotFoundError:
-        print(f"❌ Ошибка: Шаблон {template_path} не найден!")
-        return
+def render_passport(template, boxes, augmentor, apply_aug_prob, fields=None):
+    """
+    Заполняет копию уже открытого RGBA-шаблона случайными данными. Возвращает (картинка RGB, данные).
+    Если передан список fields, в него добавляются строки {"label", "text", "quad"} в координатах итоговой картинки.
+    """
+    data = generate_data()
+    img = template.copy()
+    drawn = []
 
     text_color = (35, 30, 30)
     red_color = (35, 30, 30)
@@ -163,14 +168,39 @@ def fill_template(template_path, boxes, output_dir, file_prefix, count_idx, augm
             value = str(data[label_name])
             color = red_color if 'passport' in label_name else text_color
             for box in bboxes:
-                draw_rotated_text(img, box, value, color)
+                quad = draw_rotated_text(img, box, value, color)
+                drawn.append({"label": label_name, "text": value, "quad": quad})
 
     img = img.convert('RGB')
 
     if random.random() < apply_aug_prob:
-        img = augmentor.process(img)
+        img, points = augmentor.process(img, flatten_quads(drawn))
+        drawn = unflatten_quads(drawn, points)
         print(f"    ✨ Аугментация применена.")
 
+    if fields is not None:
+        fields.extend(drawn)
+    return img, data
+
+
+def fill_template(template_path, boxes, output_dir, file_prefix, count_idx, augmentor, apply_aug_prob, job=None):
+    """Создает одно изображение паспорта и JSON разметку. С job имена детерминированы номером сэмпла"""
+    try:
+        template = Image.open(template_path).convert('RGBA')
+    except FileNotFoundError:
+        print(f"❌ Ошибка: Шаблон {template_path} не найден!")
+        return
+
+    img, data = render_passport(template, boxes, augmentor, apply_aug_prob)
+
+    if job is not None:
+        image_path, json_path = job.path(count_idx, ".png"), job.path(count_idx, ".json")
+        save_image_atomic(img, image_path, quality=95)
+        save_json_atomic(data, json_path)
+        job.record(count_idx, [image_path, json_path])
+        print(f"✅ [{count_idx + 1}] Сохранено: {os.path.basename(image_path)} и .json")
+        return
+
     # --- ЛОГИКА СОХРАНЕНИЯ (ОБНОВЛЕНА) ---
     timestamp = int(datetime.now().timestamp())
     # Соль нужна для избежания конфликта имен при мультипроцессорном запуске
@@ -199,6 +229,10 @@ if __name__ == "__main__":
     parser.add_argument('--out', type=str, default='generated', help='Папка для сохранения')
     parser.add_argument('--aug-prob', type=float, default=1 / 3, help='Вероятность применения аугментаций')
     parser.add_argument('--aug-internal-prob', type=float, default=0.7, help='Вероятность применения каждого искажения')
+    parser.add_argument('--job', action='store_true',
+                        help='Режим задания: имена и сиды по номеру сэмпла, журнал прогресса в папке вывода')
+    parser.add_argument('--seed', type=int, default=0, help='Сид задания (режим --job)')
+    parser.add_argument('--resume', action='store_true', help='Продолжить задание: готовые сэмплы пропускаются')
 
     args = parser.parse_args()
     os.makedirs(args.out, exist_ok=True)
@@ -212,8 +246,17 @@ if __name__ == "__main__":
         else:
             find_font()
             print(f"🚀 Начинаем генерацию {args.count} шт...")
-            for i in range(args.count):
-                fill_template(args.template, boxes_data, args.out, "passport", i, augmentor, args.aug_prob)
+            if args.job or args.resume:
+                job = GenerationJob(args.out, "passport", args.count, args.seed, args.resume)
+                try:
+                    for i in job.pending():
+                        seed_sample(args.seed, i, get_fake())
+                        fill_template(args.template, boxes_data, args.out, "passport", i, augmentor, args.aug_prob, job)
+                finally:
+                    job.close()
+            else:
+                for i in range(args.count):
+                    fill_template(args.template, boxes_data, args.out, "passport", i, augmentor, args.aug_prob)
             print("🎉 Генерация завершена!")
 
     except Exception as e:
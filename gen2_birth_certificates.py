@@ -4,13 +4,11 @@ import argparse
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
 from PIL import Image, ImageDraw, ImageFont
-from faker import Faker
-from num2words import num2words
 from augmentor import ImageAugmentor
+from generation_jobs import GenerationJob, get_fake, seed_sample, save_image_atomic, date_of_birth
+from field_crops import rotate_vector, rotated_quad, flatten_quads, unflatten_quads
 
 # --- Configuration ---
-fake = Faker('ru_RU')
-
 male_patronymics = ['Иванович', 'Петрович', 'Сергеевич', 'Александрович', 'Михайлович', 'Дмитриевич']
 female_patronymics = ['Ивановна', 'Петровна', 'Сергеевна', 'Александровна', 'Михайловна', 'Дмитриевна']
 
@@ -63,12 +61,14 @@ def parse_cvat_polygon_xml(xml_path):
 
 def generate_birth_certificate_data():
     """Генерирует данные для свидетельства о рождении с учетом исправленной логики."""
+    from num2words import num2words
+    fake = get_fake()
     is_male = random.choice([True, False])
     child_surname = fake.last_name_male() if is_male else fake.last_name_female()
     child_name = fake.first_name_male() if is_male else fake.first_name_female()
     child_patronymic = random.choice(male_patronymics if is_male else female_patronymics)
 
-    birth_date = fake.date_of_birth(minimum_age=1, maximum_age=18)
+    birth_date = date_of_birth(fake, minimum_age=1, maximum_age=18)
     registration_date = birth_date + timedelta(days=random.randint(3, 30))
     issuance_date = registration_date + timedelta(days=random.randint(0, 5))
 
@@ -147,9 +147,11 @@ def draw_rotated_text(img, box, text, color=(0, 0, 0)):
     txt_layer = Image.new('RGBA', (temp_dim, temp_dim), (0, 0, 0, 0))
     draw = ImageDraw.Draw(txt_layer)
 
+    offset_x = offset_y = 0
     try:
         text_bbox = draw.textbbox((0, 0), text, font=font)
         text_w, text_h = text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1]
+        offset_x, offset_y = text_bbox[0], text_bbox[1]
     except TypeError:
         text_w, text_h = draw.textsize(text, font=font)
 
@@ -160,30 +162,55 @@ def draw_rotated_text(img, box, text, color=(0, 0, 0)):
     paste_y = int(box['cy'] - rotated_txt.height / 2)
     img.paste(rotated_txt, (paste_x, paste_y), rotated_txt)
 
+    # Четырехугольник строки для экспорта кропов (см. field_crops.py)
+    dx, dy = rotate_vector(offset_x, offset_y, box['rotation'])
+    return rotated_quad(box['cx'] + dx, box['cy'] + dy, text_w, text_h, box['rotation'])
+
 # --- Main Execution ---
 
-def fill_template(template_path, boxes, output_dir, file_prefix, count_idx, augmentor, apply_aug_prob):
+def render_certificate(template, boxes, augmentor, apply_aug_prob, fields=None):
+    """Заполняет копию открытого шаблона, возвращает (картинка RGB, данные). fields - как в render_passport"""
     data = generate_birth_certificate_data()
-    try:
-        img = Image.open(template_path).convert('RGBA')
-    except FileNotFoundError:
-        print(f"❌ Ошибка: Шаблон {template_path} не найден!")
-        return
+    img = template.copy()
+    drawn = []
 
     text_color = (10, 10, 10)
     for label_name, bboxes in boxes.items():
         if label_name in data:
             value = str(data[label_name])
             for box in bboxes:
-                draw_rotated_text(img, box, value, text_color)
+                quad = draw_rotated_text(img, box, value, text_color)
+                drawn.append({"label": label_name, "text": value, "quad": quad})
 
     img = img.convert('RGB')
 
     # Применяем аугментацию с заданной вероятностью
     if random.random() < apply_aug_prob:
-        img = augmentor.process(img)
+        img, points = augmentor.process(img, flatten_quads(drawn))
+        drawn = unflatten_quads(drawn, points)
         print(f"    ✨ Аугментация применена.")
 
+    if fields is not None:
+        fields.extend(drawn)
+    return img, data
+
+
+def fill_template(template_path, boxes, output_dir, file_prefix, count_idx, augmentor, apply_aug_prob, job=None):
+    try:
+        template = Image.open(template_path).convert('RGBA')
+    except FileNotFoundError:
+        print(f"❌ Ошибка: Шаблон {template_path} не найден!")
+        return
+
+    img, _ = render_certificate(template, boxes, augmentor, apply_aug_prob)
+
+    if job is not None:
+        save_path = job.path(count_idx, ".png")
+        save_image_atomic(img, save_path, quality=95)
+        job.record(count_idx, [save_path])
+        print(f"✅ [{count_idx + 1}] Сохранено: {save_path}")
+        return
+
     filename = f"{file_prefix}_{int(datetime.now().timestamp())}_{count_idx + 1}.png"
     save_path = os.path.join(output_dir, filename)
     img.save(save_path, quality=95)
@@ -197,6 +224,9 @@ if __name__ == "__main__":
     parser.add_argument('--out', type=str, default='generated', help='Папка для сохранения')
     parser.add_argument('--aug-prob', type=float, default=1/3, help='Вероятность применения всего набора аугментаций к изображению.')
     parser.add_argument('--aug-internal-prob', type=float, default=0.7, help='Вероятность применения каждого отдельного искажения внутри аугментатора.')
+    parser.add_argument('--job', action='store_true', help='Режим задания: детерминированные имена/сиды и журнал прогресса.')
+    parser.add_argument('--seed', type=int, default=0, help='Сид задания (режим --job).')
+    parser.add_argument('--resume', action='store_true', help='Продолжить задание, пропуская готовые сэмплы.')
     args = parser.parse_args()
 
     os.makedirs(args.out, exist_ok=True)
@@ -210,8 +240,17 @@ if __name__ == "__main__":
         else:
             find_font()
             print(f"🚀 Начинаем генерацию {args.count} шт...")
-            for i in range(args.count):
-                fill_template(args.template, boxes_data, args.out, "cert", i, augmentor, args.aug_prob)
+            if args.job or args.resume:
+                job = GenerationJob(args.out, "cert", args.count, args.seed, args.resume)
+                try:
+                    for i in job.pending():
+                        seed_sample(args.seed, i, get_fake())
+                        fill_template(args.template, boxes_data, args.out, "cert", i, augmentor, args.aug_prob, job)
+                finally:
+                    job.close()
+            else:
+                for i in range(args.count):
+                    fill_template(args.template, boxes_data, args.out, "cert", i, augmentor, args.aug_prob)
             print("🎉 Генерация завершена!")
     except Exception as e:
         print(f"❌ Произошла критическая ошибка: {e}")
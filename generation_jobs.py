@@ -0,0 +1,195 @@
+import os
+import json
+import random
+import hashlib
+from datetime import date, timedelta
+import numpy as np
+
+# Один Faker('ru_RU') на процесс для всех генераторов (см. get_fake)
+_fake = None
+# Дата, от которой считаются все "N лет назад" в данных (см. set_reference_date)
+_reference_date = None
+
+
+def get_fake():
+    """Faker('ru_RU') создается дольше секунды, поэтому только при первой генерации, а не при импорте"""
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker('ru_RU')
+    return _fake
+
+
+def set_reference_date(value):
+    """
+    Фиксирует "сегодня" для генераторов. Faker date_between('-10y') и date_of_birth считают от текущей даты,
+    и тот же сид в другой день дал бы другие даты; задание фиксирует свою дату в журнале.
+    """
+    global _reference_date
+    _reference_date = date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def reference_date():
+    return _reference_date or date.today()
+
+
+def years_before(years, ref=None):
+    ref = ref or reference_date()
+    try:
+        return ref.replace(year=ref.year - years)
+    except ValueError:
+        # 29 февраля -> 28 февраля невисокосного года
+        return ref.replace(year=ref.year - years, day=28)
+
+
+def date_between_years(fake, max_years_ago, min_years_ago):
+    """Аналог fake.date_between('-{max}y', '-{min}y') относительно reference_date()"""
+    return fake.date_between_dates(years_before(max_years_ago), years_before(min_years_ago))
+
+
+def date_of_birth(fake, minimum_age, maximum_age):
+    """Аналог fake.date_of_birth(minimum_age, maximum_age) относительно reference_date()"""
+    return fake.date_between_dates(years_before(maximum_age + 1) + timedelta(days=1), years_before(minimum_age))
+
+
+def sample_seed(job_seed, index):
+    """Сид сэмпла зависит только от сида задания и номера, а не от порядка и числа процессов"""
+    digest = hashlib.sha1(f"{job_seed}:{index}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def seed_sample(job_seed, index, fake=None):
+    """Сидирует все генераторы случайности, которыми пользуются генераторы и ImageAugmentor"""
+    seed = sample_seed(job_seed, index)
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    if fake is not None:
+        fake.seed_instance(seed)
+    return seed
+
+
+def save_image_atomic(img, path, **save_kwargs):
+    """Пишем во временный файл и переименовываем: после падения не остается обрезанных картинок"""
+    tmp_path = f"{path}.tmp"
+    fmt = {".jpg": "JPEG", ".jpeg": "JPEG"}.get(os.path.splitext(path)[1].lower(), "PNG")
+    img.save(tmp_path, fmt, **save_kwargs)
+    os.replace(tmp_path, path)
+
+
+def save_json_atomic(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+class GenerationJob:
+    """
+    Задание генерации с детерминированным отображением номер -> сид -> имя файла
+    и журналом выполненных номеров (<out>/<prefix>_journal.jsonl).
+
+    Каждая выполненная запись сразу уходит в ОС (падение процесса теряет только текущий сэмпл),
+    fsync делается раз в flush_every записей. При resume пропускаются номера, у которых
+    в журнале есть запись и все файлы на месте с тем же размером; остальные генерируются заново.
+
+    Первая строка журнала - заголовок с reference_date: даты в данных считаются от нее, а не от сегодняшнего
+    дня, поэтому сэмплы, догенерированные при resume через неделю, совпадают с исходными.
+    reference_date=None берет дату из журнала (при resume) или сегодняшнюю.
+    """
+
+    def __init__(self, output_dir, prefix, count, seed=0, resume=False, flush_every=50, reference_date=None):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.count = count
+        self.seed = seed
+        self.flush_every = flush_every
+        self.journal_path = os.path.join(output_dir, f"{prefix}_journal.jsonl")
+        os.makedirs(output_dir, exist_ok=True)
+
+        if isinstance(reference_date, str):
+            reference_date = date.fromisoformat(reference_date)
+        self.done = {}
+        stored_date = None
+        if resume:
+            self.done, stored_date = self._load_journal()
+            if reference_date is not None and stored_date is not None and reference_date != stored_date:
+                print(f"⚠️ Дата задания {reference_date} не совпадает с журналом ({stored_date}): генерация заново")
+                resume = False
+        if not resume and os.path.exists(self.journal_path):
+            # Новое задание поверх старого журнала: старые записи больше не описывают файлы
+            os.remove(self.journal_path)
+            self.done, stored_date = {}, None
+
+        self.reference_date = reference_date or stored_date or date.today()
+        set_reference_date(self.reference_date)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._since_sync = 0
+        if stored_date is None:
+            self._journal.write(json.dumps({"reference_date": self.reference_date.isoformat()}) + "\n")
+            self._journal.flush()
+
+    def _load_journal(self):
+        done, stored_date = {}, None
+        if not os.path.exists(self.journal_path):
+            return done, stored_date
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка: этот сэмпл просто сгенерируем заново
+                    continue
+                if "reference_date" in entry:
+                    stored_date = date.fromisoformat(entry["reference_date"])
+                elif entry.get("seed") == self.seed:
+                    done[entry["index"]] = entry
+        return done, stored_date
+
+    def base_filename(self, index):
+        return f"{self.prefix}_{index:07d}"
+
+    def path(self, index, extension):
+        return os.path.join(self.output_dir, f"{self.base_filename(index)}{extension}")
+
+    def _is_complete(self, entry):
+        for name, size in entry["files"].items():
+            path = os.path.join(self.output_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def is_done(self, index):
+        entry = self.done.get(index)
+        return entry is not None and self._is_complete(entry)
+
+    def pending(self):
+        """Номера сэмплов, которые еще нужно сгенерировать"""
+        skipped = 0
+        for index in range(self.count):
+            if self.is_done(index):
+                skipped += 1
+                continue
+            yield index
+        if skipped:
+            print(f"🔄 Пропущено уже готовых сэмплов: {skipped}")
+
+    def record(self, index, paths, **extra):
+        """extra (например, строка метаданных) сохраняется в журнале и доступна после resume"""
+        entry = {
+            "index": index,
+            "seed": self.seed,
+            "files": {os.path.basename(p): os.path.getsize(p) for p in paths},
+            **extra,
+        }
+        self.done[index] = entry
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._since_sync += 1
+        if self._since_sync >= self.flush_every:
+            os.fsync(self._journal.fileno())
+            self._since_sync = 0
+
+    def close(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal.close()
@@ -0,0 +1,133 @@
+import os
+import random
+import hashlib
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+
+
+class GlyphAtlas:
+    """
+    Кэш растеризованных строк: альфа-маска (L) и ее смещение от точки рисования по ключу (шрифт, размер, текст).
+    Словари адресов маленькие, поэтому одни и те же строки и буквы повторяются постоянно: FreeType
+    работает только на промахе, дальше рисование - это заливка цветом чернил через готовую маску.
+
+    В памяти держится не больше max_items масок (LRU). С cache_dir маски еще и сохраняются в PNG
+    (смещение - в текстовом чанке), и следующие запуски и процессы начинают с прогретым атласом.
+    """
+
+    def __init__(self, max_items=4096, cache_dir=None):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self._masks = OrderedDict()
+        self._fonts = {}
+        self._font_ids = {}
+        self._advances = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _font_id(self, font_path):
+        """Хэш содержимого файла шрифта: одноименные шрифты разных версий не делят маски, в том числе на диске"""
+        if font_path not in self._font_ids:
+            with open(font_path, "rb") as f:
+                self._font_ids[font_path] = hashlib.sha1(f.read()).hexdigest()[:16]
+        return self._font_ids[font_path]
+
+    def font(self, font_path, size):
+        """FreeTypeFont и идентификатор его файла для ключей кэша"""
+        key = (font_path, size)
+        if key not in self._fonts:
+            self._fonts[key] = (ImageFont.truetype(font_path, size), self._font_id(font_path))
+        return self._fonts[key]
+
+    def _disk_path(self, font_id, size, text):
+        digest = hashlib.sha1(f"{font_id}\x00{size}\x00{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.png")
+
+    def _rasterize(self, font, text):
+        left, top, right, bottom = font.getbbox(text)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        return mask, (left, top)
+
+    def _load(self, path):
+        with Image.open(path) as stored:
+            stored.load()
+            left, top = map(int, stored.text["offset"].split(","))
+            return stored.convert("L"), (left, top)
+
+    def _store(self, path, entry):
+        mask, (left, top) = entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        info = PngInfo()
+        info.add_text("offset", f"{left},{top}")
+        # Несколько процессов генерации могут писать одну и ту же маску одновременно
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        mask.save(tmp_path, "PNG", pnginfo=info)
+        os.replace(tmp_path, path)
+
+    def mask(self, font_path, size, text):
+        """(маска, (dx, dy)): маску нужно класть в (x + dx, y + dy), где (x, y) - точка как у ImageDraw.text"""
+        font, font_id = self.font(font_path, size)
+        key = (font_id, size, text)
+        entry = self._masks.get(key)
+        if entry is not None:
+            self._masks.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        path = self._disk_path(font_id, size, text) if self.cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                entry = self._load(path)
+            except (OSError, KeyError, ValueError):
+                # Недописанный или чужой файл - просто растеризуем заново
+                entry = None
+        if entry is None:
+            entry = self._rasterize(font, text)
+            if path:
+                self._store(path, entry)
+
+        self._masks[key] = entry
+        if len(self._masks) > self.max_items:
+            self._masks.popitem(last=False)
+        return entry
+
+    def advances(self, font_path, size, text):
+        """Отступ каждой буквы от начала строки с учетом кернинга (для раскладки по буквам)"""
+        font, font_id = self.font(font_path, size)
+        key = (font_id, size, text)
+        if key not in self._advances:
+            if len(self._advances) >= self.max_items:
+                self._advances.clear()
+            self._advances[key] = [font.getlength(text[:i]) for i in range(len(text))]
+        return self._advances[key]
+
+    def draw_text(self, layer, xy, text, font_path, size, fill, jitter=0):
+        """
+        Замена ImageDraw.text через атлас. В отличие от ImageDraw.text, который учитывает дробную часть
+        координат при растеризации, маски кладутся с точностью до пикселя (координаты CVAT округляются),
+        так что результат может отличаться от ImageDraw.text на долю пикселя.
+        jitter > 0 раскладывает строку по буквам и сдвигает каждую
+        на случайные +/- jitter px по вертикали (и на треть этого по горизонтали), чтобы одинаковые слова
+        не выглядели штампом. Возвращает фактические границы чернил (left, top, right, bottom).
+        """
+        x, y = xy
+        if jitter <= 0:
+            pieces = [(text, 0.0, 0)]
+        else:
+            pieces = [(ch, advance + random.uniform(-jitter / 3, jitter / 3), random.randint(-jitter, jitter))
+                      for ch, advance in zip(text, self.advances(font_path, size, text)) if not ch.isspace()]
+
+        bounds = None
+        for piece, shift_x, shift_y in pieces:
+            mask, (dx, dy) = self.mask(font_path, size, piece)
+            left, top = int(round(x + shift_x + dx)), int(round(y + shift_y + dy))
+            right, bottom = left + mask.width, top + mask.height
+            layer.paste(fill, (left, top, right, bottom), mask)
+            bounds = (left, top, right, bottom) if bounds is None else (
+                min(bounds[0], left), min(bounds[1], top), max(bounds[2], right), max(bounds[3], bottom))
+        return bounds or (int(x), int(y), int(x), int(y))
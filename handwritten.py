@@ -3,25 +3,34 @@ import random
 import argparse
 import json
 import xml.etree.ElementTree as ET
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from augmentor import ImageAugmentor
+from glyph_atlas import GlyphAtlas
+from generation_jobs import GenerationJob, seed_sample, save_image_atomic, save_json_atomic
+from field_crops import rect_quad, flatten_quads, unflatten_quads
 
 
 class PassportGenerator:
-    def __init__(self, template_path, xml_path, fonts_dir, output_dir="generated"):
+    def __init__(self, template_path, xml_path, fonts_dir, output_dir="generated", atlas_dir=None, glyph_jitter=0):
         self.template_path = template_path
+        # Шаблон открывается один раз: alpha_composite все равно создает новую картинку
+        self._template = None
         self.output_dir = output_dir
 
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        self.fonts = [os.path.join(fonts_dir, f) for f in os.listdir(fonts_dir)
+        # Сортируем, чтобы выбор шрифта по сиду не зависел от порядка os.listdir
+        self.fonts = [os.path.join(fonts_dir, f) for f in sorted(os.listdir(fonts_dir))
                       if f.lower().endswith(('.ttf', '.otf'))]
 
         if not self.fonts:
             raise IOError(f"Не найдено шрифтов в папке: {fonts_dir}")
 
         self.fields = self._parse_cvat_xml(xml_path)
+        # Строки адреса из маленьких словарей: растеризуем каждую один раз (см. glyph_atlas.py)
+        self.atlas = GlyphAtlas(cache_dir=atlas_dir)
+        self.glyph_jitter = glyph_jitter
 
     def _parse_cvat_xml(self, xml_path):
         tree = ET.parse(xml_path)
@@ -77,12 +86,18 @@ class PassportGenerator:
         if "apart_nmb" in self.fields: data["apart_nmb"] = str(random.randint(1, 150))
         return data
 
-    def render(self, augmentor, apply_aug_prob, filename_prefix="handwritten"):
-        img = Image.open(self.template_path).convert("RGBA")
+    def compose(self, augmentor, apply_aug_prob, fields=None):
+        """
+        Рисует один образец в памяти, возвращает (картинка RGB, данные).
+        В fields (если передан) добавляются строки {"label", "text", "quad"} по фактическим границам текста.
+        """
+        if self._template is None:
+            self._template = Image.open(self.template_path).convert("RGBA")
+        img = self._template
         txt_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
 
         data = self.generate_fake_data()
+        drawn = []
 
         # Проверка на наличие шрифтов
         if not self.fonts:
@@ -105,7 +120,7 @@ class PassportGenerator:
             if font_size <= 0: font_size = 12  # Защита от нулевого размера
 
             try:
-                font = ImageFont.truetype(font_path, font_size)
+                self.atlas.font(font_path, font_size)
             except Exception as e:
                 print(f"Ошибка шрифта {font_path}: {e}")
                 continue
@@ -115,17 +130,35 @@ class PassportGenerator:
             # y_bottom - это низ бокса. Поднимаем текст на высоту шрифта + шум
             y = coords['y_bottom'] - font_size + random.randint(-5, 5)
 
-            # Рисуем текст на прозрачном слое
-            draw.text((x, y), text, font=font, fill=ink_color)
+            # Рисуем текст на прозрачном слое: готовая маска из атласа + цвет чернил
+            bounds = self.atlas.draw_text(txt_layer, (x, y), text, font_path, font_size, ink_color, self.glyph_jitter)
+            drawn.append({"label": label, "text": text, "quad": rect_quad(*bounds)})
 
         # Слияние текста с шаблоном
         final_img = Image.alpha_composite(img, txt_layer).convert("RGB")  # Конвертируем в RGB для JPG
 
         # Применение аугментации с заданной вероятностью
         if random.random() < apply_aug_prob:
-            final_img = augmentor.process(final_img)
+            final_img, points = augmentor.process(final_img, flatten_quads(drawn))
+            drawn = unflatten_quads(drawn, points)
             print(f"    ✨ Аугментация применена.")
 
+        if fields is not None:
+            fields.extend(drawn)
+        return final_img, data
+
+    def render(self, augmentor, apply_aug_prob, filename_prefix="handwritten", job=None, index=None):
+        final_img, data = self.compose(augmentor, apply_aug_prob)
+
+        if job is not None:
+            # Имя по номеру сэмпла: без коллизий и восстанавливается при --resume
+            image_path, json_path = job.path(index, ".jpg"), job.path(index, ".json")
+            save_image_atomic(final_img, image_path, quality=random.randint(85, 98))
+            save_json_atomic(data, json_path)
+            job.record(index, [image_path, json_path])
+            print(f"✅ Saved sample: {image_path} + JSON")
+            return
+
         # --- СОХРАНЕНИЕ (ИЗМЕНЕНО) ---
 
         # Генерируем ID один раз, чтобы он совпал для обоих файлов
@@ -154,6 +187,11 @@ if __name__ == "__main__":
     parser.add_argument('--out', type=str, default='generated', help='Папка для сохранения результатов.')
     parser.add_argument('--aug-prob', type=float, default=1/3, help='Вероятность применения всего набора аугментаций к изображению.')
     parser.add_argument('--aug-internal-prob', type=float, default=0.7, help='Вероятность применения каждого отдельного искажения внутри аугментатора.')
+    parser.add_argument('--atlas-dir', type=str, default=None, help='Папка для сохранения масок строк между запусками.')
+    parser.add_argument('--glyph-jitter', type=int, default=0, help='Случайный сдвиг каждой буквы, px (0 - строка целиком).')
+    parser.add_argument('--job', action='store_true', help='Режим задания: детерминированные имена/сиды и журнал прогресса.')
+    parser.add_argument('--seed', type=int, default=0, help='Сид задания (режим --job).')
+    parser.add_argument('--resume', action='store_true', help='Продолжить задание, пропуская готовые сэмплы.')
     args = parser.parse_args()
 
     try:
@@ -162,11 +200,22 @@ if __name__ == "__main__":
             template_path=args.template,
             xml_path=args.xml,
             fonts_dir=args.fonts,
-            output_dir=args.out
+            output_dir=args.out,
+            atlas_dir=args.atlas_dir,
+            glyph_jitter=args.glyph_jitter
         )
         print(f"🚀 Начинаем генерацию {args.count} рукописных образцов...")
-        for i in range(args.count):
-            gen.render(augmentor, args.aug_prob, f"handwritten_{i}")
-        print("🎉 Генерация завершена!")
+        if args.job or args.resume:
+            job = GenerationJob(args.out, "handwritten", args.count, args.seed, args.resume)
+            try:
+                for i in job.pending():
+                    seed_sample(args.seed, i)
+                    gen.render(augmentor, args.aug_prob, job=job, index=i)
+            finally:
+                job.close()
+        else:
+            for i in range(args.count):
+                gen.render(augmentor, args.aug_prob, f"handwritten_{i}")
+        print(f"🎉 Генерация завершена! Атлас: {gen.atlas.hits} попаданий, {gen.atlas.misses} растеризаций")
     except Exception as e:
         print(f"❌ Произошла критическая ошибка: {e}")
@@ -0,0 +1,89 @@
+import math
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def processor_draft_size(processor):
+    """
+    Сколько пикселей должно остаться по меньшей стороне после draft(). Процессор Donut приводит
+    меньшую сторону картинки к min(height, width) с сохранением пропорций (потом только уменьшает
+    под рамку), поэтому декодировать крупнее этого незачем.
+    """
+    size = processor.image_processor.size
+    if isinstance(size, dict):
+        if "shortest_edge" in size:
+            return size["shortest_edge"]
+        return min(size["height"], size["width"])
+    return min(size)
+
+
+def draft_request(image_size, min_side):
+    """
+    Размер для PIL draft() с теми же пропорциями, что у картинки: draft() уменьшает в 2/4/8 раз,
+    только пока результат покрывает запрошенный размер по обеим сторонам.
+    """
+    width, height = image_size
+    scale = min_side / min(width, height)
+    if scale >= 1:
+        return None
+    return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+
+def load_image(image_path, draft_size=None):
+    """
+    Открывает картинку в RGB. Для больших JPEG-сканов draft() просит декодер сразу
+    выдать уменьшенную в 2/4/8 раз копию - это в разы быстрее полного декодирования.
+    draft_size - минимальная меньшая сторона результата (см. processor_draft_size).
+    """
+    image = Image.open(image_path)
+    if draft_size and image.format == "JPEG":
+        request = draft_request(image.size, draft_size)
+        if request:
+            image.draft("RGB", request)
+    return image.convert("RGB")
+
+
+def _prepare_batch(batch, processor, draft_size, orient=None):
+    loaded, failed = [], []
+    images = []
+    for key, image_path in batch:
+        try:
+            image = load_image(image_path, draft_size)
+            images.append(orient(image) if orient else image)
+            loaded.append(key)
+        except Exception as e:
+            failed.append((key, e))
+
+    pixel_values = processor(images, return_tensors="pt").pixel_values if images else None
+    return loaded, pixel_values, failed
+
+
+def prefetch_batches(items, processor, batch_size=1, workers=2, prefetch=2, orient=None):
+    """
+    Генератор пачек (keys, pixel_values, failed) для пар (key, image_path).
+    Пока модель считает текущую пачку, пул потоков уже декодирует и препроцессит следующие.
+    items читается лениво, так что подходит и для генератора файлов.
+    orient - необязательная функция выравнивания картинки (см. orientation.OrientationEstimator).
+    """
+    draft_size = processor_draft_size(processor)
+    items = iter(items)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_next():
+            batch = list(itertools.islice(items, batch_size))
+            if batch:
+                pending.append(pool.submit(_prepare_batch, batch, processor, draft_size, orient))
+            return bool(batch)
+
+        # Держим в очереди workers + prefetch пачек: порядок выдачи сохраняется
+        for _ in range(workers + prefetch):
+            if not submit_next():
+                break
+
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
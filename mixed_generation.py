@@ -0,0 +1,221 @@
+import os
+import json
+import argparse
+from multiprocessing import Pool
+from augmentor import ImageAugmentor
+from generation_jobs import GenerationJob, get_fake, seed_sample, save_image_atomic, set_reference_date
+from field_crops import DEFAULT_CROP_FIELDS, CropShardWriter, export_crops
+
+# Тип документа -> стартовый токен и значения по умолчанию для задания
+DOCUMENT_GENERATORS = {
+    "passport": {"task_prompt": "<s_passport>", "template": "Sloi-1.jpg", "xml": "annotations.xml",
+                 "extension": ".png"},
+    "registration": {"task_prompt": "<s_registration>", "template": "img.png", "xml": "annotations1.xml",
+                     "fonts": "fonts", "extension": ".jpg"},
+    "birth_certificate": {"task_prompt": "<s_birth_certificate>", "template": "img_1.png", "xml": "annotations2.xml",
+                          "extension": ".png"},
+}
+
+# Состояние процесса-воркера: задание и собранные по нему рендереры (шаблоны, разметка, аугментаторы)
+_SPEC = None
+_RENDERERS = {}
+
+
+def load_spec(spec_path):
+    """
+    Задание в JSON или YAML (нужен PyYAML):
+    {"output": ..., "count": ..., "seed": 0, "workers": 4, "reference_date": "2025-01-31",
+     "documents": [{"type": "passport", "count": 100 | "weight": 1.0, "template": ..., "xml": ...,
+                    "aug_prob": 0.33, "aug_internal_prob": 0.7,
+                    "atlas_dir": ..., "glyph_jitter": 0}, ...],  # последние два - только для registration
+     "crops": {"output": ..., "shard_size": 5000, "fields": {"passport": [...], ...}}}
+    reference_date - "сегодня" для дат в данных (по умолчанию берется из журнала или текущая).
+    Секция crops необязательна: с ней кропы полей пишутся в tar-шарды (см. field_crops.py).
+    """
+    with open(spec_path, "r", encoding="utf-8") as f:
+        if spec_path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Для YAML-заданий нужен PyYAML: pip install pyyaml")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    documents = []
+    for doc in spec["documents"]:
+        if doc["type"] not in DOCUMENT_GENERATORS:
+            raise ValueError(f"Неизвестный тип документа '{doc['type']}', доступны: {', '.join(DOCUMENT_GENERATORS)}")
+        documents.append({"aug_prob": 1 / 3, "aug_internal_prob": 0.7, **DOCUMENT_GENERATORS[doc["type"]], **doc})
+    spec["documents"] = documents
+
+    if "crops" in spec:
+        crops = {"output": os.path.join(spec["output"], "crops"), "shard_size": 5000, **(spec["crops"] or {})}
+        crops["fields"] = {**DEFAULT_CROP_FIELDS, **crops.get("fields", {})}
+        spec["crops"] = crops
+    return spec
+
+
+def plan_counts(spec):
+    """Явные count берутся как есть, остаток общего count делится по weight (метод наибольших остатков)"""
+    counts = [doc.get("count") for doc in spec["documents"]]
+    weighted = [i for i, count in enumerate(counts) if count is None]
+    if weighted:
+        remaining = spec.get("count", 0) - sum(c for c in counts if c is not None)
+        if remaining < 0:
+            raise ValueError("Сумма явных count больше общего count задания")
+        total_weight = sum(spec["documents"][i].get("weight", 1.0) for i in weighted)
+        shares = {i: remaining * spec["documents"][i].get("weight", 1.0) / total_weight for i in weighted}
+        for i in weighted:
+            counts[i] = int(shares[i])
+        by_remainder = sorted(weighted, key=lambda i: shares[i] - counts[i], reverse=True)
+        for i in by_remainder[:remaining - sum(counts[i] for i in weighted)]:
+            counts[i] += 1
+    return counts
+
+
+def interleave(counts):
+    """
+    Порядок сэмплов: k-й сэмпл документа d стоит на позиции (k + 0.5) / count_d, так что типы
+    равномерно перемешаны в любом префиксе. Зависит только от задания - номер сэмпла стабилен при resume.
+    """
+    slots = [((k + 0.5) / count, doc_idx) for doc_idx, count in enumerate(counts) for k in range(count)]
+    return [doc_idx for _, doc_idx in sorted(slots)]
+
+
+def _build_renderer(doc):
+    """Шаблон, разметка и шрифты готовятся один раз на процесс, дальше только рендер"""
+    from PIL import Image
+    augmentor = ImageAugmentor(probability=doc["aug_internal_prob"])
+
+    if doc["type"] == "registration":
+        from handwritten import PassportGenerator
+        generator = PassportGenerator(doc["template"], doc["xml"], doc["fonts"], output_dir=_SPEC["output"],
+                                      atlas_dir=doc.get("atlas_dir"), glyph_jitter=doc.get("glyph_jitter", 0))
+        return lambda fields=None: generator.compose(augmentor, doc["aug_prob"], fields)
+
+    template = Image.open(doc["template"]).convert("RGBA")
+    if doc["type"] == "passport":
+        from gen1_passports import parse_cvat_xml, find_font, render_passport
+        boxes = parse_cvat_xml(doc["xml"])
+        find_font()
+        return lambda fields=None: render_passport(template, boxes, augmentor, doc["aug_prob"], fields)
+
+    from gen2_birth_certificates import parse_cvat_polygon_xml, find_font, render_certificate
+    boxes = parse_cvat_polygon_xml(doc["xml"])
+    find_font()
+    return lambda fields=None: render_certificate(template, boxes, augmentor, doc["aug_prob"], fields)
+
+
+def _init_worker(spec):
+    global _SPEC
+    _SPEC = spec
+    set_reference_date(spec["reference_date"])
+    _RENDERERS.clear()
+
+
+def _render_sample(task):
+    index, doc_idx, with_crops = task
+    doc = _SPEC["documents"][doc_idx]
+    if doc_idx not in _RENDERERS:
+        _RENDERERS[doc_idx] = _build_renderer(doc)
+
+    seed_sample(_SPEC.get("seed", 0), index, get_fake())
+    fields = [] if with_crops else None
+    img, data = _RENDERERS[doc_idx](fields)
+
+    file_name = f"{doc['type']}_{index:07d}{doc['extension']}"
+    path = os.path.join(_SPEC["output"], file_name)
+    save_image_atomic(img, path, quality=95)
+    # Кропы режутся из того же изображения в памяти, до JPEG-сжатия
+    crops = []
+    if with_crops:
+        crops = export_crops(img, fields, doc["type"], file_name, _SPEC["crops"]["fields"].get(doc["type"]))
+    metadata = {
+        "file_name": file_name,
+        "ground_truth": json.dumps({"gt_parse": data}, ensure_ascii=False),
+        "doc_type": doc["type"],
+        "task_prompt": doc["task_prompt"],
+    }
+    return index, path, metadata, crops
+
+
+def write_metadata(job, output_dir):
+    """Общий metadata.jsonl по всем типам в порядке номеров сэмплов (формат create_metadata.py + тип и промпт)"""
+    path = os.path.join(output_dir, "metadata.jsonl")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for index in sorted(job.done):
+            f.write(json.dumps(job.done[index]["metadata"], ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _iter_results(spec, tasks, workers):
+    """Результаты в порядке номеров, чтобы журнал и индекс шли так же, как план"""
+    if workers <= 1:
+        _init_worker(spec)
+        yield from map(_render_sample, tasks)
+        return
+    # Один пул на все типы: каждый процесс держит свои шаблоны, Faker и аугментаторы для всех типов
+    with Pool(workers, initializer=_init_worker, initargs=(spec,)) as pool:
+        yield from pool.imap(_render_sample, tasks, chunksize=4)
+
+
+def run(spec, resume=False):
+    counts = plan_counts(spec)
+    order = interleave(counts)
+    output_dir = spec["output"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    for doc, count in zip(spec["documents"], counts):
+        print(f"📋 {doc['type']} ({doc['template']}): {count} шт., промпт {doc['task_prompt']}")
+
+    job = GenerationJob(output_dir, "mixed", len(order), spec.get("seed", 0), resume,
+                        reference_date=spec.get("reference_date"))
+    # Процессы пула получают дату через spec: у всех сэмплов одно "сегодня", записанное в журнале
+    spec = dict(spec, reference_date=job.reference_date.isoformat())
+    writer = None
+    open_shards = set()
+    if spec.get("crops"):
+        writer = CropShardWriter(spec["crops"]["output"], spec["crops"]["shard_size"])
+        # Шард пишется целиком, поэтому сэмплы недописанного шарда рендерятся заново, даже если картинки уже есть
+        open_shards = {writer.shard_of(index) for index in range(len(order))
+                       if not (resume and writer.is_complete(writer.shard_of(index)))}
+    tasks = [(index, order[index], writer is not None and writer.shard_of(index) in open_shards)
+             for index in range(len(order))
+             if not job.is_done(index) or (writer is not None and writer.shard_of(index) in open_shards)]
+    workers = spec.get("workers", os.cpu_count() or 1)
+    print(f"🚀 Генерация {len(tasks)} из {len(order)} сэмплов, процессов: {workers}")
+
+    try:
+        for done, (index, path, metadata, crops) in enumerate(_iter_results(spec, tasks, workers), 1):
+            job.record(index, [path], metadata=metadata)
+            if writer is not None and writer.shard_of(index) in open_shards:
+                writer.write(index, crops)
+            if done % 100 == 0:
+                print(f"✅ Готово {done}/{len(tasks)}")
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        job.close()
+
+    metadata_path = write_metadata(job, output_dir)
+    print(f"🎉 Генерация завершена! Индекс: {metadata_path} ({len(job.done)} сэмплов)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Смешанная генерация документов всех типов по одному заданию")
+    parser.add_argument('spec', type=str, help='Задание в JSON или YAML')
+    parser.add_argument('--resume', action='store_true', help='Продолжить задание: готовые сэмплы пропускаются')
+    parser.add_argument('--workers', type=int, default=None, help='Переопределить число процессов из задания')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.workers is not None:
+        spec["workers"] = args.workers
+    run(spec, args.resume)
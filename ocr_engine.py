@@ -0,0 +1,279 @@
+import threading
+from collections import OrderedDict
+from PIL import Image
+from ocr_utils import clean_sequence, sequence_to_dict
+from image_pipeline import load_image, processor_draft_size
+
+# torch и transformers импортируются внутри методов: CLI с --help или ошибкой в аргументах
+# не должен платить секунды за их загрузку
+
+# Тип документа -> (папка с обученной моделью, стартовый токен)
+DOCUMENT_TYPES = {
+    "passport": ("models_ready/donut_passport_v1", "<s_passport>"),
+    "registration": ("models_ready/donut_registration_v1", "<s_registration>"),
+}
+
+# Настройки генерации по умолчанию (как в test_ocr.py)
+DEFAULT_GENERATION = {
+    "max_length": 768,
+    "use_cache": True,
+}
+
+# Настройки, с которыми валидирует evaluate_models.py
+EVAL_GENERATION = {
+    "max_length": 768,
+    "use_cache": True,
+    "repetition_penalty": 1.2,
+    "num_beams": 2,
+}
+
+# (папка модели, устройство) -> (процессор, модель), загруженные заранее в warm worker (см. preload)
+_PRELOADED = {}
+
+
+class LoadedModel:
+    """Загруженная модель вместе с процессором и закэшированными токенами промпта"""
+
+    def __init__(self, processor, model, task_prompt, device, schema=None):
+        self.processor = processor
+        self.model = model
+        self.task_prompt = task_prompt
+        self.schema = schema
+        self.prompt_ids = processor.tokenizer(
+            task_prompt, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(device)
+
+
+class OCREngine:
+    """
+    Движок распознавания: каждая модель грузится с диска один раз и живет в LRU-кэше
+    (не больше max_models одновременно), промпт токенизируется один раз на модель.
+    quantized=True берет int8-артефакты из <модель>_int8 (см. quantize_model.py),
+    backend="onnx" - графы ONNX Runtime из <модель>_onnx (см. onnx_export.py). Оба варианта работают только на CPU.
+    schema_stopping=True включает остановку по схеме полей и бюджет длины (см. schema_decoding.py).
+    auto_orient=True перед препроцессингом ставит сканы ровно (0/90/180/270, см. orientation.py).
+    """
+
+    def __init__(self, device=None, max_models=2, generation_kwargs=None, document_types=None, quantized=False,
+                 backend="torch", schema_stopping=False, auto_orient=False):
+        self.quantized = quantized
+        self.backend = backend
+        self.schema_stopping = schema_stopping
+        self.auto_orient = auto_orient
+        # Схема полей лежит рядом с исходной моделью, а не с ее int8/onnx-вариантами
+        self.schema_paths = {doc_type: model_path for doc_type, (model_path, _) in (document_types or DOCUMENT_TYPES).items()}
+        if quantized or backend == "onnx":
+            device = "cpu"
+        if device is None:
+            import torch
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self.max_models = max_models
+        self.generation_kwargs = dict(generation_kwargs or DEFAULT_GENERATION)
+        self.document_types = dict(document_types or DOCUMENT_TYPES)
+        suffix = "_onnx" if backend == "onnx" else "_int8" if quantized else ""
+        if suffix:
+            self.document_types = {
+                doc_type: (f"{model_path}{suffix}", task_prompt)
+                for doc_type, (model_path, task_prompt) in self.document_types.items()
+            }
+        # _lock держится только на чтение/публикацию в _models: загрузка весов идет под замком своего типа
+        # документа (_loading), а процессоры и ориентаторы - под отдельным _prep_lock, чтобы препроцессинг
+        # в соседних потоках не ждал from_pretrained модели
+        self._models = OrderedDict()
+        self._processors = {}
+        self._orienters = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._prep_lock = threading.Lock()
+
+    def _document(self, doc_type):
+        if doc_type not in self.document_types:
+            raise ValueError(f"Тип документа должен быть одним из: {', '.join(self.document_types)}")
+        return self.document_types[doc_type]
+
+    def get_processor(self, doc_type):
+        """Процессор грузится быстро, его можно получить раньше модели и готовить картинки параллельно"""
+        processor = self._processors.get(doc_type)
+        if processor is not None:
+            return processor
+        with self._prep_lock:
+            if doc_type not in self._processors:
+                model_path, _ = self._document(doc_type)
+                if (model_path, self.device) in _PRELOADED:
+                    self._processors[doc_type] = _PRELOADED[(model_path, self.device)][0]
+                else:
+                    from transformers import DonutProcessor
+                    self._processors[doc_type] = DonutProcessor.from_pretrained(model_path)
+            return self._processors[doc_type]
+
+    def _load_model(self, model_path):
+        if (model_path, self.device) in _PRELOADED:
+            return _PRELOADED[(model_path, self.device)][1]
+        if self.backend == "onnx":
+            # onnxruntime - необязательная зависимость, импортируем только когда она нужна
+            from onnx_backend import OnnxDonutModel
+            return OnnxDonutModel(model_path)
+        from transformers import VisionEncoderDecoderModel
+        from quantize_model import is_quantized_dir, load_quantized
+        if is_quantized_dir(model_path):
+            model = load_quantized(model_path)
+        else:
+            model = VisionEncoderDecoderModel.from_pretrained(model_path)
+        model.to(self.device)
+        model.eval()
+        return model
+
+    def _cached(self, doc_type):
+        with self._lock:
+            loaded = self._models.get(doc_type)
+            if loaded is not None:
+                self._models.move_to_end(doc_type)
+            return loaded
+
+    def get(self, doc_type):
+        loaded = self._cached(doc_type)
+        if loaded is not None:
+            return loaded
+
+        model_path, task_prompt = self._document(doc_type)
+        with self._lock:
+            loading = self._loading.setdefault(doc_type, threading.Lock())
+        # Один поток грузит модель, остальные потоки с тем же типом ждут его, а не грузят вторую копию
+        with loading:
+            loaded = self._cached(doc_type)
+            if loaded is not None:
+                return loaded
+
+            processor = self.get_processor(doc_type)
+            print(f"⏳ Загрузка модели из {model_path}...")
+            model = self._load_model(model_path)
+            print(f"⚡ Устройство: {self.device}")
+
+            schema = None
+            if self.schema_stopping:
+                from schema_decoding import load_schema
+                schema = load_schema(self.schema_paths.get(doc_type, model_path), doc_type)
+            loaded = LoadedModel(processor, model, task_prompt, self.device, schema)
+
+            with self._lock:
+                self._models[doc_type] = loaded
+                evicted = []
+                while len(self._models) > self.max_models:
+                    evicted.append(self._models.popitem(last=False)[0])
+            for name in evicted:
+                print(f"♻️ Модель '{name}' выгружена из кэша")
+            return loaded
+
+    def orienter(self, doc_type):
+        """Функция выравнивания для prefetch_batches/preprocess или None, если auto_orient выключен"""
+        if not self.auto_orient:
+            return None
+        orient = self._orienters.get(doc_type)
+        if orient is not None:
+            return orient
+        with self._prep_lock:
+            if doc_type not in self._orienters:
+                from orientation import estimator_for
+                self._orienters[doc_type] = estimator_for(doc_type)
+            return self._orienters[doc_type]
+
+    def preprocess(self, images, doc_type):
+        """Картинки (PIL или пути) -> pixel_values одной пачкой"""
+        processor = self.get_processor(doc_type)
+        draft_size = processor_draft_size(processor)
+        images = [image if isinstance(image, Image.Image) else load_image(image, draft_size) for image in images]
+        orient = self.orienter(doc_type)
+        if orient:
+            images = [orient(image) for image in images]
+        return processor(images, return_tensors="pt").pixel_values
+
+    def encode(self, pixel_values, doc_type):
+        """Только энкодер: pixel_values -> last_hidden_state (на CPU, для кэширования)"""
+        import torch
+        loaded = self.get(doc_type)
+        with torch.no_grad():
+            if self.backend == "onnx":
+                return torch.from_numpy(loaded.model.encode(pixel_values.numpy()))
+            return loaded.model.encoder(pixel_values.to(self.device)).last_hidden_state.cpu()
+
+    def generate(self, pixel_values, doc_type, **generation_kwargs):
+        """
+        Распознает пачку pixel_values одним вызовом generate и возвращает словари полей.
+        Промпт у всех одинаковой длины, а картинки приведены процессором к одному размеру,
+        поэтому паддинг нужен только на выходе (закончившиеся строки добиваются pad-токеном).
+        """
+        inputs = {"pixel_values": pixel_values.to(self.device)}
+        return self._generate(self.get(doc_type), pixel_values.shape[0], inputs, generation_kwargs)
+
+    def generate_from_encoder(self, hidden_states, doc_type, **generation_kwargs):
+        """То же, что generate, но по готовым hidden states энкодера (см. encode)"""
+        from transformers.modeling_outputs import BaseModelOutput
+        inputs = {"encoder_outputs": BaseModelOutput(last_hidden_state=hidden_states.to(self.device))}
+        return self._generate(self.get(doc_type), hidden_states.shape[0], inputs, generation_kwargs)
+
+    def decode_kwargs(self, loaded, batch_size, **generation_kwargs):
+        """
+        Все аргументы model.generate, кроме входа энкодера: промпт, служебные токены, запрет <unk>,
+        настройки движка и остановка по схеме. Общие для _generate и benchmark.py, чтобы замеры шли тем же путем.
+        """
+        processor = loaded.processor
+        kwargs = dict(self.generation_kwargs, **generation_kwargs)
+        decoder_input_ids = loaded.prompt_ids.repeat(batch_size, 1)
+
+        # Явно переданные stopping_criteria (например, пустые в benchmark.py) отключают остановку по схеме
+        if self.schema_stopping and "stopping_criteria" not in kwargs:
+            # Бюджет длины из схемы заменяет общий max_length, но не явно переданный в вызов
+            if loaded.schema.get("max_length") and "max_length" not in generation_kwargs:
+                kwargs["max_length"] = min(kwargs.get("max_length", loaded.schema["max_length"]),
+                                           loaded.schema["max_length"])
+            from transformers import LogitsProcessorList, StoppingCriteriaList
+            from schema_decoding import SchemaStoppingCriteria, StoppedRowsEosProcessor
+            criteria = SchemaStoppingCriteria(processor.tokenizer, loaded.schema["fields"], decoder_input_ids.shape[1])
+            if kwargs.get("num_beams", 1) > 1 and self.backend != "onnx":
+                # HF beam search по stopping_criteria ждет остановки всех строк - лучи закрываем через eos.
+                # Свой beam search ONNX-бэкенда делает то же сам по stopping_criteria
+                kwargs["logits_processor"] = LogitsProcessorList(
+                    [StoppedRowsEosProcessor(criteria, processor.tokenizer.eos_token_id)])
+            else:
+                kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+
+        return dict(
+            decoder_input_ids=decoder_input_ids,
+            pad_token_id=processor.tokenizer.pad_token_id,
+            eos_token_id=processor.tokenizer.eos_token_id,
+            bad_words_ids=[[processor.tokenizer.unk_token_id]],
+            return_dict_in_generate=True,
+            **kwargs
+        )
+
+    def _generate(self, loaded, batch_size, inputs, generation_kwargs):
+        import torch
+        processor = loaded.processor
+        with torch.no_grad():
+            outputs = loaded.model.generate(**inputs, **self.decode_kwargs(loaded, batch_size, **generation_kwargs))
+
+        # Постобработка всей пачки: batch_decode + очистка + разбор в словарь
+        sequences = processor.batch_decode(outputs.sequences)
+        return [sequence_to_dict(processor, clean_sequence(processor, seq, loaded.task_prompt)) for seq in sequences]
+
+    def recognize_batch(self, images, doc_type, **generation_kwargs):
+        if not images:
+            return []
+        return self.generate(self.preprocess(images, doc_type), doc_type, **generation_kwargs)
+
+    def recognize(self, image, doc_type, **generation_kwargs):
+        return self.recognize_batch([image], doc_type, **generation_kwargs)[0]
+
+
+def preload(doc_types, **engine_kwargs):
+    """
+    Загружает модели заранее, чтобы ими пользовались все OCREngine процесса с тем же устройством.
+    Нужно warm worker'у (warm_worker.py): дочерние процессы получают веса через fork без чтения с диска.
+    """
+    engine = OCREngine(**engine_kwargs)
+    for doc_type in doc_types:
+        loaded = engine.get(doc_type)
+        model_path, _ = engine.document_types[doc_type]
+        _PRELOADED[(model_path, engine.device)] = (loaded.processor, loaded.model)
+    return engine
@@ -0,0 +1,248 @@
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from ocr_engine import OCREngine, DOCUMENT_TYPES
+from image_pipeline import load_image, processor_draft_size
+
+
+class ServerMetrics:
+    """Метрики сервера: гистограмма размеров батчей и задержки последних запросов"""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batch_sizes[size] += 1
+
+    def record_request(self, latency, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(not ok)
+            self.latencies.append(latency)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self, queue_depth):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "queue_depth": queue_depth,
+                "requests": self.requests,
+                "errors": self.errors,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                "latency_ms": {
+                    "p50": self._percentile(latencies, 50),
+                    "p99": self._percentile(latencies, 99),
+                },
+            }
+
+
+class OCRRequest:
+    def __init__(self, pixel_values, doc_type):
+        self.pixel_values = pixel_values
+        self.doc_type = doc_type
+        self.future = Future()
+        self.created = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Один поток, который собирает конкурентные запросы в микробатчи:
+    ждет первый запрос, затем добирает остальные, пока не наберется max_batch_size
+    или не истечет max_wait_ms. На каждый тип документа - один вызов generate.
+    """
+
+    def __init__(self, engine, metrics, max_batch_size=8, max_wait_ms=20):
+        self.engine = engine
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        # torch нужен только потоку батчей (импорт модуля сервера и --help его не грузят), но импортируем его
+        # здесь: ошибка импорта внутри daemon-потока пропала бы молча, а запросы висели бы до таймаута
+        import torch
+        self._cat = torch.cat
+        self.thread.start()
+
+    def submit(self, pixel_values, doc_type):
+        request = OCRRequest(pixel_values, doc_type)
+        self.queue.put(request)
+        return request.future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            by_type = {}
+            for request in self._collect():
+                by_type.setdefault(request.doc_type, []).append(request)
+
+            for doc_type, requests in by_type.items():
+                self.metrics.record_batch(len(requests))
+                try:
+                    pixel_values = self._cat([r.pixel_values for r in requests])
+                    results = self.engine.generate(pixel_values, doc_type)
+                except Exception as e:
+                    for request in requests:
+                        request.future.set_exception(e)
+                    continue
+                for request, result in zip(requests, results):
+                    request.future.set_result(result)
+
+
+class OCRRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /recognize?type=passport  - тело: байты картинки или JSON {"path": "..."}
+    GET  /metrics                  - очередь, гистограмма батчей, p50/p99
+
+    JSON с путем принимается, только если сервер запущен с --image-root, и только для файлов внутри этой папки:
+    иначе любой клиент мог бы заставить сервер читать произвольные локальные файлы.
+    """
+
+    server_version = "DonutOCR/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _resolve_path(self, path):
+        """Путь из запроса -> файл внутри image_root или None"""
+        root = self.server.image_root
+        if root is None:
+            return None
+        resolved = os.path.realpath(os.path.join(root, path))
+        try:
+            return resolved if os.path.commonpath([root, resolved]) == root else None
+        except ValueError:
+            # Windows: путь на другом диске
+            return None
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/metrics":
+            self._send_json(200, self.server.metrics.snapshot(self.server.batcher.queue.qsize()))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/recognize":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        started = time.perf_counter()
+        doc_type = parse_qs(url.query).get("type", ["passport"])[0]
+        if doc_type not in DOCUMENT_TYPES:
+            self._send_json(400, {"error": f"неизвестный тип документа: {doc_type}"})
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        engine = self.server.engine
+        try:
+            # Картинку декодируем и препроцессим прямо в потоке запроса - параллельно с генерацией батча
+            draft_size = processor_draft_size(engine.get_processor(doc_type))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                path = self._resolve_path(json.loads(body)["path"])
+                if path is None:
+                    self._send_json(403, {"error": "чтение по пути запрещено: передайте байты картинки "
+                                                   "или запустите сервер с --image-root"})
+                    return
+                image = load_image(path, draft_size)
+            else:
+                image = load_image(io.BytesIO(body), draft_size)
+            pixel_values = engine.preprocess([image], doc_type)
+        except Exception as e:
+            self._send_json(400, {"error": f"не удалось прочитать картинку: {e}"})
+            return
+
+        try:
+            result = self.server.batcher.submit(pixel_values, doc_type).result(timeout=self.server.request_timeout)
+        except Exception as e:
+            self.server.metrics.record_request((time.perf_counter() - started) * 1000, ok=False)
+            self._send_json(500, {"error": str(e)})
+            return
+
+        latency = (time.perf_counter() - started) * 1000
+        self.server.metrics.record_request(latency)
+        self._send_json(200, {"doc_type": doc_type, "fields": result, "latency_ms": round(latency, 1)})
+
+    def log_message(self, format, *args):
+        # Стандартный лог http.server на каждый запрос только шумит
+        pass
+
+
+class OCRServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine, max_batch_size=8, max_wait_ms=20, request_timeout=120, image_root=None):
+        super().__init__(address, OCRRequestHandler)
+        self.engine = engine
+        self.image_root = os.path.realpath(image_root) if image_root else None
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(engine, self.metrics, max_batch_size, max_wait_ms)
+        self.request_timeout = request_timeout
+        self.batcher.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный OCR-сервер с динамическим микробатчингом")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--types', type=str, nargs='+', choices=list(DOCUMENT_TYPES), default=list(DOCUMENT_TYPES),
+                        help='Какие модели загрузить заранее')
+    parser.add_argument('--device', type=str, default=None, help='cpu / cuda (по умолчанию - cuda, если доступна)')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='Максимальный размер микробатча')
+    parser.add_argument('--max-wait-ms', type=float, default=20, help='Сколько ждать добора батча после первого запроса')
+    parser.add_argument('--schema-stop', action='store_true', help='Остановка генерации по схеме полей и при зацикливании')
+    parser.add_argument('--auto-orient', action='store_true', help='Выравнивать повернутые сканы перед распознаванием')
+    parser.add_argument('--image-root', type=str, default=None,
+                        help='Разрешить JSON {"path": ...} для файлов внутри этой папки (по умолчанию только байты)')
+    args = parser.parse_args()
+
+    engine = OCREngine(device=args.device, max_models=len(DOCUMENT_TYPES), schema_stopping=args.schema_stop,
+                       auto_orient=args.auto_orient)
+    for doc_type in args.types:
+        engine.get(doc_type)
+
+    server = OCRServer((args.host, args.port), engine, args.max_batch_size, args.max_wait_ms,
+                       image_root=args.image_root)
+    print(f"🚀 OCR-сервер слушает http://{args.host}:{args.port} (POST /recognize?type=..., GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Сервер остановлен")
@@ -0,0 +1,134 @@
+import json
+import re
+
+try:
+    # rapidfuzz считает расстояние Левенштейна на C++, на длинных строках это в десятки раз быстрее
+    from rapidfuzz.distance import Levenshtein as _rf_levenshtein
+except ImportError:
+    _rf_levenshtein = None
+
+
+def clean_sequence(processor, sequence, task_prompt):
+    """Убирает технические токены (eos, pad и сам стартовый промпт) из декодированной строки"""
+    sequence = sequence.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
+    return re.sub(r"^" + re.escape(task_prompt), "", sequence).strip()
+
+
+def sequence_to_dict(processor, sequence):
+    """Превращает ответ модели в словарь полей"""
+    predicted_dict = processor.token2json(sequence)
+
+    # ЕСЛИ МОДЕЛЬ ВЫДАЛА СЫРОЙ JSON (так учит train_donut.py), чистим и парсим его напрямую:
+    if "text_sequence" in predicted_dict:
+        raw_text = predicted_dict["text_sequence"]
+        # Пытаемся вырезать всё лишнее и оставить только сам словарь
+        try:
+            # Ищем структуру {"gt_parse": {...}}
+            match = re.search(r'{"gt_parse":\s*({.*?})}', raw_text)
+            if match:
+                predicted_dict = json.loads(match.group(1))
+            else:
+                # Если совсем мусор
+                predicted_dict = {"error": raw_text}
+        except json.JSONDecodeError:
+            predicted_dict = {"error": "JSON_Decode_Error"}
+
+    return predicted_dict
+
+
+def edit_distance(a, b):
+    """Расстояние Левенштейна между двумя строками"""
+    if _rf_levenshtein is not None:
+        return _rf_levenshtein.distance(a, b)
+
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            ))
+        previous = current
+    return previous[-1]
+
+
+def char_error_rate(truth, pred):
+    """CER = ошибки / длина эталона. Пустой эталон: 0, если и ответ пустой, иначе 1"""
+    if not truth:
+        return 0.0 if not pred else 1.0
+    return edit_distance(truth, pred) / len(truth)
+
+
+def score_sample(truth_dict, pred_dict):
+    """
+    Метрики одного документа по каждому полю эталона.
+    Поле, которого нет в ответе, считается пустой строкой.
+    CER документа = сумма ошибок по полям / суммарная длина эталонных полей,
+    так что порядок ключей в ответе на метрику не влияет.
+    """
+    fields = {}
+    total_errors, total_length = 0, 0
+    for field, truth_value in truth_dict.items():
+        truth_str = str(truth_value)
+        pred_str = str(pred_dict.get(field, "")) if isinstance(pred_dict, dict) else ""
+        errors = edit_distance(truth_str, pred_str)
+        fields[field] = {
+            "cer": errors / len(truth_str) if truth_str else float(bool(pred_str)),
+            "exact": truth_str == pred_str,
+            "errors": errors,
+            "length": len(truth_str),
+        }
+        total_errors += errors
+        total_length += len(truth_str)
+
+    return {
+        "exact": truth_dict == pred_dict,
+        "cer": total_errors / total_length if total_length else 0.0,
+        "errors": total_errors,
+        "length": total_length,
+        "fields": fields,
+    }
+
+
+class MetricsAccumulator:
+    """Копит метрики по документам и полям (в том числе из записей отчета при resume)"""
+
+    def __init__(self):
+        self.documents = 0
+        self.exact_documents = 0
+        self.errors = 0
+        self.length = 0
+        self.fields = {}
+
+    def add(self, record):
+        self.documents += 1
+        self.exact_documents += int(record["exact"])
+        self.errors += record["errors"]
+        self.length += record["length"]
+        for field, metrics in record["fields"].items():
+            stats = self.fields.setdefault(field, {"cer_sum": 0.0, "exact": 0, "errors": 0, "length": 0, "count": 0})
+            stats["cer_sum"] += metrics["cer"]
+            stats["exact"] += int(metrics["exact"])
+            stats["errors"] += metrics["errors"]
+            stats["length"] += metrics["length"]
+            stats["count"] += 1
+
+    def summary(self):
+        fields = {}
+        for field, stats in sorted(self.fields.items()):
+            fields[field] = {
+                "cer": stats["errors"] / stats["length"] if stats["length"] else 0.0,
+                "mean_cer": stats["cer_sum"] / stats["count"],
+                "exact_match": stats["exact"] / stats["count"],
+                "count": stats["count"],
+            }
+        return {
+            "documents": self.documents,
+            "exact_match": self.exact_documents / self.documents if self.documents else 0.0,
+            "cer": self.errors / self.length if self.length else 0.0,
+            "fields": fields,
+        }
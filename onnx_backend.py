@@ -0,0 +1,264 @@
+import os
+import json
+import numpy as np
+import onnxruntime as ort
+import torch
+
+ONNX_CONFIG_NAME = "onnx_config.json"
+ENCODER_NAME = "encoder_model.onnx"
+DECODER_NAME = "decoder_model.onnx"
+DECODER_WITH_PAST_NAME = "decoder_with_past_model.onnx"
+
+
+def is_onnx_dir(model_path):
+    return os.path.exists(os.path.join(model_path, ONNX_CONFIG_NAME))
+
+
+def past_names(num_layers, prefix):
+    """Имена тензоров KV-кэша: на каждый слой self/cross key/value"""
+    names = []
+    for i in range(num_layers):
+        names += [f"{prefix}.{i}.self_key", f"{prefix}.{i}.self_value",
+                  f"{prefix}.{i}.cross_key", f"{prefix}.{i}.cross_value"]
+    return names
+
+
+class GenerateOutput:
+    """Повторяет форму ответа HF generate(return_dict_in_generate=True), нужную OCREngine"""
+
+    def __init__(self, sequences):
+        self.sequences = sequences
+
+
+def _log_softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=-1, keepdims=True))
+
+
+def _apply_repetition_penalty(scores, sequences, penalty):
+    """Как RepetitionPenaltyLogitsProcessor: уже встречавшиеся токены штрафуются"""
+    if penalty == 1.0:
+        return scores
+    rows = np.arange(scores.shape[0])[:, None]
+    picked = scores[rows, sequences]
+    scores[rows, sequences] = np.where(picked < 0, picked * penalty, picked / penalty)
+    return scores
+
+
+def _ban_bad_words(scores, sequences, bad_words_ids):
+    """Как NoBadWordsLogitsProcessor: последний токен слова запрещен, если перед ним уже стоит остальное слово"""
+    for ids in bad_words_ids or []:
+        prefix = list(ids[:-1])
+        if not prefix:
+            scores[:, ids[-1]] = -np.inf
+        elif sequences.shape[1] >= len(prefix):
+            match = (sequences[:, -len(prefix):] == prefix).all(axis=1)
+            scores[match, ids[-1]] = -np.inf
+    return scores
+
+
+class OnnxDonutModel:
+    """
+    Donut на ONNX Runtime: энкодер + декодер с KV-кэшем и собственный цикл
+    greedy / beam search без питоновского оверхеда HF generate.
+    """
+
+    def __init__(self, model_dir, num_threads=None):
+        with open(os.path.join(model_dir, ONNX_CONFIG_NAME), "r", encoding="utf-8") as f:
+            self.onnx_config = json.load(f)
+        self.model_dir = model_dir
+        self.num_layers = self.onnx_config["num_layers"]
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(os.path.join(model_dir, ENCODER_NAME), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(model_dir, DECODER_NAME), options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(
+            os.path.join(model_dir, DECODER_WITH_PAST_NAME), options, providers=providers
+        )
+        # Экспорт мог выкинуть неиспользуемые входы - кормим только те, что есть в графе
+        self.with_past_inputs = {i.name for i in self.decoder_with_past.get_inputs()}
+
+    def encode(self, pixel_values):
+        return self.encoder.run(None, {"pixel_values": pixel_values})[0]
+
+    def _first_step(self, input_ids, hidden):
+        outputs = self.decoder.run(None, {"input_ids": input_ids, "encoder_hidden_states": hidden})
+        present = outputs[1:]
+        self_kv = [present[4 * i:4 * i + 2] for i in range(self.num_layers)]
+        cross_kv = [present[4 * i + 2:4 * i + 4] for i in range(self.num_layers)]
+        return outputs[0], self_kv, cross_kv
+
+    def _next_step(self, input_ids, hidden, self_kv, cross_kv):
+        feed = {"input_ids": input_ids, "encoder_hidden_states": hidden}
+        for i in range(self.num_layers):
+            feed[f"past.{i}.self_key"], feed[f"past.{i}.self_value"] = self_kv[i]
+            feed[f"past.{i}.cross_key"], feed[f"past.{i}.cross_value"] = cross_kv[i]
+        feed = {name: value for name, value in feed.items() if name in self.with_past_inputs}
+        outputs = self.decoder_with_past.run(None, feed)
+        present = outputs[1:]
+        return outputs[0], [present[2 * i:2 * i + 2] for i in range(self.num_layers)]
+
+    def generate(self, pixel_values=None, decoder_input_ids=None, max_length=768, num_beams=1, repetition_penalty=1.0,
+                 length_penalty=1.0, eos_token_id=None, pad_token_id=None, bad_words_ids=None,
+                 stopping_criteria=None, encoder_outputs=None, min_length=0, use_cache=True,
+                 return_dict_in_generate=True, **kwargs):
+        """
+        Подмножество HF generate, которое передает OCREngine.decode_kwargs. KV-кэш используется всегда,
+        а ответ всегда в форме return_dict_in_generate. Вместо pixel_values можно передать encoder_outputs
+        с готовым выходом encode(). Остальные аргументы HF (no_repeat_ngram_size, do_sample, ...) здесь
+        не реализованы - на них TypeError, а не молча другой результат, чем у PyTorch.
+        """
+        if kwargs:
+            raise TypeError(f"ONNX-бэкенд не поддерживает аргументы generate: {', '.join(sorted(kwargs))}")
+        prompt = decoder_input_ids.detach().cpu().numpy().astype(np.int64)
+        if encoder_outputs is not None:
+            hidden = encoder_outputs[0].detach().cpu().numpy().astype(np.float32)
+        else:
+            hidden = self.encode(pixel_values.detach().cpu().numpy().astype(np.float32))
+
+        if num_beams > 1:
+            sequences = self._beam_search(hidden, prompt, max_length, num_beams, repetition_penalty,
+                                          length_penalty, eos_token_id, pad_token_id, bad_words_ids,
+                                          stopping_criteria, min_length)
+        else:
+            sequences = self._greedy(hidden, prompt, max_length, repetition_penalty, eos_token_id, pad_token_id,
+                                     bad_words_ids, stopping_criteria, min_length)
+        return GenerateOutput(torch.from_numpy(sequences))
+
+    @staticmethod
+    def _should_stop(sequences, stopping_criteria):
+        """Критерии остановки HF (например, SchemaStoppingCriteria) -> маска остановленных строк"""
+        stop = np.zeros(len(sequences), dtype=bool)
+        for criteria in stopping_criteria or []:
+            result = criteria(torch.from_numpy(sequences), None)
+            stop |= np.broadcast_to(np.asarray(result, dtype=bool), stop.shape)
+        return stop
+
+    def _greedy(self, hidden, prompt, max_length, repetition_penalty, eos_token_id, pad_token_id, bad_words_ids,
+                stopping_criteria=None, min_length=0):
+        sequences = prompt
+        finished = np.zeros(len(prompt), dtype=bool)
+        logits, self_kv, cross_kv = self._first_step(prompt, hidden)
+
+        while sequences.shape[1] < max_length:
+            scores = _apply_repetition_penalty(logits[:, -1, :].astype(np.float32), sequences, repetition_penalty)
+            scores = _ban_bad_words(scores, sequences, bad_words_ids)
+            if sequences.shape[1] < min_length:
+                # Как MinLengthLogitsProcessor: до min_length eos запрещен
+                scores[:, eos_token_id] = -np.inf
+            next_tokens = scores.argmax(axis=-1)
+            # Закончившиеся строки добиваем pad-токеном, как HF
+            next_tokens = np.where(finished, pad_token_id, next_tokens)
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == eos_token_id
+            finished |= self._should_stop(sequences, stopping_criteria)
+            if finished.all():
+                break
+            logits, self_kv = self._next_step(next_tokens[:, None], hidden, self_kv, cross_kv)
+        return sequences
+
+    def _beam_search(self, hidden, prompt, max_length, num_beams, repetition_penalty, length_penalty,
+                     eos_token_id, pad_token_id, bad_words_ids, stopping_criteria=None, min_length=0):
+        """
+        Beam search по схеме HF: штрафы применяются к log-probs, гипотеза закрывается на eos,
+        ее счет нормируется на число сгенерированных токенов (без промпта). Луч, который остановил критерий,
+        на следующем шаге может только закрыться eos (как StoppedRowsEosProcessor для HF generate):
+        остальные лучи и строки батча продолжают декодирование.
+        """
+        batch_size, prompt_len = prompt.shape
+        hidden = np.repeat(hidden, num_beams, axis=0)
+        sequences = np.repeat(prompt, num_beams, axis=0)
+        beam_scores = np.full((batch_size, num_beams), -1e9, dtype=np.float32)
+        beam_scores[:, 0] = 0.0
+        beam_scores = beam_scores.reshape(-1)
+
+        finished_hyps = [[] for _ in range(batch_size)]
+        done = [False] * batch_size
+        stopped = np.zeros(len(sequences), dtype=bool)
+        logits, self_kv, cross_kv = self._first_step(sequences, hidden)
+
+        while True:
+            cur_len = sequences.shape[1]
+            scores = _log_softmax(logits[:, -1, :].astype(np.float32))
+            scores = _apply_repetition_penalty(scores, sequences, repetition_penalty)
+            scores = _ban_bad_words(scores, sequences, bad_words_ids)
+            if cur_len < min_length:
+                scores[:, eos_token_id] = -np.inf
+            if stopped.any():
+                # Счет луча не меняется: eos для него - единственный ход с log-prob 0
+                scores[stopped] = -np.inf
+                scores[stopped, eos_token_id] = 0.0
+            vocab_size = scores.shape[-1]
+            scores = (scores + beam_scores[:, None]).reshape(batch_size, num_beams * vocab_size)
+
+            # argpartition вместо полной сортировки словаря, затем сортируем только 2*num_beams кандидатов
+            top = np.argpartition(-scores, 2 * num_beams, axis=1)[:, :2 * num_beams]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            next_scores = np.take_along_axis(scores, top, axis=1)
+
+            next_beam_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+            next_tokens = np.full((batch_size, num_beams), pad_token_id, dtype=np.int64)
+            next_indices = np.zeros((batch_size, num_beams), dtype=np.int64)
+
+            for b in range(batch_size):
+                if done[b]:
+                    next_indices[b] = b * num_beams
+                    continue
+                beam = 0
+                for rank, (flat, score) in enumerate(zip(top[b], next_scores[b])):
+                    source = b * num_beams + flat // vocab_size
+                    token = flat % vocab_size
+                    if token == eos_token_id:
+                        # eos за пределами первых num_beams кандидатов не открывает гипотезу
+                        if rank < num_beams:
+                            normalized = score / max(cur_len - prompt_len, 1) ** length_penalty
+                            finished_hyps[b].append((normalized, sequences[source]))
+                    else:
+                        next_beam_scores[b, beam] = score
+                        next_tokens[b, beam] = token
+                        next_indices[b, beam] = source
+                        beam += 1
+                    if beam == num_beams:
+                        break
+
+                hyps = sorted(finished_hyps[b], key=lambda h: h[0], reverse=True)[:num_beams]
+                finished_hyps[b] = hyps
+                if len(hyps) == num_beams:
+                    best_running = next_beam_scores[b].max() / max(cur_len - prompt_len, 1) ** length_penalty
+                    done[b] = hyps[-1][0] >= best_running
+
+            if all(done):
+                break
+
+            beam_idx = next_indices.reshape(-1)
+            sequences = np.concatenate([sequences[beam_idx], next_tokens.reshape(-1, 1)], axis=1)
+            beam_scores = next_beam_scores.reshape(-1)
+            self_kv = [(k[beam_idx], v[beam_idx]) for k, v in self_kv]
+            if cur_len + 1 >= max_length:
+                break
+            stopped = self._should_stop(sequences, stopping_criteria)
+            logits, self_kv = self._next_step(next_tokens.reshape(-1, 1), hidden, self_kv, cross_kv)
+
+        # Незакончившиеся батчи дополняем текущими лучами и берем лучшую гипотезу
+        results = []
+        for b in range(batch_size):
+            hyps = list(finished_hyps[b])
+            if not done[b]:
+                for k in range(num_beams):
+                    row = b * num_beams + k
+                    normalized = beam_scores[row] / max(sequences.shape[1] - prompt_len, 1) ** length_penalty
+                    hyps.append((normalized, sequences[row]))
+            best = max(hyps, key=lambda h: h[0])[1]
+            if len(best) < max_length:
+                best = np.append(best, eos_token_id)
+            results.append(best)
+
+        width = max(len(r) for r in results)
+        output = np.full((batch_size, width), pad_token_id, dtype=np.int64)
+        for b, row in enumerate(results):
+            output[b, :len(row)] = row
+        return output
@@ -0,0 +1,225 @@
+import os
+import json
+import hashlib
+import argparse
+import torch
+from transformers import DonutProcessor, VisionEncoderDecoderModel
+
+try:
+    from transformers.cache_utils import EncoderDecoderCache
+except ImportError:
+    # Старые версии transformers работают с кортежами напрямую
+    EncoderDecoderCache = None
+
+from onnx_backend import (ONNX_CONFIG_NAME, ENCODER_NAME, DECODER_NAME, DECODER_WITH_PAST_NAME,
+                          past_names, is_onnx_dir)
+
+
+def _legacy_cache(past_key_values):
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+class EncoderWrapper(torch.nn.Module):
+    """Энкодер + проекция в размерность декодера (если она есть в модели)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.encoder
+        self.enc_to_dec_proj = getattr(model, "enc_to_dec_proj", None)
+
+    def forward(self, pixel_values):
+        hidden = self.encoder(pixel_values=pixel_values).last_hidden_state
+        if self.enc_to_dec_proj is not None:
+            hidden = self.enc_to_dec_proj(hidden)
+        return hidden
+
+
+class DecoderWrapper(torch.nn.Module):
+    """Первый шаг декодера: промпт -> логиты + полный KV-кэш (self и cross)"""
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        out = self.decoder(input_ids=input_ids, encoder_hidden_states=encoder_hidden_states,
+                           use_cache=True, return_dict=True)
+        return (out.logits,) + tuple(t for layer in _legacy_cache(out.past_key_values) for t in layer)
+
+
+class DecoderWithPastWrapper(torch.nn.Module):
+    """Следующие шаги: один токен + кэш -> логиты + обновленный self-кэш (cross-кэш не меняется)"""
+
+    def __init__(self, decoder, num_layers):
+        super().__init__()
+        self.decoder = decoder
+        self.num_layers = num_layers
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        past_key_values = tuple(tuple(past[4 * i:4 * i + 4]) for i in range(self.num_layers))
+        if EncoderDecoderCache is not None:
+            past_key_values = EncoderDecoderCache.from_legacy_cache(past_key_values)
+        out = self.decoder(input_ids=input_ids, encoder_hidden_states=encoder_hidden_states,
+                           past_key_values=past_key_values, use_cache=True, return_dict=True)
+        return (out.logits,) + tuple(t for layer in _legacy_cache(out.past_key_values) for t in layer[:2])
+
+
+def source_fingerprint(model_dir):
+    """Отпечаток исходной модели: имена, размеры и время изменения ее файлов (веса, конфиг, токенизатор)"""
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(model_dir)):
+        stat = os.stat(os.path.join(model_dir, name))
+        h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def export_is_current(model_dir, output_dir, opset):
+    """Экспорт в output_dir сделан из этих же файлов model_dir и с тем же opset"""
+    if not is_onnx_dir(output_dir):
+        return False
+    with open(os.path.join(output_dir, ONNX_CONFIG_NAME), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return config.get("source_fingerprint") == source_fingerprint(model_dir) and config.get("opset") == opset
+
+
+def export_onnx(model_dir, output_dir, opset=17):
+    print(f"⏳ Загрузка модели из {model_dir}...")
+    processor = DonutProcessor.from_pretrained(model_dir)
+    model = VisionEncoderDecoderModel.from_pretrained(model_dir)
+    model.eval()
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_layers = model.config.decoder.decoder_layers
+    size = processor.image_processor.size
+    height, width = (size["height"], size["width"]) if isinstance(size, dict) else size
+    pixel_values = torch.randn(1, 3, height, width)
+    prompt = torch.tensor([[model.config.decoder_start_token_id]], dtype=torch.long)
+
+    print("📦 Экспорт энкодера...")
+    encoder = EncoderWrapper(model)
+    torch.onnx.export(
+        encoder, (pixel_values,), os.path.join(output_dir, ENCODER_NAME),
+        input_names=["pixel_values"], output_names=["last_hidden_state"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch", 1: "encoder_len"}},
+        opset_version=opset
+    )
+
+    with torch.no_grad():
+        hidden = encoder(pixel_values)
+        present = DecoderWrapper(model.decoder)(prompt, hidden)[1:]
+
+    kv_axes = {0: "batch", 2: "past_len"}
+    cross_axes = {0: "batch", 2: "encoder_len"}
+
+    def cache_axes(names):
+        return {name: (cross_axes if "cross" in name else kv_axes) for name in names}
+
+    print("📦 Экспорт декодера (первый шаг)...")
+    present_names = past_names(num_layers, "present")
+    torch.onnx.export(
+        DecoderWrapper(model.decoder), (prompt, hidden), os.path.join(output_dir, DECODER_NAME),
+        input_names=["input_ids", "encoder_hidden_states"],
+        output_names=["logits"] + present_names,
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "seq_len"},
+            "encoder_hidden_states": {0: "batch", 1: "encoder_len"},
+            "logits": {0: "batch", 1: "seq_len"},
+            **cache_axes(present_names),
+        },
+        opset_version=opset
+    )
+
+    print("📦 Экспорт декодера с KV-кэшем...")
+    input_past_names = past_names(num_layers, "past")
+    output_self_names = [n for n in present_names if "self" in n]
+    torch.onnx.export(
+        DecoderWithPastWrapper(model.decoder, num_layers), (prompt, hidden) + tuple(present),
+        os.path.join(output_dir, DECODER_WITH_PAST_NAME),
+        input_names=["input_ids", "encoder_hidden_states"] + input_past_names,
+        output_names=["logits"] + output_self_names,
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "encoder_hidden_states": {0: "batch", 1: "encoder_len"},
+            "logits": {0: "batch"},
+            **cache_axes(input_past_names),
+            **cache_axes(output_self_names),
+        },
+        opset_version=opset
+    )
+
+    # Процессор и конфиг рядом с графами, чтобы папку можно было указать вместо исходной модели
+    processor.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ONNX_CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump({"source": model_dir, "source_fingerprint": source_fingerprint(model_dir),
+                   "num_layers": num_layers, "opset": opset}, f, indent=2)
+    print(f"✅ ONNX-модель сохранена в '{output_dir}'")
+
+
+def check_parity(doc_type, dataset_path, limit=50, batch_size=1, onnx_dir=None):
+    """
+    Сравнивает ответы ONNX Runtime и PyTorch на первых limit картинках валидации
+    с настройками evaluate_models.py. onnx_dir - проверяемый экспорт (по умолчанию <модель>_onnx).
+    Возвращает долю совпавших документов.
+    """
+    from ocr_engine import OCREngine, EVAL_GENERATION
+    from image_pipeline import prefetch_batches
+
+    torch_engine = OCREngine(generation_kwargs=EVAL_GENERATION, device="cpu")
+    onnx_engine = OCREngine(generation_kwargs=EVAL_GENERATION, backend="onnx")
+    if onnx_dir:
+        # Проверяем именно тот экспорт, который только что сделали, а не папку по умолчанию
+        onnx_engine.document_types[doc_type] = (onnx_dir, onnx_engine.document_types[doc_type][1])
+    print(f"🔍 Сверка {onnx_engine.document_types[doc_type][0]} с PyTorch")
+
+    with open(os.path.join(dataset_path, "metadata.jsonl"), "r", encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f][:limit]
+
+    items = ((item["file_name"], os.path.join(dataset_path, item["file_name"])) for item in metadata)
+    processor = torch_engine.get(doc_type).processor
+    matched, total = 0, 0
+    for names, pixel_values, failed in prefetch_batches(items, processor, batch_size):
+        if pixel_values is None:
+            continue
+        torch_results = torch_engine.generate(pixel_values, doc_type)
+        onnx_results = onnx_engine.generate(pixel_values, doc_type)
+        for name, torch_result, onnx_result in zip(names, torch_results, onnx_results):
+            total += 1
+            if torch_result == onnx_result:
+                matched += 1
+            else:
+                print(f"❌ Расхождение на {name}")
+                print(f"   PyTorch: {json.dumps(torch_result, ensure_ascii=False)}")
+                print(f"   ONNX:    {json.dumps(onnx_result, ensure_ascii=False)}")
+
+    rate = matched / total if total else 0.0
+    print(f"📊 Совпадение ONNX / PyTorch: {matched}/{total} ({rate:.2%})")
+    return rate
+
+
+if __name__ == "__main__":
+    from ocr_engine import DOCUMENT_TYPES
+
+    parser = argparse.ArgumentParser(description="Экспорт Donut в ONNX (энкодер + декодер с KV-кэшем)")
+    parser.add_argument('--type', type=str, choices=list(DOCUMENT_TYPES), required=True)
+    parser.add_argument('--out', type=str, default=None, help='Куда сохранить (по умолчанию <модель>_onnx)')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--force', action='store_true', help='Экспортировать заново, даже если экспорт актуален')
+    parser.add_argument('--check-parity', action='store_true',
+                        help='После экспорта сравнить ответы ONNX и PyTorch на валидации')
+    parser.add_argument('--limit', type=int, default=50, help='Сколько картинок валидации сравнивать')
+    args = parser.parse_args()
+
+    model_path, _ = DOCUMENT_TYPES[args.type]
+    output_dir = args.out or f"{model_path}_onnx"
+    if args.force or not export_is_current(model_path, output_dir, args.opset):
+        if is_onnx_dir(output_dir) and not args.force:
+            print(f"🔄 ONNX-модель в '{output_dir}' сделана из других весов или с другим opset, экспортируем заново")
+        export_onnx(model_path, output_dir, args.opset)
+    else:
+        print(f"♻️ ONNX-модель в '{output_dir}' актуальна, экспорт пропущен (--force - экспортировать заново)")
+
+    if args.check_parity:
+        check_parity(args.type, f"dataset/val_{args.type}", args.limit, onnx_dir=output_dir)
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import random
+import argparse
+import numpy as np
+from PIL import Image
+
+# Чистые шаблоны бланков: по ним различаются 0/180 (и 90/270), что по профилям строк не видно
+ORIENTATION_REFERENCES = {
+    "passport": "Sloi-1.jpg",
+    "registration": "img.png",
+}
+
+REFERENCE_SIZE = (48, 64)  # (ширина, высота) миниатюры для сравнения с шаблоном
+
+
+def _otsu_threshold(gray):
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(hist)
+    means = np.cumsum(hist * np.arange(256))
+    total, total_mean = weights[-1], means[-1]
+    background = weights[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    between = np.zeros(255)
+    between[valid] = (total_mean * background[valid] / total - means[:-1][valid]) ** 2 / (
+        background[valid] * foreground[valid])
+    return int(np.argmax(between))
+
+
+def _profile_contrast(ink, axis):
+    """Квадрат коэффициента вариации проекции: у строк текста чередуются пустые и плотные полосы"""
+    profile = ink.sum(axis=axis).astype(np.float64)
+    mean = profile.mean()
+    return profile.var() / (mean * mean) if mean > 0 else 0.0
+
+
+def _thumbnail(gray_image, size=REFERENCE_SIZE):
+    pixels = np.asarray(gray_image.resize(size, Image.BILINEAR), dtype=np.float32)
+    pixels -= pixels.mean()
+    norm = np.linalg.norm(pixels)
+    return pixels / norm if norm > 0 else pixels
+
+
+class OrientationEstimator:
+    """
+    Дешевое определение ориентации скана (0/90/180/270) по сильно уменьшенной копии.
+    Ось строк (горизонтально/вертикально) - по контрасту проекций бинаризованных чернил на строки
+    и столбцы. Какая из двух противоположных ориентаций верная, решает корреляция миниатюры
+    с чистым шаблоном бланка; без шаблона 180 градусов не отличить, и такая ориентация остается как есть.
+    """
+
+    def __init__(self, reference_path=None, side=320, axis_margin=1.15):
+        self.side = side
+        self.axis_margin = axis_margin
+        self.reference = None
+        if reference_path and os.path.exists(reference_path):
+            with Image.open(reference_path) as reference:
+                self.reference = _thumbnail(reference.convert("L"))
+
+    def _small_gray(self, image):
+        gray = image.convert("L")
+        gray.thumbnail((self.side, self.side), Image.BILINEAR)
+        return gray
+
+    def _axis_scores(self, gray):
+        pixels = np.asarray(gray, dtype=np.uint8)
+        ink = pixels <= _otsu_threshold(pixels)
+        return _profile_contrast(ink, axis=1), _profile_contrast(ink, axis=0)
+
+    def estimate(self, image):
+        """Угол (против часовой, как Image.rotate), на который надо повернуть картинку, чтобы она встала ровно"""
+        gray = self._small_gray(image)
+        rows, cols = self._axis_scores(gray)
+
+        if rows >= cols * self.axis_margin:
+            candidates = [0, 180]
+        elif cols >= rows * self.axis_margin:
+            candidates = [90, 270]
+        else:
+            # Ось не ясна (мало текста, сильный шум) - решает только шаблон
+            candidates = [0, 90, 180, 270] if self.reference is not None else [0]
+
+        if self.reference is None or len(candidates) == 1:
+            return candidates[0]
+        scores = [float((_thumbnail(gray.rotate(angle, expand=True)) * self.reference).sum()) for angle in candidates]
+        return candidates[int(np.argmax(scores))]
+
+    def __call__(self, image):
+        angle = self.estimate(image)
+        return image.rotate(angle, expand=True) if angle else image
+
+
+def estimator_for(doc_type, side=320):
+    return OrientationEstimator(ORIENTATION_REFERENCES.get(doc_type), side=side)
+
+
+if __name__ == "__main__":
+    from image_pipeline import load_image
+
+    parser = argparse.ArgumentParser(description="Проверка определения ориентации на валидации со случайными поворотами")
+    parser.add_argument('--type', type=str, choices=list(ORIENTATION_REFERENCES), required=True)
+    parser.add_argument('--limit', type=int, default=200, help='Сколько картинок валидации проверить')
+    parser.add_argument('--side', type=int, default=320, help='Большая сторона уменьшенной копии')
+    args = parser.parse_args()
+
+    dataset_path = f"dataset/val_{args.type}"
+    with open(os.path.join(dataset_path, "metadata.jsonl"), "r", encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f][:args.limit]
+
+    estimator = estimator_for(args.type, args.side)
+    rng = random.Random(0)
+    correct, elapsed = 0, 0.0
+    for item in metadata:
+        # Поворачиваем так же, как ImageAugmentor._apply_random_rotation_90
+        angle = rng.choice([0, 90, 180, 270])
+        image = load_image(os.path.join(dataset_path, item["file_name"])).rotate(angle, expand=True)
+        started = time.perf_counter()
+        correction = estimator.estimate(image)
+        elapsed += time.perf_counter() - started
+        correct += int((angle + correction) % 360 == 0)
+
+    total = max(len(metadata), 1)
+    print(f"🧭 Ориентация: {correct}/{len(metadata)} ({correct / total:.2%}), {elapsed * 1000 / total:.1f} мс/картинка")
@@ -0,0 +1,86 @@
+import os
+import json
+import argparse
+import torch
+from transformers import DonutProcessor, VisionEncoderDecoderModel, VisionEncoderDecoderConfig
+
+QUANT_CONFIG_NAME = "quantization.json"
+QUANT_WEIGHTS_NAME = "quantized_state_dict.pt"
+
+
+def quantize_model(model, include_encoder=False):
+    """
+    Динамическая int8-квантизация: веса Linear-слоев хранятся в int8,
+    активации квантуются на лету. Работает только на CPU.
+    """
+    model.to("cpu")
+    model.eval()
+    model.decoder = torch.ao.quantization.quantize_dynamic(model.decoder, {torch.nn.Linear}, dtype=torch.qint8)
+    if include_encoder:
+        model.encoder = torch.ao.quantization.quantize_dynamic(model.encoder, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def is_quantized_dir(model_path):
+    return os.path.exists(os.path.join(model_path, QUANT_CONFIG_NAME))
+
+
+def save_quantized(model, processor, output_dir, source_path, include_encoder):
+    """
+    save_pretrained не умеет квантованные модули, поэтому сохраняем
+    конфиг + процессор + state_dict и параметры квантизации для повторной сборки.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+    torch.save(model.state_dict(), os.path.join(output_dir, QUANT_WEIGHTS_NAME))
+    with open(os.path.join(output_dir, QUANT_CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump({"source": source_path, "dtype": "qint8", "include_encoder": include_encoder}, f, indent=2)
+
+
+def load_quantized(model_path):
+    """Собирает модель по конфигу, квантует так же, как при сохранении, и грузит int8-веса"""
+    with open(os.path.join(model_path, QUANT_CONFIG_NAME), "r", encoding="utf-8") as f:
+        quant_config = json.load(f)
+
+    config = VisionEncoderDecoderConfig.from_pretrained(model_path)
+    model = VisionEncoderDecoderModel(config=config)
+    model = quantize_model(model, include_encoder=quant_config["include_encoder"])
+    state_dict = torch.load(os.path.join(model_path, QUANT_WEIGHTS_NAME), map_location="cpu", weights_only=False)
+    model.load_state_dict(state_dict)
+    return model
+
+
+# Файлы весов всех вариантов модели: HF (fp32), int8 (QUANT_WEIGHTS_NAME) и ONNX-графы с внешними данными
+WEIGHT_EXTENSIONS = (".bin", ".safetensors", ".pt", ".onnx", ".onnx_data", ".data")
+
+
+def weights_size_mb(model_dir):
+    """Сколько весы модели занимают на диске: сумма размеров файлов весов в папке (без загрузки модели)"""
+    total = sum(os.path.getsize(os.path.join(model_dir, name)) for name in os.listdir(model_dir)
+                if name.endswith(WEIGHT_EXTENSIONS))
+    return total / 1024 / 1024
+
+
+if __name__ == "__main__":
+    from ocr_engine import DOCUMENT_TYPES
+
+    parser = argparse.ArgumentParser(description="Динамическая int8-квантизация модели Donut для CPU")
+    parser.add_argument('--type', type=str, choices=list(DOCUMENT_TYPES), required=True)
+    parser.add_argument('--encoder', action='store_true', help='Квантовать также Linear-слои энкодера')
+    parser.add_argument('--out', type=str, default=None, help='Куда сохранить (по умолчанию <модель>_int8)')
+    args = parser.parse_args()
+
+    model_path, _ = DOCUMENT_TYPES[args.type]
+    output_dir = args.out or f"{model_path}_int8"
+
+    print(f"⏳ Загрузка модели из {model_path}...")
+    processor = DonutProcessor.from_pretrained(model_path)
+    model = VisionEncoderDecoderModel.from_pretrained(model_path)
+
+    print(f"🔧 Квантуем декодер{' и энкодер' if args.encoder else ''} в int8...")
+    model = quantize_model(model, include_encoder=args.encoder)
+    save_quantized(model, processor, output_dir, model_path, args.encoder)
+
+    print(f"✅ Квантованная модель сохранена в '{output_dir}' "
+          f"({weights_size_mb(model_path):.0f} МБ -> {weights_size_mb(output_dir):.0f} МБ на диске)")
@@ -0,0 +1,210 @@
+import os
+import json
+import math
+import argparse
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+SCHEMA_FILE_NAME = "generation_schema.json"
+
+# Поля, которые пишут генераторы: generate_data() в gen1_passports.py
+# и PassportGenerator.generate_fake_data() в handwritten.py
+DEFAULT_FIELDS = {
+    "passport": ["surname", "name", "patronymic", "issued_by", "issue_date", "department_code",
+                 "passport_series", "passport_number", "sex", "birth_date", "birth_place"],
+    "registration": ["Region", "District", "city", "street", "house_number", "korpus", "stroenie", "apart_nmb"],
+}
+
+
+def load_schema(model_path, doc_type):
+    """Схема из папки модели (см. __main__), иначе - поля генераторов без бюджета длины"""
+    schema_path = os.path.join(model_path, SCHEMA_FILE_NAME)
+    if os.path.exists(schema_path):
+        with open(schema_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"fields": DEFAULT_FIELDS.get(doc_type, []), "max_length": None}
+
+
+def compute_schema(dataset_path, tokenizer, margin=1.25, prompt_len=1):
+    """
+    По метадате обучающего датасета считает обязательные поля (есть в каждом примере)
+    и бюджет длины: максимум длины GT в токенах с запасом margin.
+    """
+    with open(os.path.join(dataset_path, "metadata.jsonl"), "r", encoding="utf-8") as f:
+        metadata = [json.loads(line) for line in f]
+
+    fields = None
+    lengths = []
+    for item in metadata:
+        keys = list(json.loads(item["ground_truth"])["gt_parse"].keys())
+        fields = keys if fields is None else [k for k in fields if k in keys]
+        # +1 на eos
+        lengths.append(len(tokenizer(item["ground_truth"], add_special_tokens=False).input_ids) + 1)
+
+    lengths.sort()
+
+    def percentile(q):
+        return lengths[min(len(lengths) - 1, int(q / 100 * len(lengths)))]
+
+    return {
+        "fields": fields or [],
+        "max_length": prompt_len + math.ceil(lengths[-1] * margin),
+        "length_percentiles": {"p50": percentile(50), "p99": percentile(99), "max": lengths[-1]},
+        "samples": len(lengths),
+    }
+
+
+class _RowState:
+    """Инкрементальный разбор сгенерированного текста одной строки батча"""
+
+    def __init__(self):
+        self.text = ""
+        self.found = set()
+        self.depth = 0
+        self.opened = False
+        self.in_string = False
+        self.escape = False
+
+    def copy(self):
+        state = _RowState()
+        state.__dict__.update(self.__dict__)
+        state.found = set(self.found)
+        return state
+
+    def feed(self, piece, fields, max_key_len):
+        start = max(0, len(self.text) - max_key_len - 4)
+        self.text += piece
+        for ch in piece:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                self.opened = True
+            elif ch == "}":
+                self.depth -= 1
+
+        # Ищем ключи только в хвосте текста: JSON-ключ "field": или закрывающий токен Donut </s_field>
+        window = self.text[start:]
+        for field in fields:
+            if field not in self.found and (f'"{field}":' in window or f"</s_{field}>" in window):
+                self.found.add(field)
+
+
+class SchemaStoppingCriteria(StoppingCriteria):
+    """
+    Останавливает строку, когда:
+    - все поля схемы уже выписаны и JSON-объект закрыт (или выданы все закрывающие токены полей);
+    - хвост последовательности зациклился (одна n-грамма повторяется подряд).
+    Состояние хранится по префиксу последовательности, поэтому работает и с beam search,
+    где строки батча на каждом шаге переставляются.
+    """
+
+    def __init__(self, tokenizer, fields, prompt_len, max_ngram=8, min_loop_tokens=16, min_repeats=3):
+        self.tokenizer = tokenizer
+        self.fields = list(fields)
+        self.max_key_len = max((len(f) for f in self.fields), default=0) + len("</s_>")
+        self.prompt_len = prompt_len
+        self.max_ngram = max_ngram
+        self.min_loop_tokens = min_loop_tokens
+        self.min_repeats = min_repeats
+        self.states = {}
+        self.stopped_by_loop = 0
+        self.stopped_by_schema = 0
+
+    def _state_for(self, ids):
+        key = tuple(ids)
+        state = self.states.get(key[:-1])
+        if state is None:
+            # Первый шаг (или незнакомый префикс) - разбираем весь сгенерированный хвост
+            state = _RowState()
+            pieces = self.tokenizer.convert_ids_to_tokens(list(key[self.prompt_len:]))
+        else:
+            state = state.copy()
+            pieces = self.tokenizer.convert_ids_to_tokens([key[-1]])
+        for piece in pieces:
+            state.feed(piece.replace("▁", " "), self.fields, self.max_key_len)
+        return key, state
+
+    def _is_loop(self, ids):
+        generated = ids[self.prompt_len:]
+        for n in range(1, self.max_ngram + 1):
+            repeats = max(self.min_repeats, math.ceil(self.min_loop_tokens / n))
+            span = n * repeats
+            if len(generated) < span:
+                continue
+            tail = generated[-span:]
+            if all(tail[i] == tail[i % n] for i in range(n, span)):
+                return True
+        return False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_states = {}
+        done = []
+        for row in input_ids.tolist():
+            if len(row) <= self.prompt_len:
+                done.append(False)
+                continue
+            key, state = self._state_for(row)
+            new_states[key] = state
+
+            schema_done = bool(self.fields) and len(state.found) == len(self.fields) and (
+                (state.opened and state.depth <= 0) or all(f"</s_{f}>" in state.text for f in self.fields)
+            )
+            loop = not schema_done and self._is_loop(row)
+            self.stopped_by_schema += int(schema_done)
+            self.stopped_by_loop += int(loop)
+            done.append(schema_done or loop)
+
+        # Нужны только состояния текущего шага - предыдущие префиксы больше не встретятся
+        self.states = new_states
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+
+class StoppedRowsEosProcessor(LogitsProcessor):
+    """
+    Beam search в HF generate заканчивается по stopping_criteria, только когда остановлены все строки.
+    Этот процессор на каждом шаге спрашивает критерий про каждый луч и остановленным оставляет
+    единственный ход - eos: гипотеза закрывается, а остальные лучи продолжают. Критерий при этом
+    не нужно передавать еще и в stopping_criteria (он хранит состояние по префиксам одного шага).
+    """
+
+    def __init__(self, criteria, eos_token_id):
+        self.criteria = criteria
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        stop = self.criteria(input_ids, scores)
+        if stop.any():
+            scores = scores.clone()
+            scores[stop] = -float("inf")
+            scores[stop, self.eos_token_id] = 0.0
+        return scores
+
+
+if __name__ == "__main__":
+    from transformers import DonutProcessor
+    from ocr_engine import DOCUMENT_TYPES
+
+    parser = argparse.ArgumentParser(description="Расчет схемы полей и бюджета длины генерации по обучающему датасету")
+    parser.add_argument('--type', type=str, choices=list(DOCUMENT_TYPES), required=True)
+    parser.add_argument('--dataset', type=str, required=True, help='Папка обучающего датасета с metadata.jsonl')
+    parser.add_argument('--margin', type=float, default=1.25, help='Запас к максимальной длине GT')
+    args = parser.parse_args()
+
+    model_path, task_prompt = DOCUMENT_TYPES[args.type]
+    processor = DonutProcessor.from_pretrained(model_path)
+    prompt_len = len(processor.tokenizer(task_prompt, add_special_tokens=False).input_ids)
+    schema = compute_schema(args.dataset, processor.tokenizer, args.margin, prompt_len)
+
+    with open(os.path.join(model_path, SCHEMA_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=2)
+    print(f"✅ Схема сохранена в {model_path}/{SCHEMA_FILE_NAME}: {len(schema['fields'])} полей, "
+          f"max_length={schema['max_length']} (p99 GT: {schema['length_percentiles']['p99']} токенов)")
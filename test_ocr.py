@@ -1,82 +1,154 @@
+import os
+import glob
+import time
 import argparse
-import torch
-import re
-from PIL import Image
-from transformers import DonutProcessor, VisionEncoderDecoderModel
-
-
-def recognize_document(image_path, doc_type):
-    # Определяем пути и промпты в зависимости от типа документа
-    if doc_type == "passport":
-        model_path = "models_ready/donut_passport_v1"
-        task_prompt = "<s_passport>"
-    elif doc_type == "registration":
-        model_path = "models_ready/donut_registration_v1"
-        task_prompt = "<s_registration>"
-    else:
+import json
+from concurrent.futures import ThreadPoolExecutor
+from ocr_engine import OCREngine, DOCUMENT_TYPES
+from image_pipeline import prefetch_batches
+from warm_worker import add_warm_argument, maybe_run_warm
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+
+def recognize_document(image_path, doc_type, engine=None):
+    if doc_type not in DOCUMENT_TYPES:
         raise ValueError("Тип документа должен быть 'passport' или 'registration'")
 
-    print(f"⏳ Загрузка модели из {model_path}...")
+    engine = engine or OCREngine()
+
     try:
-        processor = DonutProcessor.from_pretrained(model_path)
-        model = VisionEncoderDecoderModel.from_pretrained(model_path)
+        engine.get_processor(doc_type)
     except Exception as e:
         print(f"❌ Ошибка загрузки модели (возможно, указан неверный путь): {e}")
         return
 
-    # Переносим модель на видеокарту
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"⚡ Используемое устройство: {device.upper()}")
-    model.to(device)
-    model.eval()
-
+    # Картинку декодируем и препроцессим в фоне, пока с диска грузятся веса модели
     print(f"🖼️ Обработка изображения: {image_path}")
+    pool = ThreadPoolExecutor(max_workers=1)
+    pixel_values_future = pool.submit(engine.preprocess, [image_path], doc_type)
+    pool.shutdown(wait=False)
+
     try:
-        image = Image.open(image_path).convert("RGB")
+        engine.get(doc_type)
     except Exception as e:
-        print(f"❌ Ошибка открытия картинки: {e}")
+        print(f"❌ Ошибка загрузки модели (возможно, указан неверный путь): {e}")
         return
 
-    # Подготавливаем картинку для модели
-    pixel_values = processor(image, return_tensors="pt").pixel_values.to(device)
-
-    # Задаем стартовый токен (наш промпт)
-    decoder_input_ids = processor.tokenizer(
-        task_prompt, add_special_tokens=False, return_tensors="pt"
-    ).input_ids.to(device)
+    try:
+        pixel_values = pixel_values_future.result()
+    except Exception as e:
+        print(f"❌ Ошибка открытия картинки: {e}")
+        return
 
     print("🧠 Нейросеть читает документ...")
-    # Запускаем генерацию
-    with torch.no_grad():
-        outputs = model.generate(
-            pixel_values,
-            decoder_input_ids=decoder_input_ids,
-            max_length=768,
-            pad_token_id=processor.tokenizer.pad_token_id,
-            eos_token_id=processor.tokenizer.eos_token_id,
-            use_cache=True,
-            bad_words_ids=[[processor.tokenizer.unk_token_id]],
-            return_dict_in_generate=True,
-        )
-
-    # Декодируем токены обратно в читаемый текст
-    sequence = processor.batch_decode(outputs.sequences)[0]
-
-    # Очищаем технические токены (pad, eos и сам стартовый промпт)
-    sequence = sequence.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
-    sequence = re.sub(r"^" + re.escape(task_prompt), "", sequence).strip()
+    result = engine.generate(pixel_values, doc_type)[0]
 
     print("\n" + "=" * 50)
     print("✅ РЕЗУЛЬТАТ РАСПОЗНАВАНИЯ:")
     print("=" * 50)
-    print(sequence)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
     print("=" * 50 + "\n")
+    return result
+
+
+def iter_image_files(input_dir=None, pattern=None):
+    """Лениво отдает пути к картинкам: рекурсивный обход папки или glob-шаблон"""
+    if pattern:
+        for path in glob.iglob(pattern, recursive=True):
+            if os.path.isfile(path):
+                yield path
+        return
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def load_processed_files(output_path):
+    """Файлы, которые уже есть в выходном JSONL (для продолжения после перезапуска)"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["file"])
+            except (json.JSONDecodeError, KeyError):
+                # Оборванная последняя строка: этот файл просто распознаем заново
+                continue
+    return done
+
+
+def recognize_directory(doc_type, output_path, input_dir=None, pattern=None, batch_size=4, workers=2, engine=None):
+    """Массовое распознавание: модель грузится один раз, результаты пишутся построчно в JSONL"""
+    engine = engine or OCREngine()
+    processor = engine.get(doc_type).processor
+
+    done = load_processed_files(output_path)
+    if done:
+        print(f"🔄 В {output_path} уже {len(done)} файлов, пропускаем их.")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    files = (path for path in iter_image_files(input_dir, pattern) if path not in done)
+    processed = 0
+
+    with open(output_path, "a", encoding="utf-8") as out_f:
+        for paths, pixel_values, failed in prefetch_batches(((p, p) for p in files), processor, batch_size, workers,
+                                                            orient=engine.orienter(doc_type)):
+            for path, e in failed:
+                print(f"❌ Ошибка открытия картинки {path}: {e}")
+
+            if pixel_values is None:
+                continue
+
+            started = time.perf_counter()
+            results = engine.generate(pixel_values, doc_type)
+            # Время пачки делим поровну между ее файлами
+            latency_ms = (time.perf_counter() - started) * 1000 / len(paths)
+
+            for path, fields in zip(paths, results):
+                out_f.write(json.dumps({
+                    "file": path,
+                    "doc_type": doc_type,
+                    "fields": fields,
+                    "latency": round(latency_ms, 1),
+                }, ensure_ascii=False) + "\n")
+            out_f.flush()
+
+            processed += len(paths)
+            print(f"✅ Распознано {processed} файлов (последняя пачка: {latency_ms:.0f} мс/файл)")
+
+    print(f"🎉 Готово! Новых файлов: {processed}. Результаты: {output_path}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Тестирование OCR моделей (Паспорт / Прописка)")
-    parser.add_argument('--image', type=str, required=True, help='Путь к тестовой картинке')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', type=str, help='Путь к тестовой картинке')
+    source.add_argument('--input-dir', type=str, help='Папка со сканами для массового распознавания')
+    source.add_argument('--glob', type=str, help='Glob-шаблон файлов, например "scans/**/*.jpg"')
     parser.add_argument('--type', type=str, choices=['passport', 'registration'], required=True, help='Тип документа')
+    parser.add_argument('--output', type=str, default='ocr_results.jsonl',
+                        help='Выходной JSONL для массового режима (уже распознанные файлы пропускаются)')
+    parser.add_argument('--batch-size', type=int, default=4, help='Размер пачки в массовом режиме')
+    parser.add_argument('--workers', type=int, default=2, help='Потоков для загрузки картинок в массовом режиме')
+    parser.add_argument('--int8', action='store_true', help='Использовать int8-модель (<модель>_int8, только CPU)')
+    parser.add_argument('--backend', type=str, choices=['torch', 'onnx'], default='torch',
+                        help='onnx - ONNX Runtime с KV-кэшем (<модель>_onnx, см. onnx_export.py)')
+    parser.add_argument('--schema-stop', action='store_true',
+                        help='Останавливать генерацию по схеме полей и при зацикливании, бюджет длины из схемы')
+    parser.add_argument('--auto-orient', action='store_true',
+                        help='Перед распознаванием ставить сканы ровно (0/90/180/270, см. orientation.py)')
+    add_warm_argument(parser)
 
     args = parser.parse_args()
-    recognize_document(args.image, args.type)
\ No newline at end of file
+    maybe_run_warm(args, __file__)
+
+    engine = OCREngine(quantized=args.int8, backend=args.backend, schema_stopping=args.schema_stop,
+                       auto_orient=args.auto_orient)
+    if args.image:
+        recognize_document(args.image, args.type, engine)
+    else:
+        recognize_directory(args.type, args.output, args.input_dir, args.glob, args.batch_size, args.workers, engine)
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+from image_pipeline import draft_request, load_image, processor_draft_size
+
+
+def donut_processor(height=1280, width=960):
+    return SimpleNamespace(image_processor=SimpleNamespace(size={"height": height, "width": width}))
+
+
+def test_draft_size_is_processor_shortest_edge():
+    assert processor_draft_size(donut_processor()) == 960
+
+
+def test_draft_request_keeps_aspect_ratio():
+    assert draft_request((4000, 3000), 960) == (1280, 960)
+    assert draft_request((800, 600), 960) is None
+
+
+def test_jpeg_scan_is_decoded_reduced(tmp_path):
+    path = tmp_path / "scan.jpg"
+    Image.new("RGB", (4000, 3000), (200, 200, 200)).save(path, quality=90)
+
+    image = load_image(str(path), processor_draft_size(donut_processor()))
+
+    # 1/2 еще покрывает 960 по меньшей стороне, 1/4 (750) уже нет
+    assert image.size == (2000, 1500)
+    assert min(image.size) >= 960
+
+
+def test_full_decode_without_draft_size(tmp_path):
+    path = tmp_path / "scan.jpg"
+    Image.new("RGB", (4000, 3000)).save(path)
+    assert load_image(str(path)).size == (4000, 3000)
@@ -0,0 +1,61 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from ocr_server import MicroBatcher, OCRRequestHandler, ServerMetrics
+
+
+class StubEngine:
+    """Вместо модели: запоминает размеры пачек и падает на типах из fail_types"""
+
+    def __init__(self, fail_types=()):
+        self.calls = []
+        self.fail_types = set(fail_types)
+
+    def generate(self, pixel_values, doc_type):
+        self.calls.append((doc_type, pixel_values.shape[0]))
+        if doc_type in self.fail_types:
+            raise RuntimeError(f"{doc_type} сломан")
+        return [{"doc_type": doc_type, "row": i} for i in range(pixel_values.shape[0])]
+
+
+def test_batcher_groups_requests_and_fails_whole_batch():
+    torch = pytest.importorskip("torch")
+    engine = StubEngine(fail_types={"registration"})
+    metrics = ServerMetrics()
+    batcher = MicroBatcher(engine, metrics, max_batch_size=8, max_wait_ms=200)
+    # Запросы лежат в очереди до старта потока - первый же _collect заберет их одним микробатчем
+    passports = [batcher.submit(torch.zeros(1, 3, 4, 4), "passport") for _ in range(3)]
+    registrations = [batcher.submit(torch.zeros(1, 3, 4, 4), "registration") for _ in range(2)]
+    batcher.start()
+
+    assert [f.result(timeout=5)["row"] for f in passports] == [0, 1, 2]
+    errors = [f.exception(timeout=5) for f in registrations]
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert errors[0] is errors[1]
+    assert sorted(engine.calls) == [("passport", 3), ("registration", 2)]
+    assert metrics.snapshot(0)["batch_size_histogram"] == {"2": 1, "3": 1}
+
+    # Упавшая пачка не останавливает поток батчей
+    assert batcher.submit(torch.zeros(1, 3, 4, 4), "passport").result(timeout=5) == {"doc_type": "passport", "row": 0}
+
+
+def resolve(root, path):
+    handler = SimpleNamespace(server=SimpleNamespace(image_root=os.path.realpath(root) if root else None))
+    return OCRRequestHandler._resolve_path(handler, path)
+
+
+def test_resolve_path_stays_inside_image_root(tmp_path):
+    root = tmp_path / "images"
+    root.mkdir()
+    (root / "scan.jpg").write_bytes(b"")
+    (tmp_path / "secret.txt").write_bytes(b"")
+
+    assert resolve(root, "scan.jpg") == os.path.realpath(root / "scan.jpg")
+    assert resolve(root, "../secret.txt") is None
+    assert resolve(root, str(tmp_path / "secret.txt")) is None
+    assert resolve(root, "/etc/passwd") is None
+    assert resolve(None, "scan.jpg") is None
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+
+from onnx_backend import OnnxDonutModel
+
+VOCAB = 32
+PAD, EOS = 1, 2
+
+
+class ChainDecoder:
+    """Фейковый декодер без KV-кэша: после токена t почти наверняка идет t + 1, реже t + 2"""
+
+    def run(self, output_names, feed):
+        last = feed["input_ids"][:, -1]
+        logits = np.zeros((len(last), 1, VOCAB), dtype=np.float32)
+        rows = np.arange(len(last))
+        logits[rows, 0, (last + 1) % VOCAB] = 10.0
+        logits[rows, 0, (last + 2) % VOCAB] = 5.0
+        return [logits]
+
+
+def fake_model():
+    model = OnnxDonutModel.__new__(OnnxDonutModel)
+    model.num_layers = 0
+    model.decoder = model.decoder_with_past = ChainDecoder()
+    model.with_past_inputs = {"input_ids", "encoder_hidden_states"}
+    return model
+
+
+def stop_after_five(input_ids, scores):
+    """Критерий, который срабатывает только для строк, дошедших до токена 5"""
+    return input_ids[:, -1] == 5
+
+
+def test_beam_search_stops_rows_individually():
+    prompt = np.array([[3], [10]], dtype=np.int64)
+    hidden = np.zeros((2, 1, 4), dtype=np.float32)
+    output = fake_model()._beam_search(hidden, prompt, max_length=8, num_beams=2, repetition_penalty=1.0,
+                                       length_penalty=1.0, eos_token_id=EOS, pad_token_id=PAD, bad_words_ids=None,
+                                       stopping_criteria=[stop_after_five])
+    # Первая строка закрыта eos сразу после 5, вторая дошла до max_length
+    assert output[0].tolist() == [3, 4, 5, EOS, PAD, PAD, PAD, PAD]
+    assert output[1].tolist() == list(range(10, 18))
+
+
+def test_greedy_stops_rows_individually():
+    prompt = np.array([[3], [10]], dtype=np.int64)
+    hidden = np.zeros((2, 1, 4), dtype=np.float32)
+    output = fake_model()._greedy(hidden, prompt, max_length=8, repetition_penalty=1.0, eos_token_id=EOS,
+                                  pad_token_id=PAD, bad_words_ids=None, stopping_criteria=[stop_after_five])
+    assert output[0].tolist() == [3, 4, 5, PAD, PAD, PAD, PAD, PAD]
+    assert output[1].tolist() == list(range(10, 18))
+
+
+def test_multi_token_bad_words_are_banned():
+    prompt = np.array([[3]], dtype=np.int64)
+    hidden = np.zeros((1, 1, 4), dtype=np.float32)
+    output = fake_model()._greedy(hidden, prompt, max_length=5, repetition_penalty=1.0, eos_token_id=EOS,
+                                  pad_token_id=PAD, bad_words_ids=[[4, 5]])
+    # После 4 запрещено 5 - модель берет следующий по вероятности токен
+    assert output[0].tolist() == [3, 4, 6, 7, 8]
+
+
+def test_generate_rejects_unsupported_arguments():
+    with pytest.raises(TypeError, match="no_repeat_ngram_size"):
+        fake_model().generate(decoder_input_ids=None, no_repeat_ngram_size=3)
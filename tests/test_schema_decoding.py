@@ -0,0 +1,16 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from schema_decoding import StoppedRowsEosProcessor
+
+
+def test_stopped_rows_can_only_emit_eos():
+    eos = 2
+    processor = StoppedRowsEosProcessor(lambda input_ids, scores: torch.tensor([True, False]), eos)
+    scores = torch.zeros(2, 5)
+    result = processor(torch.tensor([[0, 3], [0, 4]]), scores)
+    assert result[0].argmax().item() == eos
+    assert torch.isinf(result[0]).sum().item() == 4
+    assert torch.equal(result[1], scores[1])
@@ -0,0 +1,47 @@
+import os
+import json
+import socket
+import argparse
+
+import pytest
+
+import warm_worker
+
+
+def test_entry_point_allows_only_known_scripts():
+    here = os.path.dirname(os.path.realpath(warm_worker.__file__))
+    assert warm_worker._entry_point(os.path.join(here, "test_ocr.py")) == os.path.join(here, "test_ocr.py")
+    for script in ("/etc/passwd", os.path.join(here, "train_donut.py"), None):
+        with pytest.raises(ValueError):
+            warm_worker._entry_point(script)
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="нужны unix-сокеты")
+def test_read_request_times_out(monkeypatch):
+    monkeypatch.setattr(warm_worker, "REQUEST_TIMEOUT", 0.1)
+    server, client = socket.socketpair()
+    with server, client:
+        with pytest.raises(socket.timeout):
+            warm_worker._read_request(server)
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="нужны unix-сокеты")
+def test_read_request_rejects_foreign_script():
+    server, client = socket.socketpair()
+    with server, client:
+        client.sendall(json.dumps({"script": "/tmp/evil.py", "argv": [], "cwd": "/"}).encode("utf-8") + b"\n")
+        with pytest.raises(ValueError):
+            warm_worker._read_request(server)
+
+
+def test_maybe_run_warm_strips_flag(monkeypatch):
+    calls = []
+    monkeypatch.setattr(warm_worker, "run_in_worker", lambda script, argv: calls.append(argv) or 0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--type', type=str)
+    warm_worker.add_warm_argument(parser)
+    argv = ['--type', 'passport', '--wa']
+    with pytest.raises(SystemExit) as exit_info:
+        warm_worker.maybe_run_warm(parser.parse_args(argv), "test_ocr.py", argv)
+    assert exit_info.value.code == 0
+    assert calls == [['--type', 'passport']]
@@ -1,18 +1,30 @@
 import os
+import glob
 import json
 import argparse
 import torch
-import glob
-from torch.utils.data import Dataset
+import hashlib
+import random
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, Sampler
 from PIL import Image
 from transformers import DonutProcessor, VisionEncoderDecoderModel, VisionEncoderDecoderConfig
 from pytorch_lightning import LightningModule, Trainer
-from pytorch_lightning.callbacks import ModelCheckpoint
+from pytorch_lightning.callbacks import Callback, ModelCheckpoint
+from ocr_utils import clean_sequence, sequence_to_dict, score_sample, MetricsAccumulator
 
 # --- Базовые настройки (БЕЗОПАСНЫЕ ДЛЯ СТАРТА) ---
 MODEL_REPO = "naver-clova-ix/donut-base"
 MAX_LENGTH = 768
 IMAGE_SIZE = (1280, 960)  # Уменьшили для проверки!
+# Стартовые токены типов документов (task_prompt из DOCUMENT_GENERATORS в mixed_generation.py).
+# Поля в разметке - сырой JSON, отдельных токенов полей нет, так что регистрировать нужно только промпты.
+# Базовые два добавляются всегда; остальные - только если они есть в датасете или --task-prompt:
+# так словарь (и размер эмбеддингов) прежних запусков не меняется и их чекпоинты продолжают грузиться
+BASE_TASK_PROMPTS = ["<s_passport>", "<s_registration>"]
+TASK_PROMPTS = BASE_TASK_PROMPTS + ["<s_birth_certificate>"]
 
 # Ускорение для Tensor Cores
 torch.set_float32_matmul_precision('high')
@@ -43,7 +55,10 @@ class DonutDataset(Dataset):
 
         pixel_values = self.processor(image, return_tensors="pt").pixel_values
 
-        target_sequence = item["ground_truth"]
+        return pixel_values.squeeze(), self.get_labels(idx)
+
+    def get_labels(self, idx):
+        target_sequence = self.metadata[idx]["ground_truth"]
         input_ids = self.processor.tokenizer(
             target_sequence,
             add_special_tokens=False,
@@ -55,18 +70,357 @@ class DonutDataset(Dataset):
 
         labels = input_ids.clone()
         labels[labels == self.processor.tokenizer.pad_token_id] = -100
+        return labels.squeeze()
+
+
+class DonutValDataset(DonutDataset):
+    """Валидационный датасет: вместо labels отдает эталонный словарь полей"""
 
-        return pixel_values.squeeze(), labels.squeeze()
+    def __init__(self, dataset_path, processor, max_samples=None, seed=42):
+        super().__init__(dataset_path, processor)
+        # Берем фиксированную случайную подвыборку, чтобы валидация не съедала время обучения
+        if max_samples and max_samples < len(self.metadata):
+            self.metadata = random.Random(seed).sample(self.metadata, max_samples)
+            print(f"🎯 Для валидации отобрано {len(self.metadata)} примеров.")
+
+    def __getitem__(self, idx):
+        item = self.metadata[idx]
+        image_path = os.path.join(self.dataset_path, item["file_name"])
+        image = Image.open(image_path).convert("RGB")
+        pixel_values = self.processor(image, return_tensors="pt").pixel_values
+        return pixel_values.squeeze(), json.loads(item["ground_truth"])["gt_parse"]
+
+
+def collate_val_batch(batch):
+    pixel_values = torch.stack([pv for pv, _ in batch])
+    return pixel_values, [gt for _, gt in batch]
+
+
+def _encoder_fingerprint(encoder, dataset):
+    """
+    Отпечаток кэша: если поменялись веса энкодера, размер картинки или датасет (состав, размер и время
+    изменения файлов картинок) - кэш пересобирается. Веса хэшируются целиком: это доли секунды
+    против прогона энкодера по всему датасету, а частичная сумма пропускала дообученные слои.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([MODEL_REPO, list(IMAGE_SIZE)]).encode("utf-8"))
+    for item in dataset.metadata:
+        stat = os.stat(os.path.join(dataset.dataset_path, item["file_name"]))
+        h.update(f"{item['file_name']}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    for name, tensor in encoder.state_dict().items():
+        h.update(name.encode("utf-8"))
+        # Байты тензора без копии во float: view в uint8 работает для любого dtype
+        h.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+def build_encoder_cache(encoder, dataset, cache_dir, device, batch_size=4):
+    """
+    Один раз прогоняет все картинки датасета через замороженный энкодер и
+    сохраняет last_hidden_state в memory-mapped fp16 файл.
+    """
+    if len(dataset) == 0:
+        raise ValueError(f"Датасет {dataset.dataset_path} пуст: кэшировать энкодеру нечего")
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    data_path = os.path.join(cache_dir, "hidden_states.npy")
+    fingerprint = _encoder_fingerprint(encoder, dataset)
+
+    if os.path.exists(meta_path) and os.path.exists(data_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint and meta.get("complete"):
+            print(f"♻️ Кэш энкодера актуален: {data_path}")
+            return data_path
+        print("⚠️ Кэш энкодера устарел или недописан. Пересобираем...")
+        os.remove(meta_path)
+
+    encoder.to(device)
+    encoder.eval()
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+
+    cache = None
+    offset = 0
+    print(f"🧊 Строим кэш энкодера для {len(dataset)} картинок...")
+    with torch.no_grad():
+        for pixel_values, _ in loader:
+            hidden = encoder(pixel_values.to(device)).last_hidden_state
+            hidden = hidden.to(torch.float16).cpu().numpy()
+            if cache is None:
+                # Размер последовательности известен только после первого прохода
+                cache = np.lib.format.open_memmap(
+                    data_path, mode="w+", dtype=np.float16,
+                    shape=(len(dataset),) + hidden.shape[1:]
+                )
+            cache[offset:offset + len(hidden)] = hidden
+            offset += len(hidden)
+            print(f"    [{offset}/{len(dataset)}]")
+
+    cache.flush()
+    del cache
+
+    # meta.json пишем последним: пока его нет (или complete=False), кэш считается битым
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "size": len(dataset), "complete": True}, f)
+    print(f"✅ Кэш энкодера сохранен: {data_path}")
+    return data_path
+
+
+class CachedEncoderDataset(Dataset):
+    """Отдает готовые hidden states энкодера вместо картинок (режим --freeze-encoder)"""
+
+    def __init__(self, base_dataset, cache_path):
+        self.base_dataset = base_dataset
+        self.cache_path = cache_path
+        self.hidden_states = None
+        # Пустой или чужой кэш иначе всплыл бы IndexError где-то в воркере DataLoader
+        if not os.path.exists(cache_path):
+            raise FileNotFoundError(f"Кэш энкодера {cache_path} не найден: соберите его (build_encoder_cache)")
+        cached = np.load(cache_path, mmap_mode="r").shape[0]
+        if cached == 0 or cached != len(base_dataset):
+            raise ValueError(f"Кэш энкодера {cache_path} содержит {cached} записей, а датасет - {len(base_dataset)}. "
+                             f"Удалите папку кэша, чтобы он пересобрался")
+
+    def __len__(self):
+        return len(self.base_dataset)
+
+    def __getitem__(self, idx):
+        # Открываем memmap лениво, чтобы он корректно работал и в воркерах DataLoader
+        if self.hidden_states is None:
+            self.hidden_states = np.load(self.cache_path, mmap_mode="r")
+        hidden = torch.from_numpy(np.array(self.hidden_states[idx], dtype=np.float32))
+        return hidden, self.base_dataset.get_labels(idx)
+
+
+class ResumableRandomSampler(Sampler):
+    """
+    Детерминированный shuffle (seed + номер эпохи), который умеет стартовать
+    с середины эпохи. Позиция хранится в манифесте чекпоинтов.
+    """
+
+    def __init__(self, data_len, seed=42):
+        self.data_len = data_len
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+        # Lightning передает в set_epoch номер эпохи текущего запуска, а не абсолютный
+        self.epoch_offset = 0
+
+    def resume(self, epoch, position):
+        if position >= self.data_len:
+            epoch, position = epoch + 1, 0
+        self.epoch = epoch
+        self.epoch_offset = epoch
+        self.start_index = position
+
+    def set_epoch(self, epoch):
+        epoch = self.epoch_offset + epoch
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self.start_index = 0
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.data_len, generator=g).tolist()
+        return iter(order[self.start_index:])
+
+    def __len__(self):
+        # Полную длину отдаем намеренно: укороченная первая эпоха просто раньше закончит итерацию,
+        # а Lightning не обрежет последующие эпохи
+        return self.data_len
+
+
+def _capture_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _to_cpu(obj):
+    """Глубокая копия тензоров на CPU, чтобы обучение могло идти дальше, пока поток пишет файл"""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _atomic_write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_manifest(checkpoint_dir):
+    manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {"checkpoints": []}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_epoch_checkpoint(checkpoint_dir):
+    """Последний .ckpt от ModelCheckpoint: запуски до появления шаговых чекпоинтов продолжаются по нему"""
+    checkpoints = glob.glob(os.path.join(checkpoint_dir, "*.ckpt"))
+    return max(checkpoints, key=os.path.getctime) if checkpoints else None
+
+
+def _grad_scaler(trainer):
+    """GradScaler при precision="16-mixed" (иначе None): его масштаб тоже нужно переносить между запусками"""
+    plugin = getattr(trainer.strategy, "precision_plugin", None)
+    return getattr(plugin, "scaler", None)
+
+
+def find_resume_checkpoint(checkpoint_dir):
+    """Последний чекпоинт по манифесту (а не по времени создания файла)"""
+    for entry in reversed(load_manifest(checkpoint_dir)["checkpoints"]):
+        path = os.path.join(checkpoint_dir, entry["file"])
+        if os.path.exists(path):
+            return path, entry
+        print(f"⚠️ Чекпоинт из манифеста не найден на диске: {path}")
+    return None, None
+
+
+class AsyncStepCheckpoint(Callback):
+    """
+    Сохраняет чекпоинт каждые N шагов в фоновом потоке.
+    Файл пишется во временный и атомарно переименовывается, затем обновляется manifest.json.
+    Хранятся только последние keep_last чекпоинтов.
+    """
+
+    def __init__(self, checkpoint_dir, every_n_steps=500, keep_last=3):
+        self.checkpoint_dir = checkpoint_dir
+        self.every_n_steps = every_n_steps
+        self.keep_last = keep_last
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.lock = threading.Lock()
+        # Состояние, восстановленное из чекпоинта (шаг, эпоха, оптимизатор, RNG)
+        self.resume_payload = None
+
+    def on_train_start(self, trainer, pl_module):
+        payload = self.resume_payload
+        if payload is None:
+            return
+        trainer.optimizers[0].load_state_dict(payload["optimizer"])
+        scaler = _grad_scaler(trainer)
+        if scaler is not None and payload.get("scaler"):
+            scaler.load_state_dict(payload["scaler"])
+        _restore_rng_state(payload["rng"])
+        print(f"🔄 Восстановлены оптимизатор и RNG (шаг {payload['global_step']})")
+
+    def _global_step(self, trainer):
+        base = self.resume_payload["global_step"] if self.resume_payload else 0
+        return base + trainer.global_step
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        global_step = self._global_step(trainer)
+        if global_step == 0 or global_step % self.every_n_steps != 0:
+            return
+
+        sampler = pl_module.sampler
+        # Позиция в эпохе с учетом того, что первая эпоха после resume начинается не с нуля
+        position = sampler.start_index + (batch_idx + 1) * pl_module.batch_size
+        epoch = sampler.epoch
+        if position >= len(sampler):
+            epoch, position = epoch + 1, 0
+        scaler = _grad_scaler(trainer)
+        payload = {
+            "model": _to_cpu(pl_module.model.state_dict()),
+            "optimizer": _to_cpu(trainer.optimizers[0].state_dict()),
+            "rng": _capture_rng_state(),
+            "scaler": scaler.state_dict() if scaler is not None else None,
+            "global_step": global_step,
+            "epoch": epoch,
+            "position": position,
+        }
+
+        # Не копим снимки в памяти: если прошлое сохранение еще идет - дожидаемся его
+        self.wait()
+        self.pending = self.executor.submit(self._write, payload)
+
+    def _write(self, payload):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        filename = f"step-{payload['global_step']:08d}.ckpt"
+        path = os.path.join(self.checkpoint_dir, filename)
+        tmp_path = path + ".tmp"
+        torch.save(payload, tmp_path)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            manifest = load_manifest(self.checkpoint_dir)
+            entries = [e for e in manifest["checkpoints"] if e["file"] != filename]
+            entries.append({
+                "file": filename,
+                "global_step": payload["global_step"],
+                "epoch": payload["epoch"],
+                "position": payload["position"],
+            })
+            stale, entries = entries[:-self.keep_last], entries[-self.keep_last:]
+            _atomic_write_json(os.path.join(self.checkpoint_dir, "manifest.json"), {"checkpoints": entries})
+
+        # Удаляем старые файлы только после того, как манифест на них больше не ссылается
+        for entry in stale:
+            stale_path = os.path.join(self.checkpoint_dir, entry["file"])
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        print(f"💾 Чекпоинт шага {payload['global_step']} сохранен: {path}")
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def on_train_end(self, trainer, pl_module):
+        self.wait()
+        self.executor.shutdown(wait=True)
 
 
 class DonutModule(LightningModule):
-    def __init__(self, processor, model, lr, dataset_path, batch_size):
+    def __init__(self, processor, model, lr, dataset_path, batch_size, encoder_cache=None,
+                 val_dataset_path=None, val_samples=64, val_max_length=384, task_prompt="<s_passport>",
+                 val_batch_size=4):
         super().__init__()
         self.processor = processor
         self.model = model
         self.lr = lr
         self.dataset_path = dataset_path
         self.batch_size = batch_size
+        # Путь к кэшу hidden states. Если задан - обучаем только декодер
+        self.encoder_cache = encoder_cache
+        self.sampler = None
+        # (epoch, position), с которых продолжить обучение
+        self.resume_position = None
+        # Настройки валидации во время обучения
+        self.val_dataset_path = val_dataset_path
+        self.val_samples = val_samples
+        self.val_max_length = val_max_length
+        # Валидация - это generate без градиентов: ее пачка не связана с обучающей и обычно больше
+        self.val_batch_size = val_batch_size
+        self.task_prompt = task_prompt
+        self.prompt_ids = processor.tokenizer(
+            task_prompt, add_special_tokens=False, return_tensors="pt"
+        ).input_ids
+        self.val_metrics = MetricsAccumulator()
 
     def setup(self, stage=None):
         print("⚙️ Lightning Module: Вызван setup() - Подготовка к обучению...")
@@ -78,31 +432,113 @@ class DonutModule(LightningModule):
         if batch_idx == 0:
             print("🚀 ПЕРВЫЙ БАТЧ ДОШЕЛ ДО GPU! Начинаем вычисления...")
 
-        pixel_values, labels = batch
-        outputs = self.model(pixel_values, labels=labels)
+        if self.encoder_cache:
+            hidden_states, labels = batch
+            # Кортеж VisionEncoderDecoderModel сам завернет в BaseModelOutput и пропустит энкодер
+            outputs = self.model(encoder_outputs=(hidden_states,), labels=labels)
+        else:
+            pixel_values, labels = batch
+            outputs = self.model(pixel_values, labels=labels)
         loss = outputs.loss
         self.log("train_loss", loss, prog_bar=True)
         return loss
 
+    def on_validation_epoch_start(self):
+        self.val_metrics = MetricsAccumulator()
+
+    def validation_step(self, batch, batch_idx):
+        pixel_values, truth_dicts = batch
+        tokenizer = self.processor.tokenizer
+        decoder_input_ids = self.prompt_ids.to(self.device).repeat(len(truth_dicts), 1)
+
+        # Жадное декодирование с урезанной длиной: нам нужна оценка качества, а не лучший ответ
+        with torch.no_grad():
+            sequences = self.model.generate(
+                pixel_values,
+                decoder_input_ids=decoder_input_ids,
+                max_length=self.val_max_length,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                use_cache=True,
+                num_beams=1,
+                do_sample=False,
+                bad_words_ids=[[tokenizer.unk_token_id]],
+            )
+
+        for sequence, truth_dict in zip(self.processor.batch_decode(sequences), truth_dicts):
+            predicted_dict = sequence_to_dict(self.processor, clean_sequence(self.processor, sequence, self.task_prompt))
+            self.val_metrics.add(score_sample(truth_dict, predicted_dict))
+
+    def on_validation_epoch_end(self):
+        summary = self.val_metrics.summary()
+        if not summary["documents"]:
+            return
+        for field, metrics in summary["fields"].items():
+            self.log(f"val_cer/{field}", metrics["cer"])
+            self.log(f"val_exact/{field}", metrics["exact_match"])
+        self.log("val_cer", summary["cer"], prog_bar=True)
+        self.log("val_exact", summary["exact_match"], prog_bar=True)
+
     def configure_optimizers(self):
         print("⚙️ Настройка оптимизатора Adam...")
-        return torch.optim.Adam(self.model.parameters(), lr=self.lr)
+        params = [p for p in self.model.parameters() if p.requires_grad]
+        return torch.optim.Adam(params, lr=self.lr)
 
     def train_dataloader(self):
         print("⚙️ Создание DataLoader...")
         train_dataset = DonutDataset(self.dataset_path, self.processor)
+        if self.encoder_cache:
+            train_dataset = CachedEncoderDataset(train_dataset, self.encoder_cache)
+        self.sampler = ResumableRandomSampler(len(train_dataset))
+        if self.resume_position:
+            self.sampler.resume(*self.resume_position)
         # ВАЖНО: num_workers=0 предотвращает тихое зависание в виртуалках!
         return torch.utils.data.DataLoader(
             train_dataset,
             batch_size=self.batch_size,
-            shuffle=True,
+            sampler=self.sampler,
             num_workers=0,
             pin_memory=True
         )
 
+    def val_dataloader(self):
+        if not self.val_dataset_path:
+            return []
+        val_dataset = DonutValDataset(self.val_dataset_path, self.processor, max_samples=self.val_samples)
+        return torch.utils.data.DataLoader(
+            val_dataset,
+            batch_size=self.val_batch_size,
+            shuffle=False,
+            num_workers=0,
+            collate_fn=collate_val_batch
+        )
+
+
+def task_prompts_in(*dataset_paths):
+    """Промпты, которыми размечены сэмплы датасетов (поле task_prompt в metadata.jsonl от mixed_generation.py)"""
+    prompts = set()
+    for dataset_path in dataset_paths:
+        metadata_file = os.path.join(dataset_path or "", "metadata.jsonl")
+        if not dataset_path or not os.path.exists(metadata_file):
+            continue
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            prompts.update(json.loads(line).get("task_prompt") for line in f if line.strip())
+    prompts.discard(None)
+    return prompts
+
+
+def special_task_prompts(used_prompts):
+    """Список для additional_special_tokens; незарегистрированный промпт - ошибка, а не молча разбитый на кусочки токен"""
+    unknown = sorted(set(used_prompts) - set(TASK_PROMPTS))
+    if unknown:
+        raise ValueError(f"Промпты {', '.join(unknown)} не зарегистрированы: добавьте их в TASK_PROMPTS (train_donut.py)")
+    return BASE_TASK_PROMPTS + [p for p in TASK_PROMPTS if p not in BASE_TASK_PROMPTS and p in used_prompts]
+
 
 def main(args):
     print(f"🔧 Инициализация обучения для датасета: {args.dataset}")
+    used_prompts = {args.task_prompt} | task_prompts_in(args.dataset, args.val_dataset)
+    special_tokens = special_task_prompts(used_prompts)
 
     print("⏳ Загрузка конфигурации модели...")
     config = VisionEncoderDecoderConfig.from_pretrained(MODEL_REPO)
@@ -114,48 +550,90 @@ def main(args):
     model = VisionEncoderDecoderModel.from_pretrained(MODEL_REPO, config=config)
 
     processor.tokenizer.pad_token = processor.tokenizer.unk_token
-    processor.tokenizer.add_special_tokens({"additional_special_tokens": ["<s_passport>", "<s_registration>"]})
+    processor.tokenizer.add_special_tokens({"additional_special_tokens": special_tokens})
     model.decoder.resize_token_embeddings(len(processor.tokenizer))
 
     model.config.pad_token_id = processor.tokenizer.pad_token_id
     model.config.decoder_start_token_id = processor.tokenizer.convert_tokens_to_ids(["<s_passport>"])[0]
 
-    module = DonutModule(processor, model, args.lr, args.dataset, args.batch)
-
+    # Ищем последний чекпоинт по манифесту. Грузим веса до построения кэша энкодера,
+    # чтобы отпечаток кэша считался по актуальным весам
     checkpoint_dir = os.path.join("checkpoints", args.name)
+    start_epoch = 0
+    resume_payload = None
+    epoch_checkpoint = None
+    resume_path, resume_entry = find_resume_checkpoint(os.path.join(checkpoint_dir, "steps"))
+    if resume_path:
+        print(f"🔄 Найден чекпоинт: {resume_path} (шаг {resume_entry['global_step']}). Продолжаем обучение!")
+        resume_payload = torch.load(resume_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(resume_payload["model"])
+        start_epoch = resume_payload["epoch"]
+    else:
+        # Шаговых чекпоинтов нет - продолжаем по чекпоинту эпохи, как раньше (Lightning сам восстановит все)
+        epoch_checkpoint = find_epoch_checkpoint(checkpoint_dir)
+        if epoch_checkpoint:
+            print(f"🔄 Найден чекпоинт эпохи: {epoch_checkpoint}. Продолжаем обучение!")
+
+    output_model_dir = os.path.join("models_ready", args.name)
+    if start_epoch >= args.epochs:
+        # max_epochs=0 или меньше Lightning понимает как "без ограничения" - просто выгружаем готовые веса
+        print(f"✅ Обучение уже завершено ({start_epoch}/{args.epochs} эпох), сохраняем веса из чекпоинта")
+        os.makedirs(output_model_dir, exist_ok=True)
+        model.save_pretrained(output_model_dir)
+        processor.save_pretrained(output_model_dir)
+        return
+
+    encoder_cache = None
+    if args.freeze_encoder:
+        print("🧊 Режим замороженного энкодера: обучаем только декодер")
+        model.encoder.requires_grad_(False)
+        model.encoder.eval()
+        cache_dir = args.encoder_cache or os.path.join("encoder_cache", args.name)
+        device = "cuda" if args.accelerator == "gpu" and torch.cuda.is_available() else "cpu"
+        encoder_cache = build_encoder_cache(
+            model.encoder, DonutDataset(args.dataset, processor), cache_dir, device
+        )
+
+    module = DonutModule(
+        processor, model, args.lr, args.dataset, args.batch, encoder_cache,
+        val_dataset_path=args.val_dataset, val_samples=args.val_samples,
+        val_max_length=args.val_max_length, task_prompt=args.task_prompt, val_batch_size=args.val_batch
+    )
+
     checkpoint_callback = ModelCheckpoint(
         dirpath=checkpoint_dir,
         filename="donut-{epoch:02d}-{train_loss:.2f}",
         save_top_k=1,
         monitor="train_loss"
     )
+    step_checkpoint = AsyncStepCheckpoint(
+        os.path.join(checkpoint_dir, "steps"), every_n_steps=args.ckpt_every, keep_last=args.keep_last
+    )
+    step_checkpoint.resume_payload = resume_payload
+    if resume_payload:
+        module.resume_position = (resume_payload["epoch"], resume_payload["position"])
 
     print("⏳ Инициализация Trainer...")
     trainer = Trainer(
-        accelerator="gpu",
+        accelerator=args.accelerator,
         devices=1,
         ##strategy="single_device",
-        max_epochs=args.epochs,
-        precision="16-mixed",  # БЕЗОПАСНАЯ ТОЧНОСТЬ
-        callbacks=[checkpoint_callback],
+        max_epochs=args.epochs - start_epoch,
+        precision="16-mixed" if args.accelerator == "gpu" else "32-true",  # БЕЗОПАСНАЯ ТОЧНОСТЬ
+        callbacks=[checkpoint_callback, step_checkpoint],
         gradient_clip_val=1.0,
-        num_sanity_val_steps=0
+        num_sanity_val_steps=0,
+        # Валидация по шагам, а не по эпохам; без --val-dataset она полностью отключена
+        val_check_interval=args.val_every if args.val_dataset else None,
+        check_val_every_n_epoch=None if args.val_dataset else 1,
+        limit_val_batches=1.0 if args.val_dataset else 0
     )
 
     print(f"🚀 Передаем управление в PyTorch Lightning. Ждем старта эпох...")
 
-    # Ищем последний сохраненный чекпоинт в папке модели
-    latest_checkpoint = None
-    if os.path.exists(checkpoint_dir):
-        checkpoints = glob.glob(os.path.join(checkpoint_dir, "*.ckpt"))
-        if checkpoints:
-            latest_checkpoint = max(checkpoints, key=os.path.getctime)
-            print(f"🔄 Найден чекпоинт: {latest_checkpoint}. Продолжаем обучение!")
+    # По манифесту веса, оптимизатор и позиция в данных уже восстановлены, ckpt_path нужен только чекпоинту эпохи
+    trainer.fit(module, ckpt_path=epoch_checkpoint)
 
-    # Запускаем обучение, передавая путь к чекпоинту (если он есть)
-    trainer.fit(module, ckpt_path=latest_checkpoint)
-
-    output_model_dir = os.path.join("models_ready", args.name)
     os.makedirs(output_model_dir, exist_ok=True)
     model.save_pretrained(output_model_dir)
     processor.save_pretrained(output_model_dir)
@@ -169,6 +647,20 @@ if __name__ == "__main__":
     parser.add_argument('--epochs', type=int, default=10)
     parser.add_argument('--batch', type=int, default=1)  # Дефолт теперь 1
     parser.add_argument('--lr', type=float, default=3e-5)
+    parser.add_argument('--accelerator', type=str, choices=['gpu', 'cpu'], default='gpu')
+    parser.add_argument('--freeze-encoder', action='store_true',
+                        help='Заморозить энкодер и обучать только декодер на кэшированных hidden states')
+    parser.add_argument('--encoder-cache', type=str, default=None,
+                        help='Папка для кэша энкодера (по умолчанию encoder_cache/<name>)')
+    parser.add_argument('--ckpt-every', type=int, default=500, help='Сохранять чекпоинт каждые N шагов')
+    parser.add_argument('--keep-last', type=int, default=3, help='Сколько последних чекпоинтов хранить')
+    parser.add_argument('--val-dataset', type=str, default=None,
+                        help='Папка валидации (например dataset/val_passport). Без нее валидация отключена')
+    parser.add_argument('--val-every', type=int, default=1000, help='Валидировать каждые N шагов')
+    parser.add_argument('--val-samples', type=int, default=64, help='Размер случайной подвыборки валидации')
+    parser.add_argument('--val-batch', type=int, default=4, help='Размер пачки генерации при валидации')
+    parser.add_argument('--val-max-length', type=int, default=384, help='Максимальная длина генерации при валидации')
+    parser.add_argument('--task-prompt', type=str, default='<s_passport>', help='Стартовый токен для генерации')
 
     args = parser.parse_args()
     main(args)
\ No newline at end of file
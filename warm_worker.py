@@ -0,0 +1,306 @@
+import io
+import os
+import sys
+import json
+import time
+import runpy
+import socket
+import struct
+import argparse
+import tempfile
+import traceback
+
+# Протокол: клиент шлет одну JSON-строку {"script", "argv", "cwd"}, воркер форкается,
+# дочерний процесс пишет stdout/stderr скрипта прямо в сокет и в конце EXIT_MARKER + код возврата
+EXIT_MARKER = b"\x00exit:"
+# Воркер выполняет только эти скрипты из своей папки: сокет не должен превращаться в запуск произвольного кода
+ENTRY_POINTS = ("test_ocr.py", "evaluate_models.py")
+# Сколько ждать строку запроса после accept и ее предельный размер
+REQUEST_TIMEOUT = 5.0
+MAX_REQUEST_BYTES = 1024 * 1024
+
+
+def default_socket():
+    """
+    Путь к сокету по умолчанию или None там, где нет fork и AF_UNIX (Windows): тогда воркер недоступен.
+    Сокет лежит в личной папке пользователя (0700), чтобы другие пользователи машины не могли к нему подключиться.
+    """
+    if not (hasattr(os, "getuid") and hasattr(os, "fork") and hasattr(socket, "AF_UNIX")):
+        return None
+    return os.environ.get("DONUT_WARM_WORKER", os.path.join(_socket_dir(), "worker.sock"))
+
+
+def _socket_dir():
+    return os.path.join(tempfile.gettempdir(), f"donut_warm_worker_{os.getuid()}")
+
+
+def _private_dir(path):
+    """Создает папку сокета с правами 0700 и проверяет, что она наша: в общий /tmp ее мог подложить кто-то другой"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if info.st_uid != os.getuid() or not os.path.isdir(path) or os.path.islink(path):
+        raise RuntimeError(f"Папка сокета {path} принадлежит другому пользователю")
+    os.chmod(path, 0o700)
+
+
+def _peer_uid(conn):
+    """uid процесса на другом конце сокета (SO_PEERCRED) или None, если платформа этого не умеет"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def _entry_point(script):
+    """Абсолютный путь к разрешенному скрипту или ValueError для всего остального"""
+    here = os.path.dirname(os.path.realpath(__file__))
+    allowed = {os.path.join(here, name) for name in ENTRY_POINTS}
+    path = os.path.realpath(script) if isinstance(script, str) else None
+    if path not in allowed:
+        raise ValueError(f"скрипт {script!r} не входит в {', '.join(ENTRY_POINTS)}")
+    return path
+
+
+def add_warm_argument(parser):
+    """Флаг --warm для CLI-скриптов из ENTRY_POINTS"""
+    parser.add_argument('--warm', action='store_true',
+                        help='Выполнить в запущенном warm worker (python warm_worker.py serve), иначе как обычно')
+
+
+def maybe_run_warm(args, script, argv=None):
+    """
+    С --warm выполняет скрипт в воркере и завершает процесс его кодом возврата. Если воркер не запущен,
+    возвращается, и вызывающий работает сам. Флаг из argv убирает argparse, а не сравнение строк,
+    так что сокращения вроде --wa тоже не уходят в воркер.
+    """
+    if not args.warm:
+        return
+    flag_parser = argparse.ArgumentParser(add_help=False)
+    add_warm_argument(flag_parser)
+    _, rest = flag_parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    code = run_in_worker(script, rest)
+    if code is not None:
+        sys.exit(code)
+    print("⚠️ Warm worker не запущен, выполняем в текущем процессе")
+
+
+def warm_imports():
+    """Импортирует все тяжелое, что нужно CLI-скриптам; после fork это уже лежит в sys.modules"""
+    started = time.perf_counter()
+    import numpy  # noqa: F401
+    import cv2  # noqa: F401
+    import torch  # noqa: F401
+    from transformers import DonutProcessor, VisionEncoderDecoderModel, StoppingCriteriaList  # noqa: F401
+    from faker import Faker
+    import ocr_engine  # noqa: F401
+    import quantize_model  # noqa: F401
+    import schema_decoding  # noqa: F401
+    # Сам экземпляр Faker в скриптах создается заново, но провайдеры ru_RU уже будут импортированы
+    Faker('ru_RU')
+    print(f"🔥 Библиотеки загружены за {time.perf_counter() - started:.1f} с")
+
+
+def _run_child(conn, request):
+    """Выполняется в дочернем процессе: запускает скрипт как __main__ с выводом в сокет"""
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", buffering=0), encoding="utf-8", line_buffering=True)
+        sys.stderr = io.TextIOWrapper(os.fdopen(2, "wb", buffering=0), encoding="utf-8", line_buffering=True)
+
+        script = request["script"]
+        sys.argv = [script] + request["argv"]
+        sys.path[0] = os.path.dirname(script)
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int) or e.code is None:
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(EXIT_MARKER + str(code).encode("ascii"))
+        conn.close()
+    return code
+
+
+def _read_request(conn):
+    """
+    Читает строку запроса с таймаутом (socket.timeout - это OSError, соединение закрывает вызывающий)
+    и проверяет ее: только скрипты из ENTRY_POINTS, argv - список строк.
+    """
+    conn.settimeout(REQUEST_TIMEOUT)
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST_BYTES:
+            raise ValueError("слишком длинный запрос")
+    conn.settimeout(None)
+    request = json.loads(data.decode("utf-8"))
+    if not isinstance(request, dict):
+        raise ValueError("запрос должен быть объектом")
+    argv, cwd = request.get("argv"), request.get("cwd")
+    if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv) or not isinstance(cwd, str):
+        raise ValueError("argv должен быть списком строк, cwd - строкой")
+    return {"script": _entry_point(request.get("script")), "argv": argv, "cwd": cwd}
+
+
+def serve(socket_path=None, preload_types=(), quantized=False, backend="torch"):
+    """
+    Держит прогретый интерпретатор и на каждый запрос делает fork: состояние скриптов не протекает
+    между запусками, а импорты и предзагруженные модели достаются дочерним процессам бесплатно.
+    Работает только на Unix (fork и AF_UNIX). Сокет доступен только владельцу (папка 0700, сокет 0600,
+    uid собеседника сверяется через SO_PEERCRED там, где он есть), выполняются только скрипты из ENTRY_POINTS.
+    """
+    socket_path = socket_path or default_socket()
+    if socket_path is None:
+        raise RuntimeError("Warm worker нужны fork и unix-сокеты, на этой платформе их нет")
+    warm_imports()
+    if preload_types:
+        import ocr_engine
+        # Только CPU: CUDA-контекст не переживает fork
+        ocr_engine.preload(preload_types, device="cpu", quantized=quantized, backend=backend)
+        print(f"🧠 Предзагружены модели: {', '.join(preload_types)}")
+
+    # Свою папку по умолчанию создаем 0700; для пути из --socket/DONUT_WARM_WORKER папку выбирает пользователь,
+    # там остаются права 0600 на сокет и проверка uid
+    if os.path.dirname(os.path.abspath(socket_path)) == _socket_dir():
+        _private_dir(_socket_dir())
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    # Права на сам сокет - до listen, чтобы не было окна, когда подключиться может кто угодно
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    server.settimeout(1.0)
+    print(f"🚀 Warm worker слушает {socket_path} (Ctrl+C для остановки)")
+
+    try:
+        while True:
+            # Подбираем завершившиеся дочерние процессы, чтобы не копить зомби
+            try:
+                while os.waitpid(-1, os.WNOHANG)[0]:
+                    pass
+            except ChildProcessError:
+                pass
+
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+
+            peer_uid = _peer_uid(conn)
+            if peer_uid is not None and peer_uid != os.getuid():
+                print(f"❌ Отклонено подключение от чужого пользователя (uid {peer_uid})")
+                conn.close()
+                continue
+
+            try:
+                request = _read_request(conn)
+            except (OSError, ValueError) as e:
+                print(f"❌ Некорректный запрос: {e}")
+                conn.close()
+                continue
+
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                os._exit(_run_child(conn, request))
+            conn.close()
+            print(f"▶️ [{pid}] {request['script']} {' '.join(request['argv'])}")
+    except KeyboardInterrupt:
+        print("\n🛑 Warm worker остановлен")
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def run_in_worker(script, argv, socket_path=None):
+    """
+    Выполняет скрипт в запущенном warm worker и транслирует его вывод.
+    Возвращает код возврата или None, если воркер не запущен или платформа его не поддерживает
+    (тогда вызывающий работает сам).
+    """
+    socket_path = socket_path or default_socket()
+    if socket_path is None:
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+
+    request = {"script": os.path.abspath(script), "argv": list(argv), "cwd": os.getcwd()}
+    client.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    out = sys.stdout.buffer
+    pending = b""
+    code = None
+    with client:
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            pending += chunk
+            if code is None:
+                marker = pending.find(EXIT_MARKER)
+                if marker >= 0:
+                    out.write(pending[:marker])
+                    pending = pending[marker + len(EXIT_MARKER):]
+                    code = b""
+                else:
+                    # Хвост придерживаем: в нем может оказаться начало маркера
+                    keep = len(EXIT_MARKER) - 1
+                    out.write(pending[:-keep])
+                    pending = pending[-keep:]
+                out.flush()
+            if code is not None:
+                code += pending
+                pending = b""
+
+    if code is None:
+        out.write(pending)
+        out.flush()
+        print("❌ Warm worker оборвал соединение", file=sys.stderr)
+        return 1
+    return int(code or b"1")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Прогретый процесс для быстрых повторных запусков CLI")
+    parser.add_argument('--socket', type=str, default=None, help='Путь к unix-сокету воркера')
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Запустить воркер")
+    serve_parser.add_argument('--preload', type=str, nargs='*', default=[],
+                              help='Типы документов, модели которых загрузить заранее (только CPU)')
+    serve_parser.add_argument('--int8', action='store_true', help='Предзагружать int8-модели')
+    serve_parser.add_argument('--backend', type=str, choices=['torch', 'onnx'], default='torch')
+
+    run_parser = commands.add_parser("run", help="Выполнить скрипт в запущенном воркере")
+    run_parser.add_argument('script', type=str, help='Скрипт, например test_ocr.py')
+    run_parser.add_argument('args', nargs=argparse.REMAINDER, help='Аргументы скрипта')
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.socket, args.preload, args.int8, args.backend)
+    else:
+        code = run_in_worker(args.script, args.args, args.socket)
+        if code is None:
+            print(f"❌ Warm worker не запущен ({args.socket or default_socket()}). Запустите: python warm_worker.py serve")
+            code = 1
+        sys.exit(code)